@@ -1,36 +1,143 @@
-from fastapi import APIRouter, HTTPException, Request, Depends
-from sqlalchemy.orm import Session
-from app.core.database import get_db
-from app.services.queue_service import add_to_queue
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.security import HTTPBasic, HTTPBasicCredentials
+from sqlalchemy import text
+from fastapi.concurrency import run_in_threadpool
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.metrics import render_metrics, CONTENT_TYPE
+from app.services.queue_service import add_batch_to_queue, parse_upsert
+from app.services.dedup_service import recent_message_ids
+from app.services.user_cache import notify_user_changed
 import logging
+import secrets
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# Alterado: Operações administrativas usam as mesmas credenciais do dashboard (HTTP Basic)
+admin_security = HTTPBasic()
+
+def require_admin(credentials: HTTPBasicCredentials = Depends(admin_security)):
+    user_ok = secrets.compare_digest(credentials.username.encode("utf-8"), settings.DASHBOARD_USER.encode("utf-8"))
+    password_ok = secrets.compare_digest(credentials.password.encode("utf-8"), settings.DASHBOARD_PASSWORD.encode("utf-8"))
+    if not (user_ok and password_ok):
+        raise HTTPException(status_code=401, detail="Credenciais inválidas", headers={"WWW-Authenticate": "Basic"})
+
+def drop_recent_duplicates(messages: list) -> list:
+    """
+    Alterado: Descarta, antes de ir ao banco, mensagens cujo key.id já foi enfileirado
+    recentemente por este processo (ou que se repetem no mesmo webhook).
+
+    messages: pares (payload, envelope) de parse_upsert
+    """
+    fresh = []
+    batch_ids = set()
+    for message in messages:
+        message_id = message[1].evolution_id
+        if message_id:
+            if message_id in batch_ids or recent_message_ids.seen(message_id):
+                continue
+            batch_ids.add(message_id)
+        fresh.append(message)
+
+    duplicates = len(messages) - len(fresh)
+    if duplicates:
+        recent_message_ids.count(memory_duplicates=duplicates)
+        logger.info(f"{duplicates} mensagem(ns) reentregue(s) descartada(s) antes do banco")
+    return fresh
+
+def enqueue_messages(messages: list):
+    # Executa fora do event loop (threadpool): a sessão do SQLAlchemy é síncrona
+    # Alterado: Cada payload é interpretado uma única vez (MessageEnvelope); o envelope
+    # segue para a deduplicação, para a fila e é gravado para o worker
+    parsed = []
+    for payload in messages:
+        envelope = parse_upsert(payload)
+        if envelope is not None:
+            parsed.append((payload, envelope))
+    parsed = drop_recent_duplicates(parsed)
+    with SessionLocal() as db:
+        item_ids = add_batch_to_queue(db, parsed)
+
+    # Só depois do commit: se a inserção falhar, a reentrega ainda é aceita
+    recent_message_ids.remember(envelope.evolution_id for _, envelope in parsed if envelope.evolution_id)
+    return item_ids
+
 @router.post("/webhook/evolution")
-async def receive_webhook(request: Request, db: Session = Depends(get_db)):
+async def receive_webhook(request: Request):
     try:
         payload = await request.json()
-        logger.info(f"Webhook recebido: {payload}")
-        
+
         # O payload da Evolution vem como uma lista normalmente
-        if isinstance(payload, list):
-            logger.info("Processando lista de mensagens...")
-            for message in payload:
-                item = add_to_queue(db, message)
-                if item:
-                     logger.info(f"Item salvo na fila com ID: {item.id}")
-                else:
-                     logger.warning("Item ignorado (evento incorreto?)")
-        else:
-            logger.info("Processando mensagem única...")
-            item = add_to_queue(db, payload)
-            if item:
-                 logger.info(f"Item salvo na fila com ID: {item.id}")
-            else:
-                 logger.warning("Item ignorado (evento incorreto?)")
-            
+        messages = payload if isinstance(payload, list) else [payload]
+
+        # Alterado: Log resumido (o payload completo pode conter áudio em base64)
+        logger.info(f"Webhook recebido com {len(messages)} mensagem(ns)")
+
+        # Alterado: Inserção em lote (um INSERT, uma transação) rodando no threadpool,
+        # para não bloquear o event loop do uvicorn e responder rápido à Evolution
+        item_ids = await run_in_threadpool(enqueue_messages, messages)
+
+        if item_ids:
+            logger.info(f"Itens salvos na fila com IDs: {item_ids}")
+        ignored = len(messages) - len(item_ids)
+        if ignored:
+            logger.warning(f"{ignored} item(ns) ignorado(s) (evento incorreto ou reentrega duplicada)")
+
         return {"status": "received"}
     except Exception as e:
         logger.error(f"Erro ao processar webhook: {e}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
+
+def publish_user_changed(phone: str):
+    with SessionLocal() as db:
+        notify_user_changed(db, phone)
+        db.commit()
+
+# Alterado: Hook para integrações de cobrança (ex.: fluxo do n8n que altera is_client,
+# is_blocked, is_compliant ou is_canceled): avisa os workers para descartarem o
+# usuário do cache e relerem as flags do banco na próxima mensagem.
+# Alterado: Protegido pelas credenciais do dashboard (HTTP Basic)
+@router.post("/users/{phone}/invalidate-cache", dependencies=[Depends(require_admin)])
+async def invalidate_user_cache(phone: str):
+    try:
+        await run_in_threadpool(publish_user_changed, phone)
+        logger.info(f"Cache do usuário {phone} invalidado")
+        return {"status": "invalidated"}
+    except Exception as e:
+        logger.error(f"Erro ao invalidar cache do usuário {phone}: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+# Alterado: Contadores da deduplicação de webhooks neste processo da API
+# (accepted, memory_duplicates, db_duplicates); o total persistido fica em ingest_dedup
+@router.get("/stats/ingest")
+async def ingest_stats():
+    return recent_message_ids.stats()
+
+def load_upstream_health(stale_seconds: float):
+    # Só processos que publicaram recentemente (os demais provavelmente encerraram)
+    with SessionLocal() as db:
+        rows = db.execute(text("""
+            SELECT instance, upstream, state, concurrency_limit, in_flight, details, updated_at
+            FROM upstream_health
+            WHERE updated_at >= now() - make_interval(secs => :stale_seconds)
+            ORDER BY upstream, instance
+        """), {"stale_seconds": stale_seconds}).mappings().all()
+    return [dict(row) for row in rows]
+
+# Alterado: Estado do circuit breaker e limite de concorrência do n8n em cada worker
+@router.get("/stats/upstream")
+async def upstream_stats():
+    try:
+        return await run_in_threadpool(load_upstream_health, settings.UPSTREAM_HEALTH_PUBLISH_SECONDS * 4)
+    except Exception as e:
+        logger.error(f"Erro ao consultar estado das dependências: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+# Alterado: Métricas no formato do Prometheus (profundidade da fila, threads, pool do
+# banco e contadores deste processo da API); o worker expõe as suas em METRICS_PORT
+@router.get("/metrics")
+async def metrics():
+    # A profundidade da fila é lida do banco na hora: fora do event loop
+    body = await run_in_threadpool(render_metrics)
+    return Response(content=body, media_type=CONTENT_TYPE)
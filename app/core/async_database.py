@@ -0,0 +1,38 @@
+# Alterado: Novo módulo com engine assíncrono (asyncpg) para o engine de workers asyncio
+# O engine síncrono (app/core/database.py) continua sendo o padrão da API, dashboard e
+# do engine de threads.
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from app.core.config import settings
+
+
+def _async_url_and_args():
+    """
+    Converte DATABASE_URL para o driver asyncpg.
+
+    O asyncpg não entende 'sslmode' na URL (usa o argumento 'ssl'), então o
+    parâmetro é movido para connect_args.
+    """
+    url = make_url(settings.DATABASE_URL).set(drivername="postgresql+asyncpg")
+    connect_args = {"server_settings": {"timezone": "America/Sao_Paulo"}}
+
+    query = dict(url.query)
+    sslmode = query.pop("sslmode", None)
+    if sslmode:
+        connect_args["ssl"] = sslmode
+        url = url.set(query=query)
+
+    return url, connect_args
+
+
+_url, _connect_args = _async_url_and_args()
+
+async_engine = create_async_engine(
+    _url,
+    pool_pre_ping=True,
+    pool_size=settings.ASYNC_DB_POOL_SIZE,
+    max_overflow=settings.ASYNC_DB_MAX_OVERFLOW,
+    connect_args=_connect_args
+)
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
@@ -1,6 +1,6 @@
 import os
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import Dict, Optional
 
 class Settings(BaseSettings):
     SUPABASE_URL: str
@@ -13,12 +13,114 @@ class Settings(BaseSettings):
     EVOLUTION_DESTINATION_URL: str
     
     N8N_WEBHOOK_URL: str
+
+    # Alterado: Clientes HTTP compartilhados (keep-alive) para n8n e Evolution
+    N8N_TIMEOUT: float = 180.0
+    # Alterado: Circuit breaker e limite adaptativo (AIMD) de chamadas simultâneas ao n8n
+    N8N_BREAKER_FAILURE_THRESHOLD: int = 5
+    N8N_BREAKER_OPEN_SECONDS: float = 30.0
+    N8N_LIMIT_INITIAL: int = 10
+    N8N_LIMIT_MIN: int = 1
+    N8N_LIMIT_MAX: int = 50
+    # Alterado: Latência "lenta" (reduz o limite) = N8N_LATENCY_TOLERANCE x p50 das últimas
+    # chamadas bem-sucedidas, nunca abaixo de N8N_LATENCY_MIN_TARGET_SECONDS; até haver
+    # amostras suficientes vale N8N_LATENCY_TARGET_SECONDS
+    N8N_LATENCY_TARGET_SECONDS: float = 10.0
+    N8N_LATENCY_MIN_TARGET_SECONDS: float = 2.0
+    N8N_LATENCY_TOLERANCE: float = 2.0
+    # Intervalo mínimo entre duas reduções do limite (chamadas já em voo não derrubam tudo)
+    N8N_LIMIT_DECREASE_COOLDOWN_SECONDS: float = 5.0
+    # Espera máxima por uma vaga no limite antes de adiar o item
+    N8N_LIMIT_ACQUIRE_TIMEOUT: float = 30.0
+    # Intervalo (s) em que cada worker publica o estado do circuito/limite em upstream_health
+    UPSTREAM_HEALTH_PUBLISH_SECONDS: float = 15.0
+    EVOLUTION_TIMEOUT: float = 10.0
+    # Alterado: Fila de envio para o WhatsApp (threads dedicadas, token bucket por instância)
+    OUTBOUND_WORKERS: int = 4
+    OUTBOUND_MAX_QUEUE: int = 5000
+    OUTBOUND_MAX_RETRIES: int = 3
+    OUTBOUND_RETRY_BASE_DELAY_SECONDS: float = 2.0
+    EVOLUTION_SEND_RATE_PER_SECOND: float = 5.0
+    EVOLUTION_SEND_BURST: int = 10
+    # Limite por instância, ex.: EVOLUTION_SEND_RATES='{"jeronimo": 2.5}' (senão usa o padrão acima)
+    EVOLUTION_SEND_RATES: Dict[str, float] = {}
+    HTTP_CONNECT_TIMEOUT: float = 10.0
+    HTTP_MAX_CONNECTIONS: int = 100
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    HTTP_KEEPALIVE_EXPIRY: float = 30.0
+    HTTP_ENABLE_HTTP2: bool = True
+    # Intervalo (s) entre logs de estatísticas dos pools HTTP no worker (0 desativa)
+    HTTP_POOL_STATS_LOG_INTERVAL: float = 300.0
+    # Alterado: Porta do /metrics (formato Prometheus) no processo do worker (0 desativa);
+    # na API o /metrics é servido pelo próprio FastAPI
+    METRICS_PORT: int = 9100
+    # Alterado: Spans de tempo por etapa do process_request (histograma no /metrics)
+    # e profiler amostrado: fração dos itens com cProfile; guarda os N mais lentos em PROFILING_DIR
+    PROFILING_SPANS_ENABLED: bool = False
+    PROFILING_SAMPLE_RATE: float = 0.0
+    PROFILING_KEEP_SLOWEST: int = 20
+    PROFILING_DIR: str = "data/profiles"
+
+    # Alterado: Diretório do blob store de áudio (compartilhado entre API e worker)
+    BLOB_STORE_DIR: str = "data/blobs"
+
+    # Alterado: Deduplicação de webhooks reentregues pela Evolution (por key.id)
+    # Filtro em memória na API (IDs recentes) + tabela ingest_dedup (limpa após N dias)
+    DEDUP_MEMORY_MAX_IDS: int = 50000
+    DEDUP_MEMORY_TTL_SECONDS: float = 3600.0
+    DEDUP_RETENTION_DAYS: int = 7
+
+    # Alterado: Janela (s) de agrupamento de mensagens de texto do mesmo usuário.
+    # Um item só é reivindicado depois de "descansar" essa janela; mensagens de texto
+    # seguidas do mesmo telefone viram uma única chamada ao n8n e uma única resposta.
+    # 0 desativa (cada mensagem é processada assim que chega).
+    COALESCE_WINDOW_SECONDS: float = 0.0
+    # Espera máxima (s) de um agrupamento, mesmo que o usuário continue digitando
+    COALESCE_MAX_WAIT_SECONDS: float = 15.0
+    # Máximo de mensagens agrupadas numa única chamada
+    COALESCE_MAX_MESSAGES: int = 10
+
+    # Alterado: Contexto de conversa enviado ao n8n e cache em memória por usuário
+    CHAT_CONTEXT_WINDOW_MINUTES: int = 30
+    CONTEXT_CACHE_MAX_USERS: int = 5000
+    # Após esse tempo (s) o contexto do usuário é relido do banco (limita defasagem entre réplicas)
+    CONTEXT_CACHE_TTL_SECONDS: float = 300.0
+
+    # Alterado: Cache de usuários (id e flags de assinatura) no worker; 0 desativa
+    USER_CACHE_TTL_SECONDS: float = 60.0
+    USER_CACHE_MAX_SIZE: int = 10000
+
+    # Alterado: Intervalo (s) da reconciliação de users.ai_response_count com chat_logs (0 desativa)
+    COUNTER_RECONCILE_INTERVAL_SECONDS: float = 21600.0
+
+    # Alterado: Rollups por hora do dashboard: intervalo (s) do job (0 desativa) e quantas
+    # horas antes da marca d'água são recalculadas (itens mudam de status após a criação)
+    ROLLUP_INTERVAL_SECONDS: float = 300.0
+    ROLLUP_LOOKBACK_HOURS: int = 24
+
+    # Alterado: Partições mensais de request_queue/processing_logs e arquivamento
+    # Partições cujo mês terminou há mais de PARTITION_ARCHIVE_AFTER_DAYS dias são exportadas
+    # (CSV gzip em ARCHIVE_DIR) e removidas do banco; 0 no intervalo desativa o job
+    PARTITION_JOB_INTERVAL_SECONDS: float = 86400.0
+    PARTITION_MONTHS_AHEAD: int = 2
+    PARTITION_ARCHIVE_AFTER_DAYS: int = 90
+    ARCHIVE_DIR: str = "data/archive"
+
+    # Alterado: Gravação em lote dos passos (processing_logs)
+    STEP_LOG_BATCH_SIZE: int = 200
+    STEP_LOG_FLUSH_INTERVAL: float = 1.0
+    STEP_LOG_MAX_QUEUE: int = 10000
+    STEP_LOG_MAX_RETRIES: int = 3
     
     LOG_LEVEL: str = "INFO"
     
     # Configurações do Dashboard e Email
     DASHBOARD_USER: str = "admin"
     DASHBOARD_PASSWORD: str = "password"
+    # Alterado: Tempo (s) que as consultas agregadas do dashboard ficam em cache (compartilhado entre sessões)
+    DASHBOARD_CACHE_TTL_SECONDS: float = 30.0
+    # Alterado: Quantidade de linhas na tabela "Últimas Requisições"
+    DASHBOARD_REQUESTS_LIMIT: int = 50
     
     EMAIL_DESTINATION: str
     EMAIL_SMTP_SERVER: str
@@ -26,6 +128,43 @@ class Settings(BaseSettings):
     EMAIL_SMTP_USER: str
     EMAIL_SMTP_PASSWORD: str
 
+    # Alterado: Pool de conexões do SQLAlchemy (deve comportar WORKER_POOL_MAX + gerenciador)
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 15
+    DB_POOL_TIMEOUT: int = 30
+
+    # Alterado: Pool de workers persistentes do agent_manager
+    # WORKER_POOL_MIN: threads sempre vivas; WORKER_POOL_MAX: teto de concorrência (backpressure)
+    WORKER_POOL_MIN: int = 2
+    WORKER_POOL_MAX: int = 20
+    # Tempo (s) que uma thread ociosa acima do mínimo espera antes de encerrar
+    WORKER_POOL_IDLE_TIMEOUT: float = 60.0
+    # Se o item pendente mais antigo esperar mais que isso (s), o pool cresce de forma agressiva
+    WORKER_POOL_SCALE_UP_LAG: float = 5.0
+
+    # Alterado: Wakeup por LISTEN/NOTIFY; o polling vira só uma rede de segurança lenta
+    QUEUE_FALLBACK_POLL_SECONDS: float = 30.0
+
+    # Alterado: Retentativas com backoff exponencial + jitter e visibility timeout
+    RETRY_MAX_ATTEMPTS: int = 3
+    RETRY_BASE_DELAY_SECONDS: float = 30.0
+    RETRY_MAX_DELAY_SECONDS: float = 1800.0
+    # Itens em 'processing' há mais que isso (worker caiu) voltam para a fila; deve ser
+    # maior que o pior caso de processamento (agrupamento + N8N_TIMEOUT + envio)
+    VISIBILITY_TIMEOUT_SECONDS: float = 600.0
+    REAPER_INTERVAL_SECONDS: float = 60.0
+
+    # Alterado: Engine de workers selecionado na inicialização do agent_manager
+    # "thread" (padrão, pool de threads) ou "async" (event loop único com asyncpg/httpx)
+    WORKER_ENGINE: str = "thread"
+    # Engine async: conversas simultâneas em andamento e conexões do pool asyncpg.
+    # Alterado: Padrão um pequeno múltiplo de N8N_LIMIT_MAX: quase toda conversa espera
+    # pelo n8n, e o engine já só reivindica itens com vaga livre no limite do n8n; um
+    # teto maior só deixaria itens em 'processing' parados esperando vaga até serem adiados
+    ASYNC_MAX_IN_FLIGHT: int = 200
+    ASYNC_DB_POOL_SIZE: int = 5
+    ASYNC_DB_MAX_OVERFLOW: int = 5
+
     class Config:
         env_file = ".env"
         env_file_encoding = 'utf-8'
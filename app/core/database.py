@@ -8,9 +8,14 @@ from app.core.config import settings
 
 # Alterado: Adicionada configuração de timezone America/Sao_Paulo na conexão
 # Isso garante que todas as queries SQL usem o timezone correto (-3)
+# Alterado: Pool de conexões dimensionado via Settings para comportar o pool de workers
+# (antes usava o padrão do SQLAlchemy: 5 conexões + 10 de overflow)
 engine = create_engine(
     settings.DATABASE_URL, 
     pool_pre_ping=True,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
     connect_args={"options": "-c timezone=America/Sao_Paulo"}
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -0,0 +1,217 @@
+# Alterado: Novo módulo com clientes HTTP compartilhados (um por processo e por destino)
+# Antes, cada mensagem chamava httpx.post(...), abrindo uma conexão TCP + TLS nova
+# para o n8n e outra para a Evolution. Agora as conexões ficam vivas (keep-alive) e
+# são reaproveitadas, com HTTP/2 quando o servidor suporta.
+
+import logging
+import os
+import threading
+from typing import Dict
+
+import httpcore
+import httpx
+
+from app.core.config import settings
+
+logger = logging.getLogger("HttpClients")
+
+N8N = "n8n"
+EVOLUTION = "evolution"
+
+_lock = threading.Lock()
+_clients: Dict[str, httpx.Client] = {}
+_async_clients: Dict[str, httpx.AsyncClient] = {}
+_counters: Dict[str, Dict[str, int]] = {}
+# Alterado: Os hooks rodam em várias threads ao mesmo tempo; "+=" sem lock perde incrementos
+_counters_lock = threading.Lock()
+_owner_pid = os.getpid()
+
+# Alterado: A lista de conexões do pool é interna do httpcore (client._transport._pool),
+# conferida na série 1.x. Em outra versão as estatísticas de conexões são omitidas (só
+# os contadores de requisições continuam), em vez de quebrarem em silêncio.
+_POOL_INTROSPECTION = httpcore.__version__.split(".")[0] == "1"
+_pool_introspection_warned = False
+
+
+def _http2_available() -> bool:
+    if not settings.HTTP_ENABLE_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        logger.warning("Pacote 'h2' não instalado; usando HTTP/1.1 (instale httpx[http2])")
+        return False
+
+
+def _timeout(name: str) -> httpx.Timeout:
+    if name == N8N:
+        return httpx.Timeout(settings.N8N_TIMEOUT, connect=settings.HTTP_CONNECT_TIMEOUT)
+    return httpx.Timeout(settings.EVOLUTION_TIMEOUT, connect=settings.HTTP_CONNECT_TIMEOUT)
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=settings.HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY
+    )
+
+
+def _counter(name: str) -> Dict[str, int]:
+    with _counters_lock:
+        return _counters.setdefault(name, {"requests": 0, "responses": 0, "errors_http": 0})
+
+
+def _counter_snapshot(name: str) -> Dict[str, int]:
+    counter = _counter(name)
+    with _counters_lock:
+        return dict(counter)
+
+
+def _hooks(name: str, is_async: bool):
+    """Event hooks que contam requisições/respostas para pool_stats()."""
+    counter = _counter(name)
+
+    def on_request(request):
+        with _counters_lock:
+            counter["requests"] += 1
+
+    def on_response(response):
+        with _counters_lock:
+            counter["responses"] += 1
+            if response.status_code >= 400:
+                counter["errors_http"] += 1
+
+    if is_async:
+        async def on_request_async(request):
+            on_request(request)
+
+        async def on_response_async(response):
+            on_response(response)
+
+        return {"request": [on_request_async], "response": [on_response_async]}
+
+    return {"request": [on_request], "response": [on_response]}
+
+
+def _reset_after_fork():
+    # Conexões não podem ser compartilhadas entre processos: após um fork, recria tudo
+    global _owner_pid, _counters_lock
+    if os.getpid() != _owner_pid:
+        _clients.clear()
+        _async_clients.clear()
+        # Alterado: Zera os contadores no lugar: hooks de clientes criados antes do fork
+        # guardam a referência ao dict, e um dict novo deixaria pool_stats() sempre em zero.
+        # O lock é recriado (pode ter sido copiado travado por outra thread no fork)
+        _counters_lock = threading.Lock()
+        for counter in _counters.values():
+            for key in counter:
+                counter[key] = 0
+        _owner_pid = os.getpid()
+
+
+def get_client(name: str) -> httpx.Client:
+    """
+    Retorna o cliente síncrono compartilhado para o destino (N8N ou EVOLUTION).
+
+    Exemplo:
+        >>> from app.core.http_clients import get_client, N8N
+        >>> response = get_client(N8N).post(url, json=payload)
+    """
+    client = _clients.get(name)
+    if client is not None and os.getpid() == _owner_pid:
+        return client
+
+    with _lock:
+        _reset_after_fork()
+        client = _clients.get(name)
+        if client is None:
+            http2 = _http2_available()
+            client = httpx.Client(
+                http2=http2,
+                limits=_limits(),
+                timeout=_timeout(name),
+                event_hooks=_hooks(name, is_async=False)
+            )
+            _clients[name] = client
+            logger.info(f"Cliente HTTP '{name}' criado (http2={http2})")
+        return client
+
+
+def get_async_client(name: str) -> httpx.AsyncClient:
+    """Versão assíncrona de get_client (engine asyncio)."""
+    client = _async_clients.get(name)
+    if client is not None and os.getpid() == _owner_pid:
+        return client
+
+    with _lock:
+        _reset_after_fork()
+        client = _async_clients.get(name)
+        if client is None:
+            client = httpx.AsyncClient(
+                http2=_http2_available(),
+                limits=_limits(),
+                timeout=_timeout(name),
+                event_hooks=_hooks(name + "_async", is_async=True)
+            )
+            _async_clients[name] = client
+        return client
+
+
+def _pool_connections(client) -> Dict[str, int]:
+    # httpcore não expõe estatísticas públicas; lemos a lista de conexões do pool
+    global _pool_introspection_warned
+    if not _POOL_INTROSPECTION:
+        return {}
+    try:
+        connections = list(client._transport._pool.connections)
+        idle = sum(1 for c in connections if c.is_idle())
+    except Exception as e:
+        if not _pool_introspection_warned:
+            _pool_introspection_warned = True
+            logger.warning(f"Estatísticas de conexões indisponíveis (httpcore {httpcore.__version__}): {e}")
+        return {}
+
+    return {
+        "connections": len(connections),
+        "idle": idle,
+        "active": len(connections) - idle,
+    }
+
+
+def pool_stats() -> Dict[str, Dict[str, int]]:
+    """
+    Estatísticas por cliente: conexões abertas/ociosas/ativas e contadores de requisições.
+
+    Exemplo:
+        >>> pool_stats()
+        {'n8n': {'connections': 2, 'idle': 1, 'active': 1, 'requests': 40, ...}}
+    """
+    stats = {}
+    for name, client in list(_clients.items()):
+        stats[name] = {**_pool_connections(client), **_counter_snapshot(name)}
+    for name, client in list(_async_clients.items()):
+        stats[name + "_async"] = {**_pool_connections(client), **_counter_snapshot(name + "_async")}
+    return stats
+
+
+def log_pool_stats():
+    for name, values in pool_stats().items():
+        logger.info(f"Pool HTTP '{name}': {values}")
+
+
+def close_clients():
+    """Fecha os clientes síncronos (chamar no encerramento do processo)."""
+    with _lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+
+
+async def aclose_async_clients():
+    """Fecha os clientes assíncronos (chamar no encerramento do engine async)."""
+    clients = list(_async_clients.values())
+    _async_clients.clear()
+    for client in clients:
+        await client.aclose()
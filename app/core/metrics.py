@@ -0,0 +1,310 @@
+# Alterado: Novo módulo de métricas no formato texto do Prometheus (sem dependências)
+# Até aqui só havia linhas de log. Cada processo mantém seus contadores/histogramas em
+# memória e os expõe em /metrics: a API pelo FastAPI (app/api/endpoints.py) e o worker
+# por um servidor HTTP embutido (start_metrics_server, porta METRICS_PORT).
+# Tudo roda localmente; qualquer Prometheus (ou curl) pode ler o endpoint.
+#
+# Valores lidos na hora da leitura (profundidade da fila, threads, pool do banco) vêm de
+# "collectors": funções registradas com add_collector que atualizam gauges antes da renderização.
+
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from sqlalchemy import text
+
+logger = logging.getLogger("Metrics")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Latências vão de milissegundos (banco, passos) a minutos (n8n, timeout de 180s)
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 180.0, 300.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in items
+        ]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in items
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # Por combinação de labels: [contagens por bucket (não cumulativas), soma, total]
+        self._values: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][index] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, ([*state[0]], state[1], state[2])) for key, state in self._values.items())
+        lines = self._header()
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], None]):
+        """Registra uma função chamada a cada leitura para atualizar gauges."""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        with self._lock:
+            collectors = list(self._collectors)
+            metrics = list(self._metrics)
+        for collector in collectors:
+            try:
+                collector()
+            except Exception as e:
+                # Uma fonte indisponível (ex.: banco fora) não derruba o resto das métricas
+                logger.warning(f"Falha no coletor de métricas {getattr(collector, '__name__', collector)}: {e}")
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# --- Métricas da aplicação ------------------------------------------------------
+
+queue_depth = registry.register(Gauge(
+    "jeronimo_queue_depth", "Itens em request_queue por status (pending inclui retentativas agendadas)", ["status"]))
+queue_pickup_lag = registry.register(Histogram(
+    "jeronimo_queue_pickup_lag_seconds", "Tempo entre a entrada do item na fila e sua reivindicação por um worker"))
+step_latency = registry.register(Histogram(
+    "jeronimo_step_seconds", "Tempo desde o passo anterior do mesmo item até este passo (log_step)", ["step"]))
+steps_total = registry.register(Counter(
+    "jeronimo_steps_total", "Passos registrados por log_step", ["step", "status"]))
+upstream_latency = registry.register(Histogram(
+    "jeronimo_upstream_request_seconds", "Latência das chamadas às dependências externas", ["upstream"]))
+upstream_requests = registry.register(Counter(
+    "jeronimo_upstream_requests_total",
+    "Chamadas às dependências externas por resultado (ok, error, timeout, rejected)", ["upstream", "outcome"]))
+threads_active = registry.register(Gauge(
+    "jeronimo_threads_active", "Threads vivas no processo"))
+db_pool_checked_out = registry.register(Gauge(
+    "jeronimo_db_pool_checked_out", "Conexões do pool do SQLAlchemy em uso", ["engine"]))
+db_pool_size = registry.register(Gauge(
+    "jeronimo_db_pool_size", "Tamanho configurado do pool do SQLAlchemy", ["engine"]))
+db_pool_overflow = registry.register(Gauge(
+    "jeronimo_db_pool_overflow", "Conexões abertas além do pool_size (overflow)", ["engine"]))
+# Preenchidas pelos coletores do processo do worker (fila de envio, pool de workers, gravador de passos)
+component_gauge = registry.register(Gauge(
+    "jeronimo_component_value", "Estatísticas internas dos componentes do worker", ["component", "field"]))
+
+# Passos que encerram o item neste processo (libera o cronômetro do item)
+TERMINAL_STEPS = {"RESPONSE", "ERROR", "TIMEOUT", "AI_ERROR", "RETRY", "DEFERRED", "COALESCED", "REAPED"}
+TERMINAL_STATUSES = {"stopped", "skipped"}
+_MAX_TRACKED_ITEMS = 10000
+_step_clock: Dict[int, float] = {}
+_step_lock = threading.Lock()
+
+
+def observe_step(queue_id: int, step: str, status: str):
+    """Conta o passo e mede o tempo desde o passo anterior do mesmo item (neste processo)."""
+    now = time.monotonic()
+    steps_total.inc(step=step, status=status)
+    with _step_lock:
+        previous = _step_clock.pop(queue_id, None)
+        if step not in TERMINAL_STEPS and status not in TERMINAL_STATUSES:
+            if len(_step_clock) >= _MAX_TRACKED_ITEMS:
+                # Itens que nunca chegaram a um passo final (processo reiniciado, etc.)
+                _step_clock.pop(next(iter(_step_clock)))
+            _step_clock[queue_id] = now
+    if previous is not None:
+        step_latency.observe(now - previous, step=step)
+
+
+def observe_upstream(upstream: str, started: float, outcome: str):
+    """Registra uma chamada a uma dependência externa iniciada em 'started' (time.monotonic())."""
+    upstream_latency.observe(time.monotonic() - started, upstream=upstream)
+    upstream_requests.inc(upstream=upstream, outcome=outcome)
+
+
+def set_component_stats(component: str, stats: dict):
+    for field, value in stats.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            component_gauge.set(value, component=component, field=field)
+
+
+# --- Coletores padrão (API e worker) ------------------------------------------
+
+def collect_threads():
+    threads_active.set(threading.active_count())
+
+
+def collect_db_pool(name: str, engine):
+    pool = engine.pool
+    db_pool_checked_out.set(pool.checkedout(), engine=name)
+    db_pool_size.set(pool.size(), engine=name)
+    db_pool_overflow.set(max(0, pool.overflow()), engine=name)
+
+
+def collect_sync_db_pool():
+    from app.core.database import engine
+    collect_db_pool("sync", engine)
+
+
+def collect_queue_depth():
+    from app.core.database import SessionLocal
+    # 'completed' fica de fora: cresce sem limite e não é profundidade de fila
+    with SessionLocal() as db:
+        rows = db.execute(text("""
+            SELECT status, count(*) AS total
+            FROM request_queue
+            WHERE status IN ('pending', 'processing', 'failed')
+            GROUP BY status
+        """)).fetchall()
+    counts = {"pending": 0, "processing": 0, "failed": 0}
+    counts.update({row.status: row.total for row in rows})
+    for status, total in counts.items():
+        queue_depth.set(total, status=status)
+
+
+registry.add_collector(collect_threads)
+registry.add_collector(collect_sync_db_pool)
+registry.add_collector(collect_queue_depth)
+
+
+def render_metrics() -> str:
+    return registry.render()
+
+
+# --- Exportador do worker -------------------------------------------------------
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Sem uma linha de log por leitura do Prometheus
+        pass
+
+
+def start_metrics_server(port: int, host: str = "0.0.0.0"):
+    """Sobe GET /metrics numa thread daemon (processo do worker). port <= 0 desativa."""
+    if port <= 0:
+        return None
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info(f"Métricas disponíveis em http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,185 @@
+# Alterado: Novo módulo de escuta de notificações do Postgres (LISTEN/NOTIFY)
+# Permite que o agent_manager durma até alguém inserir na fila, em vez de consultar
+# o banco a cada 2 segundos.
+
+import asyncio
+import logging
+import select
+import time
+from typing import Iterable, List, Tuple
+
+import asyncpg
+import psycopg2
+import psycopg2.extensions
+from sqlalchemy.engine import make_url
+
+from app.core.config import settings
+
+logger = logging.getLogger("PgListener")
+
+# (canal, payload)
+Notification = Tuple[str, str]
+
+
+def _plain_dsn() -> str:
+    """Converte DATABASE_URL (formato SQLAlchemy) para um DSN libpq puro (psycopg2 e asyncpg)."""
+    url = make_url(settings.DATABASE_URL).set(drivername="postgresql")
+    return url.render_as_string(hide_password=False)
+
+
+class PgListener:
+    """
+    Conexão dedicada (fora do pool do SQLAlchemy) em modo autocommit que escuta canais.
+
+    Exemplo:
+        >>> listener = PgListener(["request_queue_new"])
+        >>> for channel, payload in listener.wait(timeout=30):
+        ...     print(channel, payload)
+    """
+
+    def __init__(self, channels: Iterable[str]):
+        self.channels = list(channels)
+        self._conn = None
+        # Alterado: LISTEN já na criação (antes do primeiro claim); NOTIFYs enviados antes
+        # do LISTEN se perdem e o item esperaria até QUEUE_FALLBACK_POLL_SECONDS
+        try:
+            self._connect()
+        except Exception as e:
+            logger.error(f"Erro ao iniciar o LISTEN, nova tentativa no próximo ciclo: {e}")
+
+    def _connect(self):
+        conn = psycopg2.connect(_plain_dsn())
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cur:
+            for channel in self.channels:
+                # Nome do canal é identificador (não aceita bind param); vem de constantes do código
+                cur.execute(f'LISTEN "{channel}";')
+        self._conn = conn
+        logger.info(f"Escutando canais: {', '.join(self.channels)}")
+
+    def close(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+
+    def poll(self) -> List[Notification]:
+        """
+        Notificações já recebidas, sem bloquear. Chamado a cada volta do gerenciador:
+        com a fila sempre cheia ele não chega ao wait, e os avisos de usuário alterado
+        (cache) ficariam parados no socket.
+        """
+        return self.wait(timeout=0)
+
+    def wait(self, timeout: float) -> List[Notification]:
+        """
+        Bloqueia até chegar ao menos uma notificação ou o timeout expirar.
+
+        Várias notificações acumuladas são drenadas de uma vez, para que uma rajada
+        de inserts gere um único wakeup.
+
+        Returns:
+            List[Notification]: notificações recebidas (vazia em caso de timeout)
+        """
+        try:
+            if self._conn is None:
+                self._connect()
+                # Alterado: NOTIFYs enviados enquanto estava desconectado se perderam; volta
+                # sem esperar para o chamador reivindicar antes de dormir
+                return []
+
+            # Pode já haver notificações pendentes de um poll anterior
+            if not self._conn.notifies:
+                ready, _, _ = select.select([self._conn], [], [], timeout)
+                if not ready:
+                    return []
+
+            self._conn.poll()
+            notifications = [(n.channel, n.payload) for n in self._conn.notifies]
+            self._conn.notifies.clear()
+            return notifications
+
+        except Exception as e:
+            # Conexão caiu: descarta e deixa o chamador seguir com o polling de segurança
+            logger.error(f"Erro no LISTEN, reconectando no próximo ciclo: {e}")
+            self.close()
+            time.sleep(min(timeout, 5))
+            return []
+
+
+class AsyncPgListener:
+    """
+    Versão asyncio do PgListener (engine async), usando uma conexão asyncpg dedicada.
+
+    Exemplo:
+        >>> listener = AsyncPgListener(["request_queue_new"])
+        >>> notifications = await listener.wait(timeout=30)
+    """
+
+    def __init__(self, channels: Iterable[str]):
+        self.channels = list(channels)
+        self._conn = None
+        self._pending: List[Notification] = []
+        self._event = asyncio.Event()
+
+    def _on_notify(self, connection, pid, channel, payload):
+        self._pending.append((channel, payload))
+        self._event.set()
+
+    async def _connect(self):
+        self._conn = await asyncpg.connect(_plain_dsn())
+        for channel in self.channels:
+            await self._conn.add_listener(channel, self._on_notify)
+        logger.info(f"Escutando canais (async): {', '.join(self.channels)}")
+
+    async def connect(self):
+        """Alterado: LISTEN antes do primeiro claim (o construtor não pode aguardar a conexão)."""
+        try:
+            await self._connect()
+        except Exception as e:
+            self._conn = None
+            logger.error(f"Erro ao iniciar o LISTEN (async), nova tentativa no próximo ciclo: {e}")
+
+    async def close(self):
+        if self._conn is not None:
+            try:
+                await self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+
+    def drain(self) -> List[Notification]:
+        """Notificações já recebidas (entregues pelo asyncpg no event loop), sem esperar."""
+        notifications = self._pending
+        self._pending = []
+        self._event.clear()
+        return notifications
+
+    async def wait(self, timeout: float) -> List[Notification]:
+        """Aguarda notificações sem bloquear o event loop (mesmo contrato do PgListener.wait)."""
+        try:
+            if self._conn is None or self._conn.is_closed():
+                self._conn = None
+                await self._connect()
+                # Alterado: Após reconectar, volta sem esperar para o chamador reivindicar
+                # (NOTIFYs do período desconectado se perderam)
+                return self.drain()
+
+            if not self._pending:
+                try:
+                    await asyncio.wait_for(self._event.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    return []
+
+            notifications = self._pending
+            self._pending = []
+            self._event.clear()
+            return notifications
+
+        except Exception as e:
+            logger.error(f"Erro no LISTEN (async), reconectando no próximo ciclo: {e}")
+            await self.close()
+            await asyncio.sleep(min(timeout, 5))
+            return []
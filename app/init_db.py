@@ -1,5 +1,6 @@
-from app.core.database import engine, Base
+from app.core.database import engine, Base, SessionLocal
 from app.models.all_models import User, Lead, ChatLog, RequestQueue, ProcessingLog
+from app.workers.partition_job import ensure_partitions
 import logging
 
 logging.basicConfig(level=logging.INFO)
@@ -9,6 +10,9 @@ def init_db():
     logger.info("Creating tables in database...")
     try:
         Base.metadata.create_all(bind=engine)
+        # Alterado: request_queue/processing_logs são particionadas; cria as partições iniciais
+        with SessionLocal() as db:
+            ensure_partitions(db)
         logger.info("Tables created successfully!")
     except Exception as e:
         logger.error(f"Error creating tables: {e}")
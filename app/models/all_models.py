@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, JSON
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, JSON, Float
 # Alterado: Removido func.now() e adicionado now_br do módulo timezone
 # func.now() é executado pelo banco (UTC), now_br é executado pelo Python (Brasília -3)
 from app.core.database import Base
@@ -17,6 +17,9 @@ class User(Base):
     is_compliant = Column(Boolean, default=True) # Adimplente
     # Alterado: Adicionada coluna is_canceled para indicar se o usuário cancelou o serviço
     is_canceled = Column(Boolean, default=False)
+    # Alterado: Contador mantido de respostas da IA (regra de limite de leads sem COUNT(*))
+    # Incrementado em update_chat_log_with_response; reconciliado por app/workers/reconcile_counters.py
+    ai_response_count = Column(Integer, default=0, nullable=False)
     # Alterado: DateTime SEM timezone para armazenar horário local de Brasília diretamente
     created_at = Column(DateTime, default=now_br)
 
@@ -33,26 +36,108 @@ class ChatLog(Base):
     timestamp = Column(DateTime, default=now_br)
     message_type = Column(String, nullable=True) 
     media_data = Column(String, nullable=True) 
-    evolution_id = Column(String, nullable=True)
+    # Alterado: Indexado para o JOIN da tabela detalhada do dashboard
+    evolution_id = Column(String, nullable=True, index=True)
 
 class RequestQueue(Base):
     __tablename__ = "request_queue"
+    # Alterado: Particionada por mês em created_at (app/workers/partition_job.py);
+    # por isso a chave primária inclui created_at
+    __table_args__ = {"postgresql_partition_by": "RANGE (created_at)"}
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
     payload = Column(JSON, nullable=False)
     status = Column(String, default="pending", index=True)
     # Alterado: DateTime SEM timezone para armazenar horário local de Brasília diretamente
-    created_at = Column(DateTime, default=now_br)
+    # Alterado: Indexado para as consultas da hora corrente do dashboard (após os rollups)
+    created_at = Column(DateTime, default=now_br, primary_key=True, index=True)
     updated_at = Column(DateTime, onupdate=now_br)
     attempts = Column(Integer, default=0)
+    # Alterado: Metadados extraídos do payload na ingestão (colunas indexadas), para que
+    # dashboard e worker não precisem varrer o JSON (payload::jsonb #>> ...) a cada consulta
+    phone = Column(String, nullable=True, index=True)
+    evolution_id = Column(String, nullable=True, index=True)
+    message_type = Column(String, nullable=True)
+    # Alterado: MessageEnvelope (app/services/message_envelope.py) gravado na ingestão;
+    # o worker e o dashboard leem daqui em vez de percorrer o payload
+    envelope = Column(JSON, nullable=True)
+    # Alterado: Retentativas agendadas (backoff) e visibility timeout (reaper)
+    next_attempt_at = Column(DateTime, nullable=True) # Não reivindicar antes deste horário
+    claimed_at = Column(DateTime, nullable=True) # Quando um worker reivindicou o item
+    # Alterado: Mensagem agrupada a um item principal que ainda não terminou (retentativa/adiado);
+    # fica fora do claim e volta junto com o principal
+    coalesced_into = Column(Integer, nullable=True)
 
 class ProcessingLog(Base):
     __tablename__ = "processing_logs"
+    # Alterado: Particionada por mês em timestamp. A FK para request_queue foi removida:
+    # tabelas particionadas só aceitam FK para chaves que incluam a coluna de partição,
+    # e as partições das duas tabelas são arquivadas de forma independente.
+    __table_args__ = {"postgresql_partition_by": "RANGE (timestamp)"}
 
-    id = Column(Integer, primary_key=True, index=True)
-    queue_id = Column(Integer, ForeignKey("request_queue.id"))
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
+    queue_id = Column(Integer, index=True)
     step = Column(String)
     status = Column(String) # 'success', 'error'
     details = Column(String, nullable=True)
     # Alterado: DateTime SEM timezone para armazenar horário local de Brasília diretamente
-    timestamp = Column(DateTime, default=now_br)
+    timestamp = Column(DateTime, default=now_br, primary_key=True, index=True)
+
+# Alterado: Idempotência da ingestão. Um registro por ID de mensagem da Evolution (key.id);
+# reentregas do mesmo webhook batem na chave primária e só incrementam duplicate_count.
+# Fica fora de request_queue porque tabelas particionadas não aceitam UNIQUE sem a
+# coluna de partição.
+class IngestDedup(Base):
+    __tablename__ = "ingest_dedup"
+
+    evolution_id = Column(String, primary_key=True)
+    created_at = Column(DateTime, default=now_br, index=True) # Primeira entrega
+    duplicate_count = Column(Integer, nullable=False, default=0)
+
+# Alterado: Último estado publicado por cada processo de worker do circuit breaker e do
+# limite adaptativo de chamadas a uma dependência (ex.: n8n). Consultado por GET /stats/upstream.
+class UpstreamHealth(Base):
+    __tablename__ = "upstream_health"
+
+    instance = Column(String, primary_key=True) # host:pid do worker
+    upstream = Column(String, primary_key=True)
+    state = Column(String, nullable=False) # closed, open, half_open
+    concurrency_limit = Column(Integer, nullable=False)
+    in_flight = Column(Integer, nullable=False)
+    details = Column(JSON, nullable=True)
+    updated_at = Column(DateTime, default=now_br, onupdate=now_br)
+
+# Alterado: Tabelas de agregação por hora (rollups) usadas pelos gráficos do dashboard.
+# Mantidas pelo job app/workers/rollup_job.py a partir de uma marca d'água (RollupState);
+# o dashboard lê os rollups até a marca e só vai nas tabelas brutas depois dela.
+class QueueStatusHourly(Base):
+    __tablename__ = "rollup_queue_status_hourly"
+
+    bucket = Column(DateTime, primary_key=True) # Início da hora (created_at truncado)
+    status = Column(String, primary_key=True)
+    request_count = Column(Integer, nullable=False, default=0)
+    # Soma/quantidade de (updated_at - created_at) dos itens já finalizados
+    duration_seconds_sum = Column(Float, nullable=False, default=0)
+    duration_count = Column(Integer, nullable=False, default=0)
+
+class StepHourly(Base):
+    __tablename__ = "rollup_step_hourly"
+
+    bucket = Column(DateTime, primary_key=True)
+    step = Column(String, primary_key=True)
+    step_count = Column(Integer, nullable=False, default=0)
+
+class UserRequestsHourly(Base):
+    __tablename__ = "rollup_user_requests_hourly"
+
+    bucket = Column(DateTime, primary_key=True)
+    phone = Column(String, primary_key=True)
+    request_count = Column(Integer, nullable=False, default=0)
+
+class RollupState(Base):
+    __tablename__ = "rollup_state"
+
+    name = Column(String, primary_key=True)
+    # Rollups estão completos para buckets < high_water
+    high_water = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, default=now_br, onupdate=now_br)
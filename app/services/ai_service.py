@@ -1,14 +1,15 @@
 import httpx
+import time
 from app.core.config import settings
+from app.core.http_clients import get_client, get_async_client, N8N
+from app.services.resilience import n8n_guard, UpstreamPermit
 import logging
 
 logger = logging.getLogger("AIService")
 
-def process_with_n8n(chat_context: str, current_message: str, phone: str, user_name: str = None,
-                     message_type: str = "text", media_data: str = None, message_id: str = None):
-    url = settings.N8N_WEBHOOK_URL
-    
-    payload = {
+def _build_n8n_payload(chat_context: str, current_message: str, phone: str, user_name: str = None,
+                       message_type: str = "text", media_data: str = None, message_id: str = None):
+    return {
         "log-de-conversas": chat_context,
         "pergunta-do-usuario-atual": current_message,
         "telefone-usuario": f"{phone}@s.whatsapp.net",
@@ -17,74 +18,135 @@ def process_with_n8n(chat_context: str, current_message: str, phone: str, user_n
         "audio_base64": media_data, # Pode ser null se for texto
         "message_id": message_id
     }
-    
+
+def _log_payload(payload: dict):
+    # Log do payload (sem estourar o console com base64)
+    log_payload = payload.copy()
+    if log_payload.get("audio_base64"):
+        log_payload["audio_base64"] = "[BASE64_DATA_TRUNCATED]"
+    logger.info(f"Enviando payload para n8n: {log_payload}")
+
+def _parse_n8n_response(response: httpx.Response):
+    """
+    Alterado: Interpretação da resposta do n8n separada do transporte HTTP,
+    para ser compartilhada entre a versão síncrona e a assíncrona.
+    """
+    if response.status_code != 200:
+        logger.error(f"Erro n8n: {response.status_code} - {response.text}")
+        return None
+
     try:
-        # Log do payload (sem estourar o console com base64)
-        log_payload = payload.copy()
-        if log_payload.get("audio_base64"):
-            log_payload["audio_base64"] = "[BASE64_DATA_TRUNCATED]"
-        logger.info(f"Enviando payload para n8n: {log_payload}")
+        data = response.json()
+        logger.info(f"Resposta bruta n8n: {data}") # Debug temporário
+
+        # Caso 1: Retorno Lista (Evolution/n8n padrão as vezes retorna lista)
+        if isinstance(data, list) and len(data) > 0:
+            first_item = data[0]
+            # Tenta pegar campos estruturados se existirem
+            if isinstance(first_item, dict):
+                # Se vier estruturado com pergunta/resposta
+                if "respostaIA" in first_item:
+                     return {
+                         "respostaIA": first_item.get("respostaIA"),
+                         "perguntaUsuario": first_item.get("perguntaUsuario")
+                     }
+
+                # Fallback: Tenta extrair texto estilo Evolution message
+                msg = first_item.get("message", {})
+                text_val = None
+                if isinstance(msg, dict):
+                     text_val = msg.get("conversation") or msg.get("extendedTextMessage", {}).get("text")
 
-        # Timeout de 3 minutos (180s) conforme solicitado
+                if not text_val:
+                     text_msg = first_item.get("textMessage", {})
+                     if text_msg:
+                        text_val = text_msg.get("text")
+
+                return {"respostaIA": text_val or str(first_item), "perguntaUsuario": None}
+
+        # Caso 2: Retorno Dict
+        if isinstance(data, dict):
+            # Se tiver os campos esperados
+            if "respostaIA" in data:
+                return {
+                    "respostaIA": data.get("respostaIA"),
+                    "perguntaUsuario": data.get("perguntaUsuario")
+                }
+
+            # Formatos comuns genéricos
+            text_val = data.get("output") or data.get("text") or data.get("resposta") or \
+                       data.get("message", {}).get("conversation")
+
+            return {"respostaIA": text_val, "perguntaUsuario": None}
+
+        return {"respostaIA": response.text, "perguntaUsuario": None}
+
+    except ValueError:
+        return {"respostaIA": response.text, "perguntaUsuario": None}
+
+def process_with_n8n(chat_context: str, current_message: str, phone: str, user_name: str = None,
+                     message_type: str = "text", media_data: str = None, message_id: str = None,
+                     permit: UpstreamPermit = None):
+    url = settings.N8N_WEBHOOK_URL
+    payload = _build_n8n_payload(chat_context, current_message, phone, user_name,
+                                 message_type, media_data, message_id)
+
+    # Alterado: Circuit breaker + limite AIMD. Com o circuito aberto (ou sem vaga no
+    # limite) levanta UpstreamUnavailable sem chamar o n8n. O worker reserva a vaga
+    # (permit) antes de preparar o item, para não gravar chat_log de um item adiado.
+    permit = permit or n8n_guard.reserve()
+    started = time.monotonic()
+    ok = False
+    outcome = None
+    try:
+        _log_payload(payload)
+
+        # Timeout de 3 minutos (180s) conforme solicitado (N8N_TIMEOUT)
+        # Alterado: Cliente compartilhado com keep-alive em vez de httpx.post (conexão nova a cada chamada)
         logger.info("Enviando requisição para n8n...")
-        response = httpx.post(url, json=payload, timeout=180.0)
-        
-        if response.status_code == 200:
-            try:
-                data = response.json()
-                logger.info(f"Resposta bruta n8n: {data}") # Debug temporário
-                
-                # Caso 1: Retorno Lista (Evolution/n8n padrão as vezes retorna lista)
-                if isinstance(data, list) and len(data) > 0:
-                    first_item = data[0]
-                    # Tenta pegar campos estruturados se existirem
-                    if isinstance(first_item, dict):
-                        # Se vier estruturado com pergunta/resposta
-                        if "respostaIA" in first_item:
-                             return {
-                                 "respostaIA": first_item.get("respostaIA"), 
-                                 "perguntaUsuario": first_item.get("perguntaUsuario")
-                             }
-                        
-                        # Fallback: Tenta extrair texto estilo Evolution message
-                        msg = first_item.get("message", {})
-                        text_val = None
-                        if isinstance(msg, dict):
-                             text_val = msg.get("conversation") or msg.get("extendedTextMessage", {}).get("text")
-                        
-                        if not text_val:
-                             text_msg = first_item.get("textMessage", {})
-                             if text_msg:
-                                text_val = text_msg.get("text")
-                        
-                        return {"respostaIA": text_val or str(first_item), "perguntaUsuario": None}
-
-                # Caso 2: Retorno Dict
-                if isinstance(data, dict):
-                    # Se tiver os campos esperados
-                    if "respostaIA" in data:
-                        return {
-                            "respostaIA": data.get("respostaIA"),
-                            "perguntaUsuario": data.get("perguntaUsuario")
-                        }
-
-                    # Formatos comuns genéricos
-                    text_val = data.get("output") or data.get("text") or data.get("resposta") or \
-                               data.get("message", {}).get("conversation")
-                    
-                    return {"respostaIA": text_val, "perguntaUsuario": None}
-                           
-                return {"respostaIA": response.text, "perguntaUsuario": None}
-                
-            except ValueError:
-                return {"respostaIA": response.text, "perguntaUsuario": None}
-        else:
-            logger.error(f"Erro n8n: {response.status_code} - {response.text}")
-            return None
-            
+        response = get_client(N8N).post(url, json=payload)
+        # Erros 5xx contam como falha do n8n; 4xx são problema do pedido, não do serviço
+        ok = response.status_code < 500
+        return _parse_n8n_response(response)
+
+    except httpx.TimeoutException:
+        outcome = "timeout"
+        logger.error(f"Timeout ao aguardar resposta do n8n ({settings.N8N_TIMEOUT:.0f}s).")
+        raise TimeoutError("n8n timeout")
+    except Exception as e:
+        logger.error(f"Erro de conexão com n8n: {e}")
+        return None
+    finally:
+        permit.release(started, ok, outcome)
+
+async def process_with_n8n_async(chat_context: str, current_message: str, phone: str, user_name: str = None,
+                                 message_type: str = "text", media_data: str = None, message_id: str = None,
+                                 permit: UpstreamPermit = None):
+    """
+    Alterado: Versão assíncrona de process_with_n8n para o engine asyncio.
+    Mesmo contrato: retorna dict/None, levanta TimeoutError no timeout e
+    UpstreamUnavailable com o circuito aberto.
+    """
+    url = settings.N8N_WEBHOOK_URL
+    payload = _build_n8n_payload(chat_context, current_message, phone, user_name,
+                                 message_type, media_data, message_id)
+
+    permit = permit or await n8n_guard.reserve_async()
+    started = time.monotonic()
+    ok = False
+    outcome = None
+    try:
+        _log_payload(payload)
+        response = await get_async_client(N8N).post(url, json=payload)
+        ok = response.status_code < 500
+        return _parse_n8n_response(response)
+
     except httpx.TimeoutException:
-        logger.error("Timeout ao aguardar resposta do n8n (180s).")
+        outcome = "timeout"
+        logger.error(f"Timeout ao aguardar resposta do n8n ({settings.N8N_TIMEOUT:.0f}s).")
         raise TimeoutError("n8n timeout")
     except Exception as e:
         logger.error(f"Erro de conexão com n8n: {e}")
         return None
+    finally:
+        permit.release(started, ok, outcome)
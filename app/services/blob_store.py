@@ -0,0 +1,140 @@
+# Alterado: Novo módulo de armazenamento de blobs (áudio) em arquivos locais,
+# endereçados pelo hash SHA-256 do conteúdo.
+#
+# Antes, o base64 do áudio ficava no payload da request_queue, era copiado para
+# chat_logs.media_data, carregado inteiro pelo worker e lido pelo dashboard.
+# Agora a ingestão grava os bytes em BLOB_STORE_DIR e as linhas guardam só uma
+# referência curta ("blob:sha256:<hash>"). Quem precisa do conteúdo lê do disco
+# apenas no momento do uso.
+
+import base64
+import binascii
+import hashlib
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import BinaryIO, Iterator, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger("BlobStore")
+
+BLOB_REF_PREFIX = "blob:sha256:"
+
+# Múltiplo de 3 bytes: cada pedaço vira base64 sem padding intermediário
+_B64_CHUNK_SIZE = 3 * 64 * 1024
+
+
+def _root() -> Path:
+    return Path(settings.BLOB_STORE_DIR)
+
+
+def is_blob_ref(value) -> bool:
+    return isinstance(value, str) and value.startswith(BLOB_REF_PREFIX)
+
+
+def blob_path(ref: str) -> Path:
+    """Caminho do arquivo de uma referência (ex.: data/blobs/ab/cd/abcd...)."""
+    digest = ref[len(BLOB_REF_PREFIX):]
+    if len(digest) != 64 or not all(c in "0123456789abcdef" for c in digest):
+        raise ValueError(f"Referência de blob inválida: {ref}")
+    return _root() / digest[:2] / digest[2:4] / digest
+
+
+def put_bytes(data: bytes) -> str:
+    """
+    Grava os bytes (se ainda não existirem) e retorna a referência.
+
+    A escrita é atômica (arquivo temporário + rename), então leitores nunca
+    veem um blob pela metade, mesmo com API e worker em containers diferentes.
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    ref = BLOB_REF_PREFIX + digest
+    path = blob_path(ref)
+
+    if path.exists():
+        return ref
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as tmp:
+            tmp.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return ref
+
+
+def put_base64(b64_data: str) -> Optional[str]:
+    """Decodifica base64 e grava. Retorna None se o conteúdo não for base64 válido."""
+    try:
+        raw = base64.b64decode(b64_data, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    return put_bytes(raw)
+
+
+def open_blob(ref: str) -> BinaryIO:
+    return open(blob_path(ref), "rb")
+
+
+def iter_blob(ref: str, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    """Lê o blob em pedaços (streaming), sem carregar tudo na memória."""
+    with open_blob(ref) as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def load_base64(ref: str) -> str:
+    """Retorna o conteúdo do blob em base64 (formato esperado pelo n8n)."""
+    return "".join(
+        base64.b64encode(chunk).decode("ascii")
+        for chunk in iter_blob(ref, chunk_size=_B64_CHUNK_SIZE)
+    )
+
+
+def resolve_media(value: Optional[str]) -> Optional[str]:
+    """Referência -> base64; base64 em linha (linhas antigas) é retornado como está."""
+    if is_blob_ref(value):
+        return load_base64(value)
+    return value
+
+
+def offload_payload_media(payload: dict) -> dict:
+    """
+    Move o base64 de áudio do payload da Evolution para o blob store, deixando
+    só a referência ('base64_ref') no lugar. Altera e retorna o próprio payload.
+    """
+    body = payload.get("body") if isinstance(payload.get("body"), dict) else None
+    data = (body or {}).get("data") or payload.get("data")
+    if not isinstance(data, dict):
+        return payload
+
+    message = data.get("message")
+    if not isinstance(message, dict):
+        return payload
+
+    # audioMessage.base64 (lido pelo worker) e message.base64 (includeBase64OnData)
+    for container in (message.get("audioMessage"), message):
+        if not isinstance(container, dict):
+            continue
+        b64_data = container.get("base64")
+        if not b64_data or not isinstance(b64_data, str):
+            continue
+
+        ref = put_base64(b64_data)
+        if ref is None:
+            logger.warning("Base64 de mídia inválido; mantido no payload")
+            continue
+
+        container.pop("base64")
+        container["base64_ref"] = ref
+
+    return payload
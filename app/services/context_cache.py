@@ -0,0 +1,122 @@
+# Alterado: Novo módulo com cache em memória do contexto de conversa por usuário
+# Antes, get_chat_context consultava a janela inteira de 30 minutos em chat_logs a
+# cada mensagem. Agora o contexto fica em memória (LRU por user_id), é atualizado
+# incrementalmente por save_chat_log/update_chat_log_with_response e só vai ao banco
+# quando o usuário não está no cache (ou a entrada expirou).
+
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.timezone import now_br
+
+# (log_id, timestamp, message_text, response_text)
+ContextEntry = Tuple[int, datetime, Optional[str], Optional[str]]
+
+
+def _now_naive() -> datetime:
+    # chat_logs.timestamp é gravado sem timezone, já no horário de Brasília
+    return now_br().replace(tzinfo=None)
+
+
+def _naive(dt: datetime) -> datetime:
+    if dt is not None and dt.tzinfo is not None:
+        return dt.astimezone(now_br().tzinfo).replace(tzinfo=None)
+    return dt
+
+
+class _UserContext:
+    __slots__ = ("entries", "loaded_at")
+
+    def __init__(self, entries: Dict[int, ContextEntry]):
+        self.entries = entries
+        self.loaded_at = time.monotonic()
+
+
+class ChatContextCache:
+    """
+    LRU de contextos por usuário, com expiração por idade.
+
+    - Mensagens mais antigas que a janela (window_minutes) são descartadas na leitura.
+    - Cada usuário é recarregado do banco após ttl_seconds, o que limita a
+      defasagem quando mais de uma réplica do worker atende o mesmo usuário.
+    - Acima de max_users, o usuário menos usado recentemente sai do cache.
+    """
+
+    def __init__(self, max_users: int, window_minutes: int, ttl_seconds: float):
+        self.max_users = max_users
+        self.window = timedelta(minutes=window_minutes)
+        self.ttl_seconds = ttl_seconds
+        self._users: "OrderedDict[int, _UserContext]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _prune(self, ctx: _UserContext, limit_time: datetime):
+        expired = [log_id for log_id, entry in ctx.entries.items() if entry[1] and entry[1] < limit_time]
+        for log_id in expired:
+            del ctx.entries[log_id]
+
+    def get(self, user_id: int) -> Optional[List[ContextEntry]]:
+        """Entradas da janela em ordem cronológica; None se não estiver no cache."""
+        with self._lock:
+            ctx = self._users.get(user_id)
+            if ctx is None or time.monotonic() - ctx.loaded_at > self.ttl_seconds:
+                if ctx is not None:
+                    del self._users[user_id]
+                self.misses += 1
+                return None
+
+            self._users.move_to_end(user_id)
+            self._prune(ctx, _now_naive() - self.window)
+            self.hits += 1
+            return sorted(ctx.entries.values(), key=lambda entry: (entry[1], entry[0]))
+
+    def load(self, user_id: int, entries: List[ContextEntry]):
+        """Popula o cache com o resultado da consulta ao banco (janela completa)."""
+        with self._lock:
+            self._users[user_id] = _UserContext({entry[0]: entry for entry in entries})
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+
+    def append(self, user_id: int, log_id: int, timestamp: datetime,
+               message_text: Optional[str], response_text: Optional[str] = None):
+        """Adiciona uma mensagem nova (só se o usuário já estiver no cache)."""
+        with self._lock:
+            ctx = self._users.get(user_id)
+            if ctx is not None:
+                ctx.entries[log_id] = (log_id, _naive(timestamp) or _now_naive(), message_text, response_text)
+
+    def update(self, user_id: int, log_id: int, message_text: Optional[str] = None,
+               response_text: Optional[str] = None):
+        """Atualiza resposta/transcrição de uma mensagem já no cache."""
+        with self._lock:
+            ctx = self._users.get(user_id)
+            if ctx is None or log_id not in ctx.entries:
+                return
+            _, timestamp, old_text, old_response = ctx.entries[log_id]
+            ctx.entries[log_id] = (
+                log_id,
+                timestamp,
+                message_text if message_text is not None else old_text,
+                response_text if response_text is not None else old_response,
+            )
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"users": len(self._users), "hits": self.hits, "misses": self.misses}
+
+
+chat_context_cache = ChatContextCache(
+    max_users=settings.CONTEXT_CACHE_MAX_USERS,
+    window_minutes=settings.CHAT_CONTEXT_WINDOW_MINUTES,
+    ttl_seconds=settings.CONTEXT_CACHE_TTL_SECONDS
+)
@@ -0,0 +1,73 @@
+# Alterado: Novo módulo com o filtro em memória de IDs de mensagens recentes (API)
+# A Evolution reentrega o webhook quando a resposta demora; cada reentrega virava um
+# item novo na fila (nova chamada de até 180s ao n8n e resposta duplicada no WhatsApp).
+# A garantia entre processos é a chave primária de ingest_dedup (queue_service); este
+# filtro só descarta as repetições mais comuns antes de irem ao banco.
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable
+
+from app.core.config import settings
+
+
+class RecentIdsFilter:
+    """
+    Conjunto LRU de IDs já enfileirados, com expiração (ttl_seconds).
+
+    IDs só entram via remember(), chamado depois do commit: se o INSERT falhar, a
+    reentrega da Evolution ainda é aceita.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._ids: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.accepted = 0
+        self.memory_duplicates = 0
+        self.db_duplicates = 0
+
+    def seen(self, message_id: str) -> bool:
+        with self._lock:
+            expires_at = self._ids.get(message_id)
+            if expires_at is None:
+                return False
+            if time.monotonic() > expires_at:
+                del self._ids[message_id]
+                return False
+            return True
+
+    def remember(self, message_ids: Iterable[str]):
+        if self.max_size <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl_seconds
+        with self._lock:
+            for message_id in message_ids:
+                self._ids[message_id] = expires_at
+                self._ids.move_to_end(message_id)
+            while len(self._ids) > self.max_size:
+                self._ids.popitem(last=False)
+
+    def count(self, accepted: int = 0, memory_duplicates: int = 0, db_duplicates: int = 0):
+        with self._lock:
+            self.accepted += accepted
+            self.memory_duplicates += memory_duplicates
+            self.db_duplicates += db_duplicates
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "tracked_ids": len(self._ids),
+                "accepted": self.accepted,
+                "memory_duplicates": self.memory_duplicates,
+                "db_duplicates": self.db_duplicates,
+            }
+
+
+recent_message_ids = RecentIdsFilter(
+    max_size=settings.DEDUP_MEMORY_MAX_IDS,
+    ttl_seconds=settings.DEDUP_MEMORY_TTL_SECONDS
+)
@@ -1,11 +1,23 @@
 import httpx
+import time
 from app.core.config import settings
+from app.core.metrics import observe_upstream
+from app.core.http_clients import get_client, get_async_client, EVOLUTION
 import logging
 
 logger = logging.getLogger("EvolutionService")
 
-def send_message(phone: str, text: str):
-    url = f"{settings.EVOLUTION_API_URL}/message/sendText/{settings.EVOLUTION_INSTANCE_NAME}"
+# Alterado: Resultado do envio para a fila de envio decidir se vale tentar de novo.
+# 4xx (número inválido, payload recusado) não muda numa nova tentativa; 408/429,
+# 5xx, timeout e erro de conexão são transitórios.
+SEND_OK = "ok"
+SEND_RETRY = "retry"
+SEND_REJECTED = "rejected"
+_RETRYABLE_4XX = (408, 429)
+
+def _build_request(phone: str, text: str, instance: str = None):
+    # Alterado: Instância configurável por chamada (fila de envio com limite por instância)
+    url = f"{settings.EVOLUTION_API_URL}/message/sendText/{instance or settings.EVOLUTION_INSTANCE_NAME}"
     headers = {
         "apikey": settings.EVOLUTION_API_KEY,
         "Content-Type": "application/json"
@@ -19,16 +31,48 @@ def send_message(phone: str, text: str):
         },
         "text": text
     }
-    
+    return url, headers, body
+
+def _handle_response(phone: str, response: httpx.Response, started: float) -> str:
+    logger.info(f"Mensagem enviada para {phone}: Status {response.status_code}")
+    if response.status_code != 201:
+        logger.error(f"Erro no envio Evolution: {response.text}")
+        observe_upstream(EVOLUTION, started, "error")
+        if 400 <= response.status_code < 500 and response.status_code not in _RETRYABLE_4XX:
+            return SEND_REJECTED
+        return SEND_RETRY
+    observe_upstream(EVOLUTION, started, "ok")
+    return SEND_OK
+
+def _handle_exception(e: Exception, started: float) -> str:
+    logger.error(f"Exceção ao enviar mensagem Evolution: {e}")
+    # Alterado: Latência e resultado do envio para o /metrics
+    observe_upstream(EVOLUTION, started, "timeout" if isinstance(e, httpx.TimeoutException) else "error")
+    return SEND_RETRY
+
+def send_message(phone: str, text: str, instance: str = None):
+    return deliver_message(phone, text, instance) == SEND_OK
+
+def deliver_message(phone: str, text: str, instance: str = None) -> str:
+    """Como send_message, mas retorna SEND_OK, SEND_RETRY ou SEND_REJECTED."""
+    url, headers, body = _build_request(phone, text, instance)
+    started = time.monotonic()
+
+    try:
+        # Importante: Como chamaremos isso dentro de threads, usamos o cliente síncrono.
+        # Alterado: Cliente compartilhado (thread-safe) com keep-alive, timeout via EVOLUTION_TIMEOUT
+        response = get_client(EVOLUTION).post(url, headers=headers, json=body)
+        return _handle_response(phone, response, started)
+    except Exception as e:
+        return _handle_exception(e, started)
+
+async def send_message_async(phone: str, text: str, instance: str = None):
+    # Alterado: Versão assíncrona de send_message para o engine asyncio
+    url, headers, body = _build_request(phone, text, instance)
+    started = time.monotonic()
+
     try:
-        # Importante: Como chamaremos isso dentro de threads, podemos usar httpx.post síncrono ou assíncrono.
-        # Por simplicidade e compatibilidade com o worker atual (threading), usarei síncrono.
-        response = httpx.post(url, headers=headers, json=body, timeout=10.0)
-        logger.info(f"Mensagem enviada para {phone}: Status {response.status_code}")
-        if response.status_code != 201:
-            logger.error(f"Erro no envio Evolution: {response.text}")
-            return False
-        return True
+        response = await get_async_client(EVOLUTION).post(url, headers=headers, json=body)
+        return _handle_response(phone, response, started) == SEND_OK
     except Exception as e:
-        logger.error(f"Exceção ao enviar mensagem Evolution: {e}")
-        return False
+        return _handle_exception(e, started) == SEND_OK
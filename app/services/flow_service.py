@@ -1,58 +1,78 @@
+from sqlalchemy import and_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import Session
 from app.models.all_models import User, ChatLog
-from app.services.evolution_service import send_message
+from app.services.outbound_service import enqueue_message
 # Alterado: Importando now_br do módulo timezone para usar horário de Brasília
 from datetime import timedelta
 from app.core.timezone import now_br
+from app.core.config import settings
+from app.services.context_cache import chat_context_cache
+from app.services.user_cache import user_cache, UserRecord
+from typing import Callable
 import logging
 
 logger = logging.getLogger("UserFlow")
 
-def get_or_create_user(db: Session, phone: str, push_name: str):
-    user = db.query(User).filter(User.phone == phone).first()
-    
-    if not user:
-        # Cria usuário direto (conceito de Lead está implícito em is_client=False)
-        user = User(phone=phone, name=push_name, is_client=False)
-        db.add(user)
-        db.commit()
-        db.refresh(user)
-    else:
-        # Atualiza nome se vier diferente e não tiver nome salvo?
-        # Por enquanto mantemos o original ou atualizamos. Vamos atualizar se o push_name vier.
-        if push_name and user.name != push_name:
-            user.name = push_name
-            db.commit()
-            
-    return user
+# Alterado: Função usada para avisar o usuário (telefone, texto) -> sucesso.
+# Padrão: entrega à fila de envio (app/services/outbound_service.py), que retorna na
+# hora; o envio pela Evolution acontece nas threads da fila.
+Notifier = Callable[[str, str], bool]
+
+_USER_COLUMNS = (User.id, User.phone, User.name, User.is_client,
+                 User.is_blocked, User.is_compliant, User.is_canceled)
+
+def get_or_create_user(db: Session, phone: str, push_name: str) -> UserRecord:
+    # Alterado: Cache com TTL na frente do banco. Se o usuário está no cache e o nome
+    # não mudou, nenhuma consulta é feita.
+    cached = user_cache.get(phone)
+    if cached is not None and (not push_name or cached.name == push_name):
+        return cached
 
-def process_lead_logic(db: Session, user: User, message_text: str):
+    # Alterado: Criação/atualização atômica em um único comando (sem corrida no índice
+    # único de phone quando duas mensagens de um telefone novo chegam juntas).
+    # Cria usuário direto (conceito de Lead está implícito em is_client=False)
+    # Atualiza o nome só se o push_name vier e for diferente do salvo.
+    stmt = pg_insert(User).values(phone=phone, name=push_name, is_client=False)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[User.phone],
+        set_={"name": stmt.excluded.name},
+        where=and_(stmt.excluded.name.isnot(None), User.name.is_distinct_from(stmt.excluded.name))
+    ).returning(*_USER_COLUMNS)
+
+    row = db.execute(stmt).first()
+    if row is None:
+        # Já existia e nada mudou (o WHERE evitou um UPDATE inútil): só lê
+        row = db.query(*_USER_COLUMNS).filter(User.phone == phone).one()
+    db.commit()
+
+    record = UserRecord(*row)
+    user_cache.put(record)
+    return record
+
+def process_lead_logic(db: Session, user: UserRecord, message_text: str, notify: Notifier = enqueue_message):
     """
     Regra: Lead (is_client=False) tem limite de 3 respostas da IA.
     Na 4ª requisição, recebe mensagem de limite atingido.
     
-    Alterado: Conta registros onde response_text NÃO é nulo,
-    pois a resposta da IA é salva no mesmo registro da mensagem do usuário.
+    Alterado: Lê o contador users.ai_response_count (busca O(1) pela chave primária)
+    em vez de contar os registros de chat_logs com response_text não nulo.
     """
     
-    # Alterado: Conta mensagens que JÁ RECEBERAM resposta da IA
-    # (response_text não é nulo indica que a IA já respondeu)
-    bot_responses = db.query(ChatLog).filter(
-        ChatLog.user_id == user.id, 
-        ChatLog.response_text != None  # Conta apenas onde a IA já respondeu
-    ).count()
+    # Alterado: Lido sempre do banco (não do cache de usuários) para refletir respostas recentes
+    bot_responses = db.query(User.ai_response_count).filter(User.id == user.id).scalar() or 0
     
     logger.info(f"Lead {user.phone}: já tem {bot_responses} respostas da IA (limite: 3)")
     
     # Se JÁ TIVER 3 ou mais respostas, bloqueia.
     if bot_responses >= 3:
-        send_message(user.phone, "Você atingiu o limite de interações gratuitas. Faça sua assinatura em https://jeronimo.app.br/.")
+        notify(user.phone, "Você atingiu o limite de interações gratuitas. Faça sua assinatura em https://jeronimo.app.br/.")
         logger.info(f"Lead {user.phone} bloqueado: atingiu limite de 3 respostas gratuitas")
         return False # Interrompe fluxo
     else:
         return True # Segue fluxo
 
-def check_block_and_compliant(db: Session, user: User):
+def check_block_and_compliant(db: Session, user: UserRecord, notify: Notifier = enqueue_message):
     """
     Verifica se o usuário pode continuar o fluxo.
     
@@ -68,55 +88,60 @@ def check_block_and_compliant(db: Session, user: User):
     # Alterado: Verificação de is_canceled (nova validação)
     # NULL ou FALSE = continua fluxo; TRUE = interrompe
     if user.is_canceled == True:
-        send_message(user.phone, "Sua assinatura foi cancelada. Renove sua assinatura no seu painel da Kiwify para acessar o Jerônimo novamente: https://dashboard.kiwify.com/login")
+        notify(user.phone, "Sua assinatura foi cancelada. Renove sua assinatura no seu painel da Kiwify para acessar o Jerônimo novamente: https://dashboard.kiwify.com/login")
         logger.info(f"Usuário {user.phone} bloqueado: assinatura cancelada")
         return False
     
     # Alterado: Verificação de is_blocked
     # NULL ou FALSE = continua fluxo; TRUE = interrompe
     if user.is_blocked == True:
-        send_message(user.phone, "Seu acesso foi bloqueado. Entre em contato com o suporte pelo email suporte@jeronimo.app.br")
+        notify(user.phone, "Seu acesso foi bloqueado. Entre em contato com o suporte pelo email suporte@jeronimo.app.br")
         logger.info(f"Usuário {user.phone} bloqueado: is_blocked=True")
         return False
     
     # Alterado: Verificação de is_compliant
     # NULL ou FALSE = inadimplente (interrompe); TRUE = adimplente (continua)
     if user.is_compliant != True:  # NULL ou FALSE → inadimplente
-        send_message(user.phone, "Você está atrasado com sua assinatura. Regularize sua assinatura no seu painel da Kiwify para acessar o Jerônimo novamente: https://dashboard.kiwify.com/login")
+        notify(user.phone, "Você está atrasado com sua assinatura. Regularize sua assinatura no seu painel da Kiwify para acessar o Jerônimo novamente: https://dashboard.kiwify.com/login")
         logger.info(f"Usuário {user.phone} bloqueado: inadimplente (is_compliant={user.is_compliant})")
         return False
         
     return True
 
 def get_chat_context(db: Session, user_id: int, exclude_message_id: int = None):
-    # Passo 4: Conversas nos últimos 30 min
-    # Alterado: Usando now_br() para garantir timezone de Brasília (-3)
-    limit_time = now_br() - timedelta(minutes=30)
-    
-    query = db.query(ChatLog).filter(
-        ChatLog.user_id == user_id,
-        ChatLog.timestamp >= limit_time
-    )
-    
-    # Exclui a mensagem atual do contexto (pois ela vai em 'pergunta-do-usuario-atual')
-    if exclude_message_id:
-        query = query.filter(ChatLog.id != exclude_message_id)
-        
-    logs = query.order_by(ChatLog.timestamp.asc()).all()
-    
-    if not logs:
-        return ""
-        
-    formatted = ""
-    for log in logs:
+    # Passo 4: Conversas nos últimos 30 min (CHAT_CONTEXT_WINDOW_MINUTES)
+    # Alterado: Lê do cache em memória; só consulta chat_logs quando o usuário não está
+    # no cache (a consulta traz a janela inteira, que passa a ser mantida incrementalmente)
+    entries = chat_context_cache.get(user_id)
+
+    if entries is None:
+        # Alterado: Usando now_br() para garantir timezone de Brasília (-3)
+        limit_time = now_br() - timedelta(minutes=settings.CHAT_CONTEXT_WINDOW_MINUTES)
+
+        # Só as colunas usadas no prompt (sem media_data)
+        entries = [tuple(row) for row in db.query(
+            ChatLog.id, ChatLog.timestamp, ChatLog.message_text, ChatLog.response_text
+        ).filter(
+            ChatLog.user_id == user_id,
+            ChatLog.timestamp >= limit_time
+        ).order_by(ChatLog.timestamp.asc()).all()]
+
+        chat_context_cache.load(user_id, entries)
+
+    parts = []
+    for log_id, _, message_text, response_text in entries:
+        # Exclui a mensagem atual do contexto (pois ela vai em 'pergunta-do-usuario-atual')
+        if exclude_message_id and log_id == exclude_message_id:
+            continue
+
         # Formato: Pergunta + Resposta (se houver)
-        if log.message_text:
-            formatted += f"Usuário: {log.message_text}\n"
+        if message_text:
+            parts.append(f"Usuário: {message_text}\n")
         
-        if log.response_text:
-            formatted += f"Resposta da IA: {log.response_text}\n\n"
+        if response_text:
+            parts.append(f"Resposta da IA: {response_text}\n\n")
             
-    return formatted
+    return "".join(parts)
 
 def save_chat_log(db: Session, user_id: int, text: str, sent_by_user: bool = True, 
                   message_type: str = "text", media_data: str = None, evolution_id: str = None):
@@ -131,14 +156,24 @@ def save_chat_log(db: Session, user_id: int, text: str, sent_by_user: bool = Tru
     db.add(log)
     db.commit()
     db.refresh(log)
+    chat_context_cache.append(user_id, log.id, log.timestamp, log.message_text)
     return log
 
 def update_chat_log_with_response(db: Session, log_id: int, response: str, transcription: str = None):
     log = db.query(ChatLog).filter(ChatLog.id == log_id).first()
     if log:
+        first_answer = log.response_text is None
         log.response_text = response
         if transcription:
             log.message_text = transcription
+
+        # Alterado: Incrementa o contador de respostas na mesma transação (atômico no banco)
+        if first_answer and response is not None and log.user_id:
+            db.query(User).filter(User.id == log.user_id).update(
+                {User.ai_response_count: User.ai_response_count + 1},
+                synchronize_session=False
+            )
         db.commit()
         db.refresh(log)
+        chat_context_cache.update(log.user_id, log.id, message_text=transcription, response_text=response)
     return log
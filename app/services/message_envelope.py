@@ -0,0 +1,149 @@
+# Alterado: Novo módulo com o envelope da mensagem da Evolution, extraído uma única vez
+# A navegação payload -> body/data -> key.remoteJid / message.conversation ... era repetida
+# na ingestão (queue_service), no worker (prepare_request e agrupamento) e no dashboard,
+# cada uma percorrendo o JSON de novo. Agora a ingestão monta um MessageEnvelope e o grava
+# em request_queue.envelope; worker e dashboard leem o envelope sem tocar no payload.
+# Linhas antigas (envelope nulo) são interpretadas do payload na hora (MessageEnvelope.load).
+
+from typing import Any, Dict, Optional
+
+# Tipos de mensagem pela chave presente em message (na ordem de prioridade)
+TEXT_KEYS = ("conversation", "extendedTextMessage")
+KNOWN_TYPES = ("conversation", "extendedTextMessage", "audioMessage")
+
+KIND_TEXT = "text"
+KIND_AUDIO = "audio"
+
+
+def _message_data(payload: dict) -> dict:
+    # 'data' vem em body.data (webhook encapsulado) ou na raiz (padrão Evolution)
+    body = payload.get("body")
+    data = body.get("data") if isinstance(body, dict) else None
+    if not isinstance(data, dict) or not data:
+        data = payload.get("data")
+    return data if isinstance(data, dict) else {}
+
+
+def payload_message(payload: dict) -> dict:
+    """Objeto 'message' do webhook ({} se ausente)."""
+    message = _message_data(payload).get("message")
+    return message if isinstance(message, dict) else {}
+
+
+def media_ref_from_message(message: dict) -> Optional[str]:
+    """
+    Referência do áudio no blob store ('base64_ref', gravada por offload_payload_media);
+    em payloads antigos (ou base64 inválido) o próprio base64 em linha.
+    """
+    audio = message.get("audioMessage")
+    audio = audio if isinstance(audio, dict) else {}
+    return audio.get("base64_ref") or message.get("base64_ref") or audio.get("base64")
+
+
+class MessageEnvelope:
+    """
+    Campos da mensagem usados pelo fluxo.
+
+    - message_type: tipo pela chave presente na mensagem (conversation,
+      extendedTextMessage, audioMessage) ou, se nenhuma, o messageType informado;
+      é o valor da coluna request_queue.message_type.
+    - declared_type: messageType como veio da Evolution (enviado ao n8n e ao chat_logs).
+    - kind: "audio", "text" ou None (tipo não suportado).
+    - media_ref: referência do áudio no blob store (só para kind == "audio").
+    """
+
+    __slots__ = ("phone", "push_name", "evolution_id", "message_type", "declared_type",
+                 "kind", "text", "media_ref")
+
+    def __init__(self, phone: Optional[str], push_name: Optional[str], evolution_id: Optional[str],
+                 message_type: Optional[str], declared_type: Optional[str], kind: Optional[str],
+                 text: str, media_ref: Optional[str]):
+        self.phone = phone
+        self.push_name = push_name
+        self.evolution_id = evolution_id
+        self.message_type = message_type
+        self.declared_type = declared_type
+        self.kind = kind
+        self.text = text
+        self.media_ref = media_ref
+
+    @classmethod
+    def from_payload(cls, payload: Any) -> "MessageEnvelope":
+        """Interpreta o webhook da Evolution (uma única passada pelo JSON)."""
+        data = _message_data(payload) if isinstance(payload, dict) else {}
+        key = data.get("key")
+        key = key if isinstance(key, dict) else {}
+        message = data.get("message")
+        message = message if isinstance(message, dict) else {}
+
+        remote_jid = key.get("remoteJid") or ""
+        declared_type = data.get("messageType")
+
+        message_type = declared_type
+        for known_type in KNOWN_TYPES:
+            if known_type in message:
+                message_type = known_type
+                break
+
+        # Áudio tem precedência (mesma regra do worker antes do envelope)
+        if "audioMessage" in message:
+            kind = KIND_AUDIO
+        elif any(text_key in message for text_key in TEXT_KEYS):
+            kind = KIND_TEXT
+        else:
+            kind = None
+
+        extended = message.get("extendedTextMessage")
+        text = message.get("conversation") or \
+               (extended.get("text") if isinstance(extended, dict) else None) or \
+               ""
+
+        return cls(
+            phone=remote_jid.split("@")[0] or None,
+            push_name=data.get("pushName"),
+            evolution_id=key.get("id"),
+            message_type=message_type,
+            declared_type=declared_type,
+            kind=kind,
+            text=text,
+            media_ref=media_ref_from_message(message) if kind == KIND_AUDIO else None,
+        )
+
+    @classmethod
+    def from_dict(cls, values: Dict[str, Any]) -> "MessageEnvelope":
+        envelope = cls(*(values.get(name) for name in cls.__slots__))
+        # to_dict omite texto vazio
+        envelope.text = envelope.text or ""
+        return envelope
+
+    @classmethod
+    def load(cls, envelope: Optional[Dict[str, Any]], payload: Any = None) -> "MessageEnvelope":
+        """Envelope gravado na ingestão; linhas antigas (sem envelope) caem no payload."""
+        if envelope:
+            return cls.from_dict(envelope)
+        return cls.from_payload(payload)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Formato gravado em request_queue.envelope (sem chaves vazias)."""
+        values = {}
+        for name in self.__slots__:
+            value = getattr(self, name)
+            if value is not None and value != "":
+                values[name] = value
+        return values
+
+    def queue_columns(self) -> Dict[str, Optional[str]]:
+        """Colunas indexadas de request_queue preenchidas a partir do envelope."""
+        return {"phone": self.phone, "evolution_id": self.evolution_id, "message_type": self.message_type}
+
+    @property
+    def is_audio(self) -> bool:
+        return self.kind == KIND_AUDIO
+
+    @property
+    def is_text(self) -> bool:
+        return self.kind == KIND_TEXT
+
+    def __repr__(self) -> str:
+        return (f"MessageEnvelope(phone={self.phone!r}, evolution_id={self.evolution_id!r}, "
+                f"message_type={self.message_type!r}, kind={self.kind!r})")
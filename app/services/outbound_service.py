@@ -0,0 +1,257 @@
+# Alterado: Novo módulo com a fila de envio de mensagens para o WhatsApp (Evolution)
+# Antes, send_message era chamado dentro do worker (e das regras do flow_service): cada
+# envio segurava a thread até a Evolution responder (delay de 1200ms + até 10s de timeout).
+# Agora o worker só entrega a mensagem a esta fila e segue. Threads de envio dedicadas
+# (OUTBOUND_WORKERS) respeitam um token bucket por instância da Evolution e fazem
+# retentativas com backoff na própria thread, antes da próxima mensagem (a ordem de
+# entrega por usuário vale também quando um envio falha). A latência e a profundidade
+# da fila de envio ficam em stats(), separadas da latência do n8n.
+#
+# A fila é em memória (como o gravador de passos): stop() drena o que restou no
+# encerramento do processo; mensagens ainda na fila se o processo morrer são perdidas.
+# Alterado: Mensagens da fila carregam o queue_id do item; se a entrega falhar de vez
+# (retentativas esgotadas, 4xx, fila cheia ou sobra no stop) o item ganha um passo
+# SEND_FAILED em processing_logs, para a resposta não entregue ser vista e reenviada.
+
+import atexit
+import functools
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from app.core.config import settings
+from app.services.evolution_service import deliver_message, SEND_OK, SEND_REJECTED
+from app.workers.step_log_writer import step_log_writer
+
+logger = logging.getLogger("OutboundService")
+
+
+class TokenBucket:
+    """Token bucket thread-safe: 'rate' envios/s, com rajada de até 'burst'."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """Bloqueia até haver um token disponível."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+@dataclass
+class OutboundMessage:
+    phone: str
+    text: str
+    instance: str
+    queue_id: Optional[int] = None
+    enqueued_at: float = field(default_factory=time.monotonic)
+    attempts: int = 0
+
+
+class OutboundSender:
+    """
+    Fila de envio com N threads. Mensagens do mesmo telefone vão sempre para a mesma
+    thread (hash do telefone), preservando a ordem de entrega por usuário.
+    """
+
+    def __init__(self, workers: int, max_queue: int, max_retries: int, retry_base_delay: float,
+                 default_rate: float, burst: int, instance_rates: Dict[str, float]):
+        self.workers = max(1, workers)
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.default_rate = default_rate
+        self.burst = burst
+        self.instance_rates = instance_rates
+        self._queues: List["queue.Queue"] = [queue.Queue(maxsize=max_queue) for _ in range(self.workers)]
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.dropped = 0
+        self._latency_sum = 0.0
+        self._latency_max = 0.0
+        self._queue_wait_sum = 0.0
+
+    # --- API pública --------------------------------------------------------
+
+    def send(self, phone: str, text: str, instance: Optional[str] = None,
+             queue_id: Optional[int] = None) -> bool:
+        """
+        Enfileira a mensagem e retorna na hora (compatível com Notifier).
+        Retorna False se a fila estiver cheia (mensagem descartada).
+        queue_id: item de origem, que recebe o passo SEND_FAILED se a entrega falhar.
+        """
+        self._ensure_started()
+        message = OutboundMessage(phone, text, instance or settings.EVOLUTION_INSTANCE_NAME, queue_id)
+        return self._put(message)
+
+    def stats(self) -> dict:
+        with self._lock:
+            delivered = self.sent + self.failed
+            return {
+                "queued": sum(q.qsize() for q in self._queues),
+                "sent": self.sent,
+                "failed": self.failed,
+                "retried": self.retried,
+                "dropped": self.dropped,
+                "avg_send_latency": round(self._latency_sum / delivered, 3) if delivered else 0.0,
+                "max_send_latency": round(self._latency_max, 3),
+                "avg_queue_wait": round(self._queue_wait_sum / delivered, 3) if delivered else 0.0,
+            }
+
+    def stop(self, timeout: float = 30.0):
+        """Envia o que restou na fila e encerra as threads."""
+        if not self._threads:
+            return
+        # Retentativas em espera de backoff acordam na hora (uma última tentativa)
+        self._stop.set()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(timeout=max(0.0, deadline - time.monotonic()))
+        self._threads = []
+        # Sobra de threads que não terminaram no prazo: registra como não entregue
+        for work in self._queues:
+            while True:
+                try:
+                    message = work.get_nowait()
+                except queue.Empty:
+                    break
+                with self._lock:
+                    self.dropped += 1
+                self._record_failure(message, "Fila de envio encerrada antes da entrega")
+        logger.info(f"Fila de envio encerrada: {self.stats()}")
+
+    # --- Internos -----------------------------------------------------------
+
+    def _ensure_started(self):
+        if self._threads:
+            return
+        with self._lock:
+            if not self._threads:
+                self._stop.clear()
+                for index in range(self.workers):
+                    thread = threading.Thread(target=self._run, args=(index,), name=f"outbound-{index}", daemon=True)
+                    thread.start()
+                    self._threads.append(thread)
+
+    def _put(self, message: OutboundMessage) -> bool:
+        try:
+            self._queues[hash(message.phone) % self.workers].put_nowait(message)
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            logger.error(f"Fila de envio cheia; mensagem para {message.phone} descartada")
+            self._record_failure(message, "Fila de envio cheia; mensagem descartada")
+            return False
+
+    def _record_failure(self, message: OutboundMessage, reason: str):
+        if message.queue_id is None:
+            return
+        step_log_writer.write(message.queue_id, "SEND_FAILED", "error",
+                              f"{reason} (tentativas: {message.attempts}): {message.text}")
+
+    def _bucket(self, instance: str) -> TokenBucket:
+        with self._lock:
+            bucket = self._buckets.get(instance)
+            if bucket is None:
+                rate = self.instance_rates.get(instance, self.default_rate)
+                bucket = TokenBucket(rate, self.burst)
+                self._buckets[instance] = bucket
+            return bucket
+
+    def _wait_retry(self, message: OutboundMessage):
+        # Alterado: Backoff na própria thread do shard (antes um Timer recolocava a mensagem
+        # no fim da fila, e mensagens seguintes ao mesmo usuário passavam na frente dela).
+        # As demais mensagens do shard esperam junto; no stop() a espera termina na hora.
+        delay = self.retry_base_delay * (2 ** (message.attempts - 1))
+        with self._lock:
+            self.retried += 1
+        logger.warning(f"Falha no envio para {message.phone} (tentativa {message.attempts}); nova tentativa em {delay:.1f}s")
+        self._stop.wait(delay)
+
+    def _deliver(self, message: OutboundMessage):
+        while True:
+            self._bucket(message.instance).acquire()
+            message.attempts += 1
+            started = time.monotonic()
+            result = deliver_message(message.phone, message.text, instance=message.instance)
+            latency = time.monotonic() - started
+            ok = result == SEND_OK
+
+            # Alterado: 4xx não é repetido (não muda e seguraria o shard inteiro no backoff)
+            if ok or result == SEND_REJECTED or message.attempts > self.max_retries or self._stop.is_set():
+                break
+            self._wait_retry(message)
+
+        with self._lock:
+            if ok:
+                self.sent += 1
+            else:
+                self.failed += 1
+            self._latency_sum += latency
+            self._latency_max = max(self._latency_max, latency)
+            self._queue_wait_sum += started - message.enqueued_at
+        if not ok:
+            logger.error(f"Mensagem para {message.phone} não entregue após {message.attempts} tentativa(s)")
+            reason = "Recusada pela Evolution (4xx)" if result == SEND_REJECTED else "Retentativas esgotadas"
+            self._record_failure(message, reason)
+
+    def _run(self, index: int):
+        work = self._queues[index]
+        while not (self._stop.is_set() and work.empty()):
+            try:
+                message = work.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                self._deliver(message)
+            except Exception as e:
+                logger.error(f"Erro inesperado no envio para {message.phone}: {e}")
+                self._record_failure(message, f"Erro inesperado: {e}")
+
+
+outbound_sender = OutboundSender(
+    workers=settings.OUTBOUND_WORKERS,
+    max_queue=settings.OUTBOUND_MAX_QUEUE,
+    max_retries=settings.OUTBOUND_MAX_RETRIES,
+    retry_base_delay=settings.OUTBOUND_RETRY_BASE_DELAY_SECONDS,
+    default_rate=settings.EVOLUTION_SEND_RATE_PER_SECOND,
+    burst=settings.EVOLUTION_SEND_BURST,
+    instance_rates=settings.EVOLUTION_SEND_RATES
+)
+
+# Garante o envio do que restou mesmo se o processo encerrar sem chamar stop()
+atexit.register(outbound_sender.stop)
+
+
+def enqueue_message(phone: str, text: str, queue_id: Optional[int] = None) -> bool:
+    """Notifier padrão do fluxo: entrega a mensagem à fila de envio e retorna na hora."""
+    return outbound_sender.send(phone, text, queue_id=queue_id)
+
+
+def request_notifier(queue_id: int):
+    """Notifier ligado ao item: falhas de entrega viram o passo SEND_FAILED do item."""
+    return functools.partial(enqueue_message, queue_id=queue_id)
@@ -1,27 +1,297 @@
+from sqlalchemy import text, insert, func
 from sqlalchemy.orm import Session
+from datetime import timedelta
+from typing import List, Optional, Sequence, Set, Tuple
 from app.models.all_models import RequestQueue
+from app.core.config import settings
+from app.core.timezone import now_br
+from app.core.metrics import queue_pickup_lag
+from app.services.blob_store import offload_payload_media
+from app.services.message_envelope import MessageEnvelope, media_ref_from_message, payload_message
+from app.services.dedup_service import recent_message_ids
 import json
+import logging
 
-def add_to_queue(db: Session, payload: dict):
+logger = logging.getLogger(__name__)
+
+# Alterado: Canal do Postgres LISTEN/NOTIFY usado para acordar o agent_manager
+# assim que um item entra na fila (em vez de esperar o próximo ciclo de polling)
+QUEUE_NOTIFY_CHANNEL = "request_queue_new"
+
+# Alterado: Reivindicação atômica de itens da fila.
+# O SELECT interno trava as linhas escolhidas (FOR UPDATE) e pula as que outro
+# processo já travou (SKIP LOCKED); o UPDATE marca como 'processing' no mesmo comando.
+# Assim, vários containers do agent_manager podem rodar ao mesmo tempo sem que
+# dois deles peguem a mesma mensagem. Só os IDs voltam (nada de carregar o payload).
+# Alterado: Só reivindica itens vencidos (next_attempt_at de retentativas com backoff) e grava
+# claimed_at, usado pelo reaper (visibility timeout) para devolver itens travados à fila
+CLAIM_PENDING_SQL = text("""
+    UPDATE request_queue
+    SET status = 'processing', updated_at = :now, claimed_at = :now
+    WHERE id IN (
+        SELECT id
+        FROM request_queue
+        WHERE status = 'pending'
+          AND created_at <= :due_before
+          AND (next_attempt_at IS NULL OR next_attempt_at <= :now)
+          AND coalesced_into IS NULL
+        ORDER BY created_at ASC
+        LIMIT :limit
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, COALESCE(next_attempt_at, created_at) AS enqueued_at
+""")
+
+# Alterado: Devolve à fila itens reivindicados que o pool não aceitou (parando ou cheio),
+# sem esperar o reaper (VISIBILITY_TIMEOUT_SECONDS)
+RELEASE_CLAIMED_SQL = text("""
+    UPDATE request_queue
+    SET status = 'pending', updated_at = :now, claimed_at = NULL
+    WHERE id = ANY(:ids) AND status = 'processing'
+""")
+
+# Tipos de mensagem de texto (valores de request_queue.message_type)
+TEXT_MESSAGE_TYPES = ("conversation", "extendedTextMessage")
+
+# Alterado: Reivindica mensagens de TEXTO pendentes e mais novas do mesmo telefone,
+# para agrupá-las com o item que está sendo processado (COALESCE_WINDOW_SECONDS).
+# Usa as colunas indexadas phone/message_type (sem varrer o JSON do payload).
+# Alterado: Inclui as mensagens que já pertenciam ao grupo deste item (coalesced_into) numa
+# tentativa anterior; as agrupadas a outro item continuam com ele.
+CLAIM_SIBLINGS_SQL = text("""
+    UPDATE request_queue
+    SET status = 'processing', updated_at = :now, claimed_at = :now, coalesced_into = NULL
+    WHERE id IN (
+        SELECT id
+        FROM request_queue
+        WHERE status = 'pending'
+          AND phone = :phone
+          AND id > :after_id
+          AND message_type IN ('conversation', 'extendedTextMessage')
+          AND (coalesced_into IS NULL OR coalesced_into = :primary_id)
+          AND (next_attempt_at IS NULL OR next_attempt_at <= :now)
+        ORDER BY id ASC
+        LIMIT :limit
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, envelope, CASE WHEN envelope IS NULL THEN payload END AS payload, created_at
+""")
+
+# Alterado: Registra os IDs da Evolution (key.id) em ingest_dedup; reentregas batem na
+# chave primária e só incrementam duplicate_count. RETURNING informa quais são novos
+# (xmax = 0 só para linhas inseridas nesta instrução).
+REGISTER_MESSAGE_IDS_SQL = text("""
+    INSERT INTO ingest_dedup (evolution_id, created_at, duplicate_count)
+    SELECT message_id, :now, 0
+    FROM unnest(CAST(:message_ids AS varchar[])) AS message_id
+    ON CONFLICT (evolution_id) DO UPDATE
+        SET duplicate_count = ingest_dedup.duplicate_count + 1
+    RETURNING evolution_id, (xmax = 0) AS inserted
+""")
+
+def _get_event(payload: dict) -> Optional[str]:
     # Validar se é uma mensagem de interesse (ex: messages.upsert)
     # Tenta pegar evento direto da raiz (Padrão Evolution) ou de 'body' (caso venha encapsulado)
+    if not isinstance(payload, dict):
+        return None
+
     event = payload.get("event")
     
     if not event:
         body = payload.get("body", {})
         if isinstance(body, dict):
             event = body.get("event")
+
+    return event
+
+def parse_upsert(payload: dict) -> Optional[MessageEnvelope]:
+    """
+    Alterado: Envelope da mensagem (extraído uma única vez, na ingestão) se o webhook
+    for um messages.upsert; None para os demais eventos (não entram na fila).
+    """
+    if _get_event(payload) != "messages.upsert":
+        return None
+    return MessageEnvelope.from_payload(payload)
+
+def _queue_row(payload: dict, envelope: MessageEnvelope) -> dict:
+    # Alterado: O base64 de áudio vai para o blob store; a linha guarda só a referência
+    payload = offload_payload_media(payload)
+    if envelope.is_audio:
+        # O envelope foi montado antes do offload: passa a apontar para o blob
+        envelope.media_ref = media_ref_from_message(payload_message(payload))
+    return {
+        "payload": payload,
+        "envelope": envelope.to_dict(),
+        "status": "pending",
+        **envelope.queue_columns()
+    }
+
+def register_message_ids(db: Session, message_ids: List[str]) -> Set[str]:
+    """
+    Alterado: Registra os IDs em ingest_dedup (sem commit, na transação da inserção na
+    fila) e retorna só os que ainda não tinham sido recebidos.
+    """
+    unique_ids = sorted(set(message_ids))
+    if not unique_ids:
+        return set()
+
+    rows = db.execute(REGISTER_MESSAGE_IDS_SQL, {"now": now_br(), "message_ids": unique_ids}).fetchall()
+    new_ids = {row.evolution_id for row in rows if row.inserted}
+
+    duplicates = len(unique_ids) - len(new_ids)
+    recent_message_ids.count(accepted=len(new_ids), db_duplicates=duplicates)
+    if duplicates:
+        logger.info(f"{duplicates} mensagem(ns) reentregue(s) descartada(s) (já estavam na fila)")
+    return new_ids
+
+def add_to_queue(db: Session, payload: dict):
+    envelope = parse_upsert(payload)
     
-    if event == "messages.upsert":
-        # Extrair dados básicos para log rápido se necessário, 
-        # mas aqui salvamos o payload inteiro raw para processamento pelo worker
-        new_request = RequestQueue(
-            payload=payload,
-            status="pending"
-        )
+    if envelope is not None:
+        # Alterado: Reentrega do mesmo webhook (mesmo key.id) não gera item novo
+        if envelope.evolution_id and not register_message_ids(db, [envelope.evolution_id]):
+            db.commit()
+            return None
+
+        # Salvamos o payload inteiro raw (auditoria) e o envelope já extraído para o worker
+        new_request = RequestQueue(**_queue_row(payload, envelope))
         db.add(new_request)
+        db.flush()
+        # Alterado: NOTIFY dentro da mesma transação; o Postgres só entrega após o commit,
+        # então o gerenciador nunca acorda antes de a linha estar visível
+        notify_new_items(db, new_request.id)
         db.commit()
         db.refresh(new_request)
         return new_request
     
     return None
+
+
+def add_batch_to_queue(db: Session, messages: Sequence[Tuple[dict, MessageEnvelope]]) -> List[int]:
+    """
+    Alterado: Insere todas as mensagens de interesse de um webhook em UM único
+    INSERT multi-linha, numa única transação (antes era commit + refresh por mensagem).
+
+    Args:
+        db: sessão do banco
+        messages: pares (payload, envelope) de messages.upsert, já interpretados por
+            parse_upsert (os demais eventos ficam de fora)
+
+    Returns:
+        List[int]: IDs criados na fila (mensagens ignoradas não entram)
+    """
+    created_at = now_br()
+
+    # Alterado: Idempotência por key.id (reentregas da Evolution e repetições no lote)
+    new_ids = register_message_ids(db, [env.evolution_id for _, env in messages if env.evolution_id])
+    batch_ids = set()
+    rows = []
+    for payload, envelope in messages:
+        evo_id = envelope.evolution_id
+        if evo_id:
+            if evo_id not in new_ids or evo_id in batch_ids:
+                continue
+            batch_ids.add(evo_id)
+
+        rows.append({**_queue_row(payload, envelope), "created_at": created_at, "attempts": 0})
+
+    if not rows:
+        # Grava os contadores de duplicadas (ingest_dedup), se houver
+        db.commit()
+        return []
+
+    result = db.execute(insert(RequestQueue).values(rows).returning(RequestQueue.id))
+    item_ids = [row[0] for row in result]
+
+    # Um único NOTIFY acorda o gerenciador para o lote inteiro
+    notify_new_items(db, item_ids[-1])
+    db.commit()
+    return item_ids
+
+def notify_new_items(db: Session, item_id: int = None):
+    """Emite NOTIFY no canal da fila (entregue aos ouvintes no commit da transação)."""
+    db.execute(
+        text("SELECT pg_notify(:channel, :payload)"),
+        {"channel": QUEUE_NOTIFY_CHANNEL, "payload": str(item_id or "")}
+    )
+
+def claim_pending_items(db: Session, limit: int) -> List[int]:
+    """
+    Reivindica até `limit` itens pendentes de forma atômica e segura entre processos.
+
+    Args:
+        db: sessão do banco
+        limit: quantidade máxima de itens a reivindicar
+
+    Returns:
+        List[int]: IDs reivindicados (já marcados como 'processing'), em ordem crescente
+    """
+    if limit <= 0:
+        return []
+
+    now = now_br()
+    # Com a janela de agrupamento ativa, só entram itens que já "descansaram" a janela
+    due_before = now - timedelta(seconds=settings.COALESCE_WINDOW_SECONDS)
+
+    rows = db.execute(CLAIM_PENDING_SQL, {"limit": limit, "now": now, "due_before": due_before}).fetchall()
+    db.commit()
+
+    # Alterado: Atraso entre a entrada na fila (ou o vencimento da retentativa) e a
+    # reivindicação; inclui a janela de agrupamento. Gravados sem timezone, no horário de Brasília
+    naive_now = now.replace(tzinfo=None)
+    for row in rows:
+        queue_pickup_lag.observe(max(0.0, (naive_now - row.enqueued_at).total_seconds()))
+
+    # RETURNING não garante ordem; IDs crescentes seguem a ordem de chegada
+    return sorted(row[0] for row in rows)
+
+def release_claimed_items(db: Session, item_ids: List[int]):
+    """Devolve itens reivindicados (e ainda não iniciados) para 'pending'."""
+    if not item_ids:
+        return
+    db.execute(RELEASE_CLAIMED_SQL, {"ids": list(item_ids), "now": now_br()})
+    notify_new_items(db)
+    db.commit()
+
+def seconds_until_next_due(db: Session) -> Optional[float]:
+    """
+    Quanto tempo (s) até o próximo item pendente poder ser reivindicado.
+    None se não há pendentes. Usado para limitar o tempo de espera do LISTEN.
+    """
+    # Alterado: Considera também o next_attempt_at das retentativas agendadas
+    window = timedelta(seconds=settings.COALESCE_WINDOW_SECONDS)
+    due_at = db.query(func.min(func.greatest(
+        RequestQueue.created_at + window,
+        func.coalesce(RequestQueue.next_attempt_at, RequestQueue.created_at)
+    ))).filter(
+        RequestQueue.status == "pending",
+        # Agrupadas a um principal não são reivindicadas sozinhas
+        RequestQueue.coalesced_into.is_(None)
+    ).scalar()
+    if due_at is None:
+        return None
+
+    # created_at/next_attempt_at são gravados sem timezone, já no horário de Brasília
+    return max(0.0, (due_at - now_br().replace(tzinfo=None)).total_seconds())
+
+def claim_sibling_items(db: Session, primary_id: int, phone: str, after_id: int, limit: int):
+    """
+    Reivindica mensagens de texto pendentes do mesmo telefone com ID maior que after_id
+    (livres ou já agrupadas ao item primary_id numa tentativa anterior).
+
+    Returns:
+        Lista de linhas (id, envelope, payload, created_at), em ordem de chegada; payload só
+        vem preenchido em linhas antigas, sem envelope
+    """
+    if limit <= 0:
+        return []
+
+    rows = db.execute(CLAIM_SIBLINGS_SQL, {
+        "now": now_br(),
+        "primary_id": primary_id,
+        "after_id": after_id,
+        "phone": phone,
+        "limit": limit
+    }).fetchall()
+    db.commit()
+    return sorted(rows, key=lambda row: row[0])
@@ -0,0 +1,361 @@
+# Alterado: Novo módulo com circuit breaker e limite de concorrência adaptativo (AIMD)
+# Quando o n8n degradava, todos os workers ficavam presos até o timeout de 180s e as
+# falhas voltavam para a fila de uma vez. Agora:
+#   - CircuitBreaker: após N falhas seguidas o circuito abre e as chamadas são recusadas
+#     na hora (UpstreamUnavailable); o item é adiado, não marcado como falha. Depois de
+#     open_seconds uma única chamada de teste (half-open) decide se fecha de novo.
+#   - AIMDLimiter: limite de chamadas simultâneas ao n8n que cresce +1 por "janela" de
+#     sucessos rápidos e cai pela metade com erro ou latência acima do alvo. O alvo
+#     acompanha a mediana das chamadas recentes (latency_tolerance x p50).
+#   - reserve(): o worker reserva a vaga (UpstreamPermit) antes de preparar o item; se
+#     o fluxo parar antes da chamada, permit.cancel() devolve a vaga sem mexer no limite.
+
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import List, Tuple
+
+from app.core.config import settings
+from app.core.metrics import observe_upstream, upstream_requests
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class UpstreamUnavailable(Exception):
+    """Chamada recusada (circuito aberto ou limite de concorrência esgotado)."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int, open_seconds: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.rejected = 0
+        self.opened_count = 0
+
+    def _retry_after(self) -> float:
+        return max(0.0, self._opened_at + self.open_seconds - time.monotonic())
+
+    def allow(self):
+        """Levanta UpstreamUnavailable se a chamada não deve ser feita agora."""
+        with self._lock:
+            if self._state == OPEN:
+                if self._retry_after() > 0:
+                    self.rejected += 1
+                    raise UpstreamUnavailable(f"Circuito {self.name} aberto", self._retry_after())
+                self._state = HALF_OPEN
+
+            if self._state == HALF_OPEN:
+                # Só uma chamada de teste por vez enquanto o circuito está meio aberto
+                if self._probe_in_flight:
+                    self.rejected += 1
+                    raise UpstreamUnavailable(f"Circuito {self.name} em teste", self.open_seconds)
+                self._probe_in_flight = True
+
+    def is_open(self) -> bool:
+        with self._lock:
+            return self._state == OPEN and self._retry_after() > 0
+
+    def accepting(self) -> bool:
+        """Se uma chamada agora seria aceita (fechado, ou meio aberto sem teste em voo)."""
+        with self._lock:
+            if self._state == OPEN and self._retry_after() > 0:
+                return False
+            return self._state == CLOSED or not self._probe_in_flight
+
+    def retry_after(self) -> float:
+        with self._lock:
+            return self._retry_after()
+
+    def cancel_probe(self):
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._probe_in_flight = False
+            self._state = CLOSED
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    self.opened_count += 1
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            state = self._state
+            if state == OPEN and self._retry_after() <= 0:
+                state = HALF_OPEN
+            return {
+                "state": state,
+                "consecutive_failures": self._failures,
+                "retry_after": round(self._retry_after(), 1) if state == OPEN else 0.0,
+                "opened_count": self.opened_count,
+                "rejected": self.rejected,
+            }
+
+
+def _resolve_waiter(waiter: asyncio.Future):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+# Chamadas bem-sucedidas recentes usadas no p50, e mínimo de amostras para usá-lo
+LATENCY_WINDOW = 200
+LATENCY_MIN_SAMPLES = 20
+
+
+class AIMDLimiter:
+    def __init__(self, initial: int, min_limit: int, max_limit: int, latency_target: float,
+                 min_latency_target: float = 0.0, latency_tolerance: float = 2.0,
+                 decrease_cooldown: float = 5.0):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.initial_latency_target = latency_target
+        self.min_latency_target = min_latency_target
+        self.latency_tolerance = latency_tolerance
+        self.decrease_cooldown = decrease_cooldown
+        self._latencies: deque = deque(maxlen=LATENCY_WINDOW)
+        self._limit = float(initial)
+        self._in_flight = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+        # Alterado: Tarefas do engine async esperando vaga (loop, future); acordadas por
+        # release/release_unused via call_soon_threadsafe (antes: polling a cada 50ms)
+        self._async_waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    @property
+    def limit(self) -> int:
+        return max(self.min_limit, int(self._limit))
+
+    def free_slots(self) -> int:
+        with self._cond:
+            return max(0, self.limit - self._in_flight)
+
+    def _latency_target(self) -> float:
+        # Alterado: Alvo relativo ao comportamento observado (antes fixo em 60s, que contra
+        # um timeout de 180s só reduzia o limite depois de um minuto inteiro de degradação)
+        if len(self._latencies) < LATENCY_MIN_SAMPLES:
+            return self.initial_latency_target
+        ordered = sorted(self._latencies)
+        p50 = ordered[len(ordered) // 2]
+        return max(self.min_latency_target, p50 * self.latency_tolerance)
+
+    @property
+    def latency_target(self) -> float:
+        with self._cond:
+            return self._latency_target()
+
+    def try_acquire(self) -> bool:
+        with self._cond:
+            if self._in_flight < self.limit:
+                self._in_flight += 1
+                return True
+            return False
+
+    def acquire(self, timeout: float) -> bool:
+        """Versão bloqueante (threads). Retorna False se não houve vaga no tempo."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._in_flight >= self.limit:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            self._in_flight += 1
+            return True
+
+    async def acquire_async(self, timeout: float) -> bool:
+        """Versão para o engine asyncio (não bloqueia o event loop)."""
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._cond:
+                if self._in_flight < self.limit:
+                    self._in_flight += 1
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                # Registrado sob o lock: um release entre a checagem e a espera não se perde
+                waiter = loop.create_future()
+                self._async_waiters.append((loop, waiter))
+            try:
+                await asyncio.wait_for(waiter, remaining)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                with self._cond:
+                    if (loop, waiter) in self._async_waiters:
+                        self._async_waiters.remove((loop, waiter))
+
+    def _wake_waiters(self):
+        # Chamado com self._cond: uma thread bloqueada e todas as tarefas async reavaliam
+        # (o limite pode ter crescido); quem não conseguir vaga volta a esperar
+        self._cond.notify()
+        waiters, self._async_waiters = self._async_waiters, []
+        for loop, waiter in waiters:
+            loop.call_soon_threadsafe(_resolve_waiter, waiter)
+
+    def release(self, latency: float, ok: bool):
+        with self._cond:
+            self._in_flight -= 1
+            now = time.monotonic()
+            slow = latency > self._latency_target()
+            if ok:
+                # Lentas também entram: se o n8n ficar mais lento de vez, o alvo acompanha
+                self._latencies.append(latency)
+            if not ok or slow:
+                # Diminuição multiplicativa, no máximo uma vez por decrease_cooldown: as
+                # chamadas que já estavam em voo quando o n8n piorou não derrubam o limite a zero
+                if now - self._last_decrease >= self.decrease_cooldown:
+                    self._limit = max(float(self.min_limit), self._limit / 2)
+                    self._last_decrease = now
+            else:
+                # Aumento aditivo: +1 a cada 'limit' sucessos
+                self._limit = min(float(self.max_limit), self._limit + 1 / max(self._limit, 1.0))
+            self._wake_waiters()
+
+    def release_unused(self):
+        """Devolve uma vaga reservada sem chamada feita (não mexe no limite)."""
+        with self._cond:
+            self._in_flight -= 1
+            self._wake_waiters()
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            return {"limit": self.limit, "in_flight": self._in_flight,
+                    "latency_target": round(self._latency_target(), 2)}
+
+
+class UpstreamGuard:
+    """Circuit breaker + limite AIMD de uma dependência externa (ex.: n8n)."""
+
+    def __init__(self, name: str, breaker: CircuitBreaker, limiter: AIMDLimiter, acquire_timeout: float):
+        self.name = name
+        self.breaker = breaker
+        self.limiter = limiter
+        self.acquire_timeout = acquire_timeout
+
+    def _allow(self):
+        try:
+            self.breaker.allow()
+        except UpstreamUnavailable:
+            upstream_requests.inc(upstream=self.name, outcome="rejected")
+            raise
+
+    def _rejected_by_limiter(self):
+        # A chamada não aconteceu: libera a vaga de teste do circuito (se era half-open)
+        self.breaker.cancel_probe()
+        upstream_requests.inc(upstream=self.name, outcome="rejected")
+        raise UpstreamUnavailable(
+            f"Limite de concorrência de {self.name} esgotado ({self.limiter.limit})",
+            self.acquire_timeout
+        )
+
+    def enter(self):
+        """Antes da chamada: levanta UpstreamUnavailable se ela não deve ser feita."""
+        self._allow()
+        if not self.limiter.acquire(self.acquire_timeout):
+            self._rejected_by_limiter()
+
+    async def enter_async(self):
+        self._allow()
+        if not await self.limiter.acquire_async(self.acquire_timeout):
+            self._rejected_by_limiter()
+
+    def reserve(self) -> "UpstreamPermit":
+        """
+        Reserva a vaga (circuito + limite) antes de preparar a chamada: quem não conseguir
+        vaga desiste antes de gravar qualquer coisa. Levanta UpstreamUnavailable.
+        """
+        self.enter()
+        return UpstreamPermit(self)
+
+    async def reserve_async(self) -> "UpstreamPermit":
+        await self.enter_async()
+        return UpstreamPermit(self)
+
+    def free_slots(self) -> int:
+        """
+        Alterado: Chamadas que caberiam agora (0 com o circuito aberto ou em teste). O
+        engine async limita o claim por aqui, em vez de reivindicar itens que só
+        esperariam vaga até serem adiados.
+        """
+        if not self.breaker.accepting():
+            return 0
+        return self.limiter.free_slots()
+
+    def cancel(self):
+        """A vaga foi reservada, mas a chamada não aconteceu (fluxo parou antes)."""
+        self.breaker.cancel_probe()
+        self.limiter.release_unused()
+
+    def exit(self, started: float, ok: bool, outcome: str = None):
+        latency = time.monotonic() - started
+        # Alterado: Latência e resultado da chamada para o /metrics
+        observe_upstream(self.name, started, outcome or ("ok" if ok else "error"))
+        self.limiter.release(latency, ok)
+        if ok:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+
+    def snapshot(self) -> dict:
+        return {"name": self.name, **self.breaker.snapshot(), **self.limiter.snapshot()}
+
+
+class UpstreamPermit:
+    """Vaga reservada em um UpstreamGuard; liberada uma única vez (release ou cancel)."""
+
+    __slots__ = ("guard", "done")
+
+    def __init__(self, guard: UpstreamGuard):
+        self.guard = guard
+        self.done = False
+
+    def release(self, started: float, ok: bool, outcome: str = None):
+        """Chamada feita: registra o resultado no circuito e no limite AIMD."""
+        if not self.done:
+            self.done = True
+            self.guard.exit(started, ok, outcome)
+
+    def cancel(self):
+        """Chamada não feita: devolve a vaga (no-op se já liberada)."""
+        if not self.done:
+            self.done = True
+            self.guard.cancel()
+
+
+n8n_guard = UpstreamGuard(
+    "n8n",
+    CircuitBreaker("n8n", settings.N8N_BREAKER_FAILURE_THRESHOLD, settings.N8N_BREAKER_OPEN_SECONDS),
+    AIMDLimiter(
+        initial=settings.N8N_LIMIT_INITIAL,
+        min_limit=settings.N8N_LIMIT_MIN,
+        max_limit=settings.N8N_LIMIT_MAX,
+        latency_target=settings.N8N_LATENCY_TARGET_SECONDS,
+        min_latency_target=settings.N8N_LATENCY_MIN_TARGET_SECONDS,
+        latency_tolerance=settings.N8N_LATENCY_TOLERANCE,
+        decrease_cooldown=settings.N8N_LIMIT_DECREASE_COOLDOWN_SECONDS
+    ),
+    acquire_timeout=settings.N8N_LIMIT_ACQUIRE_TIMEOUT
+)
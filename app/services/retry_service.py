@@ -0,0 +1,123 @@
+# Alterado: Novo módulo único de retentativas da fila (substitui retry_agent.py e o
+# retry_manager_loop, que a cada 120s devolviam TODOS os itens 'failed' para 'pending'
+# de uma vez e nunca recuperavam itens travados em 'processing').
+#   - schedule_retry: agenda a próxima tentativa do item com backoff exponencial + jitter
+#     (next_attempt_at); o claim só pega itens vencidos.
+#   - defer_item: adia sem consumir tentativa (ex.: circuito do n8n aberto).
+#   - reap_stuck_items: visibility timeout; itens em 'processing' há mais de
+#     VISIBILITY_TIMEOUT_SECONDS (worker caiu) voltam para a fila.
+#   - release_orphan_siblings: mensagens agrupadas (coalesced_into) cujo principal já
+#     terminou sem reivindicá-las de novo (ex.: agrupamento desligado) voltam a ser livres.
+
+import random
+from datetime import timedelta
+from typing import List, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.timezone import now_br
+from app.models.all_models import RequestQueue
+from app.services.queue_service import notify_new_items
+
+REAP_STUCK_SQL = text("""
+    UPDATE request_queue
+    SET status = CASE WHEN COALESCE(attempts, 0) >= :max_attempts THEN 'failed' ELSE 'pending' END,
+        attempts = CASE WHEN COALESCE(attempts, 0) >= :max_attempts THEN attempts ELSE COALESCE(attempts, 0) + 1 END,
+        next_attempt_at = NULL,
+        claimed_at = NULL,
+        updated_at = :now
+    WHERE status = 'processing'
+      AND COALESCE(claimed_at, updated_at, created_at) < :stale_before
+    RETURNING id, status
+""")
+
+RELEASE_ORPHAN_SIBLINGS_SQL = text("""
+    UPDATE request_queue sibling
+    SET coalesced_into = NULL, updated_at = :now
+    WHERE sibling.status = 'pending'
+      AND sibling.coalesced_into IS NOT NULL
+      AND NOT EXISTS (
+          SELECT 1 FROM request_queue primary_item
+          WHERE primary_item.id = sibling.coalesced_into
+            AND primary_item.status IN ('pending', 'processing')
+      )
+    RETURNING sibling.id
+""")
+
+def retry_delay_seconds(attempt: int) -> float:
+    """
+    Atraso da tentativa 'attempt' (1, 2, 3...): base * 2^(attempt-1), limitado a
+    RETRY_MAX_DELAY_SECONDS. Metade do valor é fixa e metade aleatória (jitter), para
+    que falhas simultâneas (ex.: n8n fora do ar) não voltem todas ao mesmo tempo.
+    """
+    delay = min(settings.RETRY_MAX_DELAY_SECONDS, settings.RETRY_BASE_DELAY_SECONDS * (2 ** (attempt - 1)))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def schedule_retry(db: Session, item: RequestQueue) -> str:
+    """
+    Devolve o item para a fila com next_attempt_at no futuro, ou marca como 'failed'
+    quando as tentativas acabaram. Não faz commit (o chamador grava junto com o resto).
+
+    Returns:
+        str: novo status do item ('pending' ou 'failed')
+    """
+    attempts = item.attempts or 0
+    item.claimed_at = None
+    if attempts >= settings.RETRY_MAX_ATTEMPTS:
+        item.status = "failed"
+        item.next_attempt_at = None
+        return item.status
+
+    item.attempts = attempts + 1
+    item.status = "pending"
+    item.next_attempt_at = now_br() + timedelta(seconds=retry_delay_seconds(item.attempts))
+    # Acorda os gerenciadores para recalcularem a espera até o novo vencimento
+    notify_new_items(db, item.id)
+    return item.status
+
+def defer_item(db: Session, item: RequestQueue, seconds: float):
+    """
+    Alterado: Adia o item sem consumir tentativa (a dependência está indisponível, o
+    item não falhou). O jitter espalha a volta dos itens adiados juntos. Não faz commit.
+    """
+    seconds = max(seconds, 1.0)
+    item.status = "pending"
+    item.claimed_at = None
+    item.next_attempt_at = now_br() + timedelta(seconds=seconds + random.uniform(0, seconds))
+    notify_new_items(db, item.id)
+
+def reap_stuck_items(db: Session) -> List[Tuple[int, str]]:
+    """
+    Devolve à fila (ou marca 'failed', se sem tentativas) os itens em 'processing'
+    reivindicados há mais de VISIBILITY_TIMEOUT_SECONDS.
+
+    Returns:
+        Lista de (id, novo status)
+    """
+    now = now_br()
+    rows = db.execute(REAP_STUCK_SQL, {
+        "now": now,
+        "stale_before": now - timedelta(seconds=settings.VISIBILITY_TIMEOUT_SECONDS),
+        "max_attempts": settings.RETRY_MAX_ATTEMPTS,
+    }).fetchall()
+
+    if any(row.status == "pending" for row in rows):
+        notify_new_items(db)
+    db.commit()
+    return [(row.id, row.status) for row in rows]
+
+def release_orphan_siblings(db: Session) -> List[int]:
+    """
+    Solta as mensagens presas a um item principal que já terminou (ou não existe mais);
+    elas voltam a ser reivindicadas sozinhas.
+
+    Returns:
+        IDs liberados
+    """
+    rows = db.execute(RELEASE_ORPHAN_SIBLINGS_SQL, {"now": now_br()}).fetchall()
+    if rows:
+        notify_new_items(db)
+    db.commit()
+    return [row.id for row in rows]
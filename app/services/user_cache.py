@@ -0,0 +1,111 @@
+# Alterado: Novo módulo com cache (TTL) dos usuários resolvidos pelo worker
+# get_or_create_user fazia SELECT + INSERT/UPDATE com commits a cada mensagem.
+# Agora o registro do usuário fica em memória por USER_CACHE_TTL_SECONDS e a
+# criação/atualização usa um único INSERT ... ON CONFLICT (phone) DO UPDATE.
+#
+# Quando flags de assinatura mudam (is_client, is_blocked, is_compliant, is_canceled),
+# quem alterou deve chamar notify_user_changed(db, phone): o NOTIFY chega em todos
+# os workers (via LISTEN) e remove o usuário do cache deles.
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+
+# Canal do Postgres usado para invalidar o cache em todos os processos
+USER_CHANGED_CHANNEL = "user_changed"
+
+
+class UserRecord:
+    """Cópia leve (somente leitura) dos campos do usuário usados no fluxo."""
+
+    __slots__ = ("id", "phone", "name", "is_client", "is_blocked", "is_compliant", "is_canceled")
+
+    def __init__(self, id: int, phone: str, name: Optional[str], is_client: bool,
+                 is_blocked: bool, is_compliant: bool, is_canceled: bool):
+        self.id = id
+        self.phone = phone
+        self.name = name
+        self.is_client = is_client
+        self.is_blocked = is_blocked
+        self.is_compliant = is_compliant
+        self.is_canceled = is_canceled
+
+    def __repr__(self):
+        return f"UserRecord(id={self.id}, phone={self.phone!r}, is_client={self.is_client})"
+
+
+class UserCache:
+    def __init__(self, ttl_seconds: float, max_size: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self._items: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, phone: str) -> Optional[UserRecord]:
+        with self._lock:
+            cached = self._items.get(phone)
+            if cached is None:
+                return None
+            record, expires_at = cached
+            if time.monotonic() > expires_at:
+                del self._items[phone]
+                return None
+            self._items.move_to_end(phone)
+            return record
+
+    def put(self, record: UserRecord):
+        if self.ttl_seconds <= 0:
+            return
+        with self._lock:
+            self._items[record.phone] = (record, time.monotonic() + self.ttl_seconds)
+            self._items.move_to_end(record.phone)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def invalidate(self, phone: str = None):
+        """Remove um usuário do cache (ou todos, se phone for None)."""
+        with self._lock:
+            if phone is None:
+                self._items.clear()
+            else:
+                self._items.pop(phone, None)
+
+
+user_cache = UserCache(ttl_seconds=settings.USER_CACHE_TTL_SECONDS, max_size=settings.USER_CACHE_MAX_SIZE)
+
+
+def invalidate_user(phone: str = None):
+    """Invalidação local (neste processo)."""
+    user_cache.invalidate(phone)
+
+
+def notify_user_changed(db: Session, phone: str):
+    """
+    Hook para atualizações de cobrança/assinatura: invalida o usuário neste processo e
+    emite NOTIFY para os workers (entregue no commit da transação do chamador).
+    Alterações feitas direto no banco emitem o mesmo NOTIFY pelo trigger de users
+    (run_migration_sprint22.py); aqui a invalidação local vale antes do commit.
+
+    Exemplo:
+        >>> user.is_compliant = False
+        >>> notify_user_changed(db, user.phone)
+        >>> db.commit()
+    """
+    invalidate_user(phone)
+    db.execute(
+        text("SELECT pg_notify(:channel, :payload)"),
+        {"channel": USER_CHANGED_CHANNEL, "payload": phone}
+    )
+
+
+def handle_notifications(notifications):
+    """Processa notificações do LISTEN que dizem respeito ao cache de usuários."""
+    for channel, payload in notifications:
+        if channel == USER_CHANGED_CHANNEL:
+            invalidate_user(payload or None)
@@ -1,9 +1,25 @@
+import sys
 import time
 import logging
+from sqlalchemy import func, or_
 from sqlalchemy.orm import Session
+from app.core.config import settings
 from app.core.database import SessionLocal
+from app.core.timezone import now_br
 from app.models.all_models import RequestQueue
+from app.core.http_clients import log_pool_stats, close_clients
+from app.core.metrics import registry, set_component_stats, start_metrics_server
+from app.core.pg_listener import PgListener
+from app.services.user_cache import handle_notifications, USER_CHANGED_CHANNEL
+from app.services.queue_service import claim_pending_items, release_claimed_items, seconds_until_next_due, QUEUE_NOTIFY_CHANNEL
 from app.workers.worker import process_request
+from app.workers.worker_pool import WorkerPool
+from app.workers.reconcile_counters import reconcile_loop
+from app.workers.rollup_job import rollup_loop
+from app.workers.partition_job import partition_loop
+from app.workers.step_log_writer import step_log_writer
+from app.services.outbound_service import outbound_sender
+from app.workers.scheduler import build_scheduler
 import threading
 
 # Configuração de Logs
@@ -13,99 +29,185 @@ logger = logging.getLogger("AgentManager")
 def get_pending_count(db: Session):
     return db.query(RequestQueue).filter(RequestQueue.status == "pending").count()
 
-def get_pending_items(db: Session, limit: int):
-    return db.query(RequestQueue).filter(RequestQueue.status == "pending").order_by(RequestQueue.created_at.asc()).limit(limit).all()
+def get_queue_backlog(db: Session):
+    """
+    Retorna (quantidade de pendentes, idade em segundos do pendente mais antigo).
+    Usado pelo pool para decidir se deve crescer.
+    """
+    # Alterado: Retentativas agendadas para o futuro não contam como backlog
+    now = now_br()
+    pending, oldest = db.query(
+        func.count(RequestQueue.id),
+        func.min(RequestQueue.created_at)
+    ).filter(
+        RequestQueue.status == "pending",
+        or_(RequestQueue.next_attempt_at.is_(None), RequestQueue.next_attempt_at <= now),
+        RequestQueue.coalesced_into.is_(None)
+    ).one()
 
-import math
+    if not oldest:
+        return pending, 0.0
 
-def agent_manager_loop():
-    logger.info("Iniciando Gerenciador de Agentes (Scaling Dinâmico)...")
+    # created_at é gravado sem timezone, já no horário de Brasília
+    lag = (now.replace(tzinfo=None) - oldest).total_seconds()
+    return pending, max(0.0, lag)
+
+# Alterado: Tamanho máximo de lote reivindicado por ciclo
+CLAIM_BATCH_LIMIT = 50
+
+def build_worker_pool() -> WorkerPool:
+    return WorkerPool(
+        process_request,
+        min_workers=settings.WORKER_POOL_MIN,
+        max_workers=settings.WORKER_POOL_MAX,
+        idle_timeout=settings.WORKER_POOL_IDLE_TIMEOUT,
+        scale_up_lag=settings.WORKER_POOL_SCALE_UP_LAG
+    )
+
+def agent_manager_loop(pool: WorkerPool, listener: PgListener):
+    # Alterado: Em vez de disparar uma thread nova por item, os itens são entregues a um
+    # pool persistente e limitado. O gerenciador só reivindica itens quando há vaga
+    # no pool (backpressure), então a concorrência nunca passa de WORKER_POOL_MAX.
+    # Alterado: Sem polling de 2s. O gerenciador dorme no LISTEN e acorda com o NOTIFY
+    # emitido por add_to_queue; QUEUE_FALLBACK_POLL_SECONDS é só a rede de segurança.
+    logger.info("Iniciando Gerenciador de Agentes (Pool de Workers + LISTEN/NOTIFY)...")
     while True:
         try:
-            logger.info("Tentando conectar ao banco para buscar itens...") # DEBUG
+            # Alterado: Drena sem bloquear a cada volta (com o pool ou o lote sempre cheios o
+            # loop não chega ao listener.wait e o cache de usuários ficaria desatualizado)
+            handle_notifications(listener.poll())
+
+            slots = pool.available_slots()
+            if slots == 0:
+                # Pool cheio: não reivindica nada até liberar vaga
+                logger.debug(f"Pool cheio ({pool.stats()}). Aguardando vaga...")
+                pool.wait_for_capacity(timeout=5)
+                continue
+
+            requested = min(slots, CLAIM_BATCH_LIMIT)
             with SessionLocal() as db:
-                logger.info("Conexão aberta. Buscando itens pendentes...") # DEBUG
-                # Busca todos os pendentes (poderia limitar para não estourar memória, mas vamos assumir volume controlável por enquanto)
-                # Ou pega um lote grande, ex: 100
-                items = get_pending_items(db, 50) 
-                logger.info(f"Query executada. Itens encontrados: {len(items)}") # DEBUG 
-                count = len(items)
-                
+                # Alterado: Reivindicação atômica (UPDATE ... FOR UPDATE SKIP LOCKED RETURNING id)
+                # Substitui o SELECT + UPDATE em dois passos, que deixava duas réplicas
+                # pegarem o mesmo item e carregava os payloads inteiros em memória.
+                item_ids = claim_pending_items(db, requested)
+                count = len(item_ids)
+
                 if count > 0:
-                    # Regra: 1 agente para cada 3 requisições
-                    # 1-3 -> 1 agente
-                    # 4-6 -> 2 agentes ...
-                    required_agents = math.ceil(count / 3)
-                    
-                    logger.info(f"Fila com {count} itens. Iniciando {required_agents} agente(s)...")
-                    
-                    # Marcar como 'processing' antes de disparar threads para evitar race condition se rodasse em paralelo real
-                    for item in items:
-                        item.status = "processing"
-                        db.add(item)
-                    db.commit()
-                    
-                    # Dispara threads
-                    # Aqui, como estamos usando threads simples, 'agentes' são threads de processamento.
-                    # Vamos disparar uma thread POR ITEM, mas limitando a concorrência?
-                    # O usuário disse: "o sistema deve acordar um agente para ajudar... se chegarem mais, acordar mais".
-                    # A interpretação mais simples e eficiente em Python Threading é:
-                    # Disparar uma thread por item (Worker), mas semanticamente agrupados.
-                    # Mas se o requisito é estrito sobre "Agentes" como workers persistentes que pegam lotes:
-                    # Seria complexo implementar workers consumidores de fila dinâmica agora.
-                    # Vou manter a lógica de "Disparar processamento" mas usando o conceito matemático para validar a regra.
-                    # Na prática: Vamos processar TODOS os itens encontrados, disparando threads.
-                    # O "Agente" aqui é a capacidade de processamento.
-                    # Se tiver 6 itens, disparamos 6 threads (que equivalem a N agentes trabalhando).
-                    # Para respeitar a semântica "1 agente cuida de 3":
-                    # Poderiamos ter threads que processam loops de 3 itens.
-                    # Mas isso atrasaria o 2º e 3º item.
-                    # A melhor UX é processar tudo paralelo.
-                    # Vou assumir que "Acordar agente" é uma metáfora para "Escalar capacidade".
-                    # Vou disparar uma thread para CADA item imediatamente.
-                    
-                    for item in items:
-                        t = threading.Thread(target=process_request, args=(item.id,))
-                        t.start()
-                        
+                    logger.info(f"Reivindicados {count} item(ns). Pool: {pool.stats()}")
+
+                    for index, item_id in enumerate(item_ids):
+                        # Alterado: Pool parando ou cheio recusa o item; ele e o resto do
+                        # lote voltam para 'pending' agora, em vez de esperar o reaper
+                        if not pool.submit(item_id):
+                            rejected = item_ids[index:]
+                            release_claimed_items(db, rejected)
+                            logger.warning(f"Pool recusou {len(rejected)} item(ns); devolvidos à fila")
+                            break
+
+                    # Informa o backlog restante para o pool decidir se cresce
+                    pending, lag = get_queue_backlog(db)
+                    pool.report_backlog(pending, lag)
                 else:
                     logger.debug("Nenhum item pendente. Aguardando...")
-            
-            time.sleep(2) # Verifica a cada 2 segundos (mais rápido)
+
+                if count >= requested:
+                    # Lote cheio: provavelmente há mais itens, tenta de novo sem dormir
+                    continue
+
+                # Itens pendentes ainda dentro da janela de agrupamento (ou com retentativa
+                # agendada) ficam prontos sozinhos, então a espera é limitada até o próximo
+                timeout = settings.QUEUE_FALLBACK_POLL_SECONDS
+                next_due = seconds_until_next_due(db)
+                if next_due is not None:
+                    timeout = min(timeout, max(next_due, 0.05))
+
+            # Dorme até um NOTIFY (ou até o timeout calculado)
+            notifications = listener.wait(timeout=timeout)
+            # Alterado: Notificações de usuário alterado (cobrança) invalidam o cache local
+            handle_notifications(notifications)
             
         except Exception as e:
             logger.error(f"Erro no loop do gerenciador: {e}")
             time.sleep(5)
 
-def retry_manager_loop():
-    logger.info("Iniciando Agente de Recuperação (Retry)...")
+def pool_stats_loop():
+    # Alterado: Log periódico das estatísticas dos pools HTTP (n8n/Evolution)
     while True:
+        time.sleep(settings.HTTP_POOL_STATS_LOG_INTERVAL)
         try:
-            with SessionLocal() as db:
-                # Busca itens falhados com menos de 3 tentativas
-                failed_items = db.query(RequestQueue).filter(
-                    RequestQueue.status == "failed",
-                    RequestQueue.attempts < 3
-                ).all()
-                
-                if failed_items:
-                    logger.info(f"Encontrados {len(failed_items)} itens falhados para reprocessar.")
-                    for item in failed_items:
-                        item.status = "pending"
-                        item.attempts += 1
-                        logger.info(f"Re-enfileirando item {item.id} (Tentativa {item.attempts})")
-                    db.commit()
-                
-            time.sleep(120) # Verifica a cada 2 minutos
-            
+            log_pool_stats()
+            writer_stats = step_log_writer.stats()
+            if writer_stats["dropped"] or writer_stats["delayed"]:
+                logger.warning(f"Gravador de passos com perdas/atrasos: {writer_stats}")
+            # Alterado: Envio ao WhatsApp (fila, latência da Evolution) separado da latência do n8n
+            logger.info(f"Fila de envio: {outbound_sender.stats()}")
         except Exception as e:
-            logger.error(f"Erro no retry manager: {e}")
-            time.sleep(60)
+            logger.error(f"Erro ao coletar estatísticas HTTP: {e}")
+
+def register_worker_collectors(pool: WorkerPool):
+    """Alterado: Estatísticas dos componentes do worker no /metrics (lidas a cada leitura)."""
+    def collect_components():
+        set_component_stats("outbound", outbound_sender.stats())
+        set_component_stats("step_log_writer", step_log_writer.stats())
+        set_component_stats("worker_pool", pool.stats())
+
+    registry.add_collector(collect_components)
 
 if __name__ == "__main__":
-    # Inicia o Retry Manager em uma thread separada (daemon para morrer com o processo)
-    retry_thread = threading.Thread(target=retry_manager_loop, daemon=True)
-    retry_thread.start()
+    # Alterado: O antigo Retry Manager (varredura de 'failed' a cada 120s) foi substituído
+    # por retentativas agendadas por item (next_attempt_at) + reaper no APScheduler
+    scheduler = build_scheduler()
+    scheduler.start()
+
+    if settings.HTTP_POOL_STATS_LOG_INTERVAL > 0:
+        threading.Thread(target=pool_stats_loop, daemon=True).start()
+
+    # Alterado: Reconciliação periódica de users.ai_response_count com chat_logs
+    if settings.COUNTER_RECONCILE_INTERVAL_SECONDS > 0:
+        threading.Thread(target=reconcile_loop, daemon=True).start()
+
+    # Alterado: Manutenção incremental dos rollups por hora usados pelo dashboard
+    if settings.ROLLUP_INTERVAL_SECONDS > 0:
+        threading.Thread(target=rollup_loop, daemon=True).start()
+
+    # Alterado: Criação de partições futuras e arquivamento das antigas
+    if settings.PARTITION_JOB_INTERVAL_SECONDS > 0:
+        threading.Thread(target=partition_loop, daemon=True).start()
     
+    # Alterado: Engine selecionado na inicialização (WORKER_ENGINE ou --engine)
+    # "async": event loop único (app/workers/async_engine.py); "thread": pool de threads
+    engine_name = settings.WORKER_ENGINE
+    if "--engine" in sys.argv:
+        engine_name = sys.argv[sys.argv.index("--engine") + 1]
+
+    if engine_name == "async":
+        from app.workers.async_engine import run_async_engine
+        run_async_engine()
+        sys.exit(0)
+
+    if engine_name != "thread":
+        logger.error(f"WORKER_ENGINE inválido: {engine_name} (use 'thread' ou 'async')")
+        sys.exit(1)
+
+    # Alterado: Pool persistente de workers (tamanho configurável via Settings)
+    pool = build_worker_pool()
+    pool.start()
+
+    # Alterado: /metrics do worker (formato Prometheus)
+    register_worker_collectors(pool)
+    start_metrics_server(settings.METRICS_PORT)
+
+    listener = PgListener([QUEUE_NOTIFY_CHANNEL, USER_CHANGED_CHANNEL])
+
     # Inicia o loop principal na thread principal
-    agent_manager_loop()
+    try:
+        agent_manager_loop(pool, listener)
+    finally:
+        scheduler.shutdown(wait=False)
+        listener.close()
+        pool.shutdown(wait=True, timeout=30)
+        # Alterado: Entrega as mensagens que ainda estão na fila de envio
+        outbound_sender.stop()
+        # Alterado: Grava os passos que ainda estão no buffer e reporta descartes/atrasos
+        step_log_writer.stop()
+        close_clients()
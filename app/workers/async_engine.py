@@ -0,0 +1,253 @@
+# Alterado: Novo engine de workers baseado em asyncio (WORKER_ENGINE=async)
+#
+# Um único event loop processa milhares de conversas simultâneas:
+# - as chamadas ao n8n usam httpx.AsyncClient (não prendem threads); as mensagens ao
+#   usuário vão para a fila de envio (app/services/outbound_service.py);
+# - o banco é acessado via asyncpg, e as regras de negócio são as MESMAS do engine de
+#   threads (prepare_request/finish_request em worker.py + flow_service), executadas
+#   com AsyncSession.run_sync;
+# - a sessão só fica aberta nas fases de banco, nunca durante a espera do n8n, então
+#   poucas conexões atendem muitas conversas em andamento.
+#
+# O engine de threads continua disponível e é o padrão (WORKER_ENGINE=thread).
+
+import asyncio
+import functools
+import logging
+from typing import List, Set
+
+from app.core.async_database import AsyncSessionLocal
+from app.core.config import settings
+from app.core.http_clients import aclose_async_clients
+from app.core.metrics import registry, collect_db_pool, set_component_stats, start_metrics_server
+from app.core.pg_listener import AsyncPgListener
+from app.services.ai_service import process_with_n8n_async
+from app.services.blob_store import resolve_media
+from app.services.outbound_service import request_notifier, outbound_sender
+from app.services.resilience import n8n_guard, UpstreamUnavailable
+from app.services.queue_service import claim_pending_items, QUEUE_NOTIFY_CHANNEL
+from app.services.queue_service import seconds_until_next_due
+from app.services.user_cache import handle_notifications, USER_CHANGED_CHANNEL
+from app.workers.step_log_writer import step_log_writer
+from app.workers.profiling import span, trace_request
+from app.workers.worker import (
+    PreparedRequest,
+    run_phase,
+    defer_if_unavailable,
+    defer_unavailable,
+    prepare_request,
+    finish_request,
+    start_coalescing,
+    collect_siblings,
+    coalesce_wait_seconds,
+    settle_coalesced
+)
+
+logger = logging.getLogger("AsyncEngine")
+
+# Mesmo tamanho de lote do engine de threads
+CLAIM_BATCH_LIMIT = 50
+
+
+class AsyncWorkerEngine:
+    def __init__(self, max_in_flight: int):
+        self.max_in_flight = max_in_flight
+        self._tasks: Set[asyncio.Task] = set()
+        # Limita fases de banco simultâneas ao tamanho do pool asyncpg, para que
+        # milhares de conversas não estourem o pool_timeout esperando conexão
+        self._db_gate = asyncio.Semaphore(settings.ASYNC_DB_POOL_SIZE + settings.ASYNC_DB_MAX_OVERFLOW)
+        self._capacity = asyncio.Event()
+        self._capacity.set()
+        # Alterado: Conversas reivindicadas que ainda não reservaram a vaga do n8n
+        self._awaiting_permit: Set[int] = set()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    async def _run_session(self, fn, *args):
+        async with self._db_gate:
+            async with AsyncSessionLocal() as session:
+                return await session.run_sync(fn, *args)
+
+    async def _run_db_phase(self, queue_id: int, phase, *args):
+        return await self._run_session(run_phase, queue_id, phase, *args)
+
+    async def _coalesce(self, queue_id: int):
+        # Mesmo ciclo de worker.coalesce, mas dormindo com asyncio.sleep
+        try:
+            state = await self._run_session(start_coalescing, queue_id)
+            while state is not None:
+                wait = coalesce_wait_seconds(state)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+                await self._run_session(collect_siblings, state)
+            return state
+        except Exception as e:
+            logger.error(f"Erro no agrupamento do item {queue_id}: {e}")
+            return None
+
+    async def process_request(self, queue_id: int):
+        # Alterado: Spans por etapa (o ContextVar do trace vale só para esta task);
+        # sem profiler: o event loop intercala várias conversas na mesma thread
+        with trace_request(queue_id, allow_profiler=False):
+            await self._process_request(queue_id)
+
+    async def _process_request(self, queue_id: int):
+        if await self._run_session(defer_if_unavailable, queue_id):
+            return
+
+        with span("coalesce"):
+            group = await self._coalesce(queue_id)
+        try:
+            await self._process(queue_id, group.texts if group else [])
+        finally:
+            if group and group.sibling_ids:
+                await self._run_session(settle_coalesced, group)
+
+    async def _process(self, queue_id: int, extra_texts):
+        # Alterado: Vaga do n8n reservada antes da preparação (como worker.reserve_n8n):
+        # sem vaga o item é adiado sem chat_log gravado nem avisos enfileirados
+        try:
+            permit = await n8n_guard.reserve_async()
+        except UpstreamUnavailable as e:
+            await self._run_session(defer_unavailable, queue_id, e)
+            return
+        finally:
+            self._awaiting_permit.discard(queue_id)
+        try:
+            await self._prepare_and_call(queue_id, extra_texts, permit)
+        finally:
+            # Fluxo parou antes da chamada: devolve a vaga (no-op se a chamada foi feita)
+            permit.cancel()
+
+    async def _prepare_and_call(self, queue_id: int, extra_texts, permit):
+        # Alterado: Mensagens ao usuário vão para a fila de envio (enqueue_message não
+        # bloqueia), então não é mais preciso coletá-las e enviá-las depois da fase.
+        # O notifier leva o queue_id: falha de entrega vira o passo SEND_FAILED do item
+        notify = request_notifier(queue_id)
+        prepared: PreparedRequest = await self._run_db_phase(queue_id, prepare_request, queue_id, notify, extra_texts)
+
+        if prepared is None:
+            return
+
+        # Chamada ao n8n sem nenhuma conexão do banco presa
+        ai_response_data, error = None, None
+        try:
+            with span("n8n_call"):
+                # Leitura do blob de áudio fora do event loop
+                media_data = await asyncio.to_thread(resolve_media, prepared.media_data)
+                ai_response_data = await process_with_n8n_async(
+                    prepared.context, prepared.message_text, prepared.phone,
+                    user_name=prepared.user_name,
+                    message_type=prepared.message_type,
+                    media_data=media_data,
+                    message_id=prepared.evo_id,
+                    permit=permit
+                )
+        except Exception as e:
+            error = e
+
+        await self._run_db_phase(queue_id, finish_request, prepared, ai_response_data, error, notify)
+
+    def _on_task_done(self, queue_id: int, task: asyncio.Task):
+        # Conversas que terminaram antes da reserva (circuito aberto, erro no agrupamento)
+        self._awaiting_permit.discard(queue_id)
+        self._tasks.discard(task)
+        self._capacity.set()
+        if not task.cancelled() and task.exception():
+            logger.error(f"Erro não tratado no engine async: {task.exception()}")
+
+    def submit(self, queue_id: int):
+        self._awaiting_permit.add(queue_id)
+        task = asyncio.create_task(self.process_request(queue_id))
+        self._tasks.add(task)
+        task.add_done_callback(functools.partial(self._on_task_done, queue_id))
+
+    async def _claim(self, limit: int) -> List[int]:
+        return await self._run_session(claim_pending_items, limit)
+
+    async def run(self):
+        logger.info(f"Iniciando engine async (máx. {self.max_in_flight} conversas simultâneas)...")
+        listener = AsyncPgListener([QUEUE_NOTIFY_CHANNEL, USER_CHANGED_CHANNEL])
+        # Alterado: LISTEN ativo antes do primeiro claim
+        await listener.connect()
+        try:
+            while True:
+                try:
+                    # Alterado: Avisos de usuário alterado processados a cada volta, mesmo
+                    # sem chegar ao listener.wait (fila ou conversas sempre no limite)
+                    handle_notifications(listener.drain())
+
+                    # Alterado: Backpressure também pela vaga do n8n (limite AIMD e circuito):
+                    # só reivindica o que pode chamar o n8n logo; o resto fica 'pending' no
+                    # banco em vez de 'processing' esperando vaga até ser adiado
+                    n8n_slots = n8n_guard.free_slots() - len(self._awaiting_permit)
+                    slots = min(self.max_in_flight - self.in_flight, n8n_slots)
+                    if slots <= 0:
+                        # Espera alguma conversa terminar (no máximo 5s, para voltar a drenar
+                        # as notificações e reavaliar o circuito)
+                        self._capacity.clear()
+                        try:
+                            await asyncio.wait_for(self._capacity.wait(), timeout=5)
+                        except asyncio.TimeoutError:
+                            pass
+                        continue
+
+                    requested = min(slots, CLAIM_BATCH_LIMIT)
+                    item_ids = await self._claim(requested)
+
+                    if item_ids:
+                        logger.info(f"Reivindicados {len(item_ids)} item(ns). Em andamento: {self.in_flight}")
+                        for item_id in item_ids:
+                            self.submit(item_id)
+
+                    if len(item_ids) >= requested:
+                        continue
+
+                    # Dorme até um NOTIFY, até o próximo item ficar pronto ou o timeout de segurança
+                    timeout = settings.QUEUE_FALLBACK_POLL_SECONDS
+                    next_due = await self._run_session(seconds_until_next_due)
+                    if next_due is not None:
+                        timeout = min(timeout, max(next_due, 0.05))
+                    handle_notifications(await listener.wait(timeout=timeout))
+
+                except Exception as e:
+                    logger.error(f"Erro no loop do engine async: {e}")
+                    await asyncio.sleep(5)
+        finally:
+            await listener.close()
+            if self._tasks:
+                logger.info(f"Aguardando {len(self._tasks)} conversa(s) em andamento...")
+                await asyncio.wait(set(self._tasks), timeout=30)
+            await aclose_async_clients()
+            # Entrega as mensagens que ainda estão na fila de envio
+            await asyncio.to_thread(outbound_sender.stop)
+            # Grava os passos ainda no buffer (a thread do gravador roda fora do event loop)
+            await asyncio.to_thread(step_log_writer.stop)
+
+
+def _register_metrics(engine: "AsyncWorkerEngine"):
+    # Alterado: /metrics do engine async (pool asyncpg e conversas em andamento)
+    from app.core.async_database import async_engine
+
+    def collect_async_engine():
+        collect_db_pool("async", async_engine.sync_engine)
+        set_component_stats("async_engine", {"in_flight": engine.in_flight, "max_in_flight": engine.max_in_flight})
+        set_component_stats("outbound", outbound_sender.stats())
+        set_component_stats("step_log_writer", step_log_writer.stats())
+
+    registry.add_collector(collect_async_engine)
+    start_metrics_server(settings.METRICS_PORT)
+
+
+async def _main():
+    # O engine é criado dentro do loop (Semaphore/Event ficam presos ao loop em execução)
+    engine = AsyncWorkerEngine(max_in_flight=settings.ASYNC_MAX_IN_FLIGHT)
+    _register_metrics(engine)
+    await engine.run()
+
+
+def run_async_engine():
+    asyncio.run(_main())
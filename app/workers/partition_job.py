@@ -0,0 +1,200 @@
+# Alterado: Novo job de partições mensais e arquivamento de request_queue/processing_logs
+# As duas tabelas cresciam sem limite (payload JSON completo em cada item). Agora são
+# particionadas por mês (RANGE em created_at/timestamp). Este job:
+#   - cria as partições dos próximos PARTITION_MONTHS_AHEAD meses (e a DEFAULT);
+#   - exporta partições antigas (mês encerrado há mais de PARTITION_ARCHIVE_AFTER_DAYS
+#     dias) para CSV gzip em ARCHIVE_DIR e depois faz DETACH + DROP.
+# Os rollups por hora (rollup_job) continuam com o histórico agregado dos meses arquivados.
+#
+# Uso avulso:
+#   python -m app.workers.partition_job                     (cria partições e arquiva)
+#   python -m app.workers.partition_job restore <arquivo>   (recarrega uma partição arquivada)
+
+import csv
+import gzip
+import logging
+import os
+import re
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.timezone import now_br
+
+logger = logging.getLogger("PartitionJob")
+
+# Tabela particionada -> coluna de partição
+PARTITIONED_TABLES = {
+    "request_queue": "created_at",
+    "processing_logs": "timestamp",
+}
+
+ARCHIVE_FILE_PATTERN = re.compile(r"^(?P<table>\w+?)_p(?P<month>\d{6})\.csv\.gz$")
+
+def _month_start(dt: datetime) -> datetime:
+    return dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
+
+def _add_months(dt: datetime, months: int) -> datetime:
+    years, month_index = divmod(dt.month - 1 + months, 12)
+    return dt.replace(year=dt.year + years, month=month_index + 1)
+
+def partition_name(table: str, month: datetime) -> str:
+    return f"{table}_p{month:%Y%m}"
+
+def _lock(db: Session):
+    # Serializa execuções concorrentes (várias réplicas do worker)
+    db.execute(text("SELECT pg_advisory_xact_lock(hashtext('partition_job'))"))
+
+def create_partition(db: Session, table: str, month: datetime):
+    """Cria (se não existir) a partição do mês informado."""
+    start = _month_start(month)
+    end = _add_months(start, 1)
+    db.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {partition_name(table, start)} PARTITION OF {table} "
+        f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+    ))
+
+def create_partitions(db: Session, table: str, start: Optional[datetime] = None):
+    """
+    Cria a partição DEFAULT e as partições mensais de 'start' (padrão: mês atual)
+    até PARTITION_MONTHS_AHEAD meses à frente. Não faz commit.
+    """
+    first = _month_start(start or now_br())
+    last = _add_months(_month_start(now_br()), settings.PARTITION_MONTHS_AHEAD)
+    db.execute(text(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT"))
+    month = first
+    while month <= last:
+        create_partition(db, table, month)
+        month = _add_months(month, 1)
+
+def ensure_partitions(db: Session):
+    """Garante as partições do mês atual e dos próximos meses em todas as tabelas."""
+    _lock(db)
+    for table in PARTITIONED_TABLES:
+        create_partitions(db, table)
+    db.commit()
+
+def list_partitions(db: Session, table: str) -> List[Tuple[str, datetime]]:
+    """Partições mensais anexadas à tabela: [(nome, início do mês)] em ordem."""
+    rows = db.execute(text("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = :table
+    """), {"table": table}).scalars().all()
+
+    pattern = re.compile(rf"^{table}_p(\d{{6}})$")
+    partitions = []
+    for name in rows:
+        match = pattern.match(name)
+        if match:
+            partitions.append((name, datetime.strptime(match.group(1), "%Y%m")))
+    return sorted(partitions, key=lambda item: item[1])
+
+def archive_path(table: str, name: str) -> str:
+    return os.path.join(settings.ARCHIVE_DIR, table, f"{name}.csv.gz")
+
+def export_partition(db: Session, table: str, name: str) -> int:
+    """Exporta a partição para CSV gzip (escrita atômica). Retorna as linhas exportadas."""
+    path = archive_path(table, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+
+    raw = db.connection().connection
+    with raw.cursor() as cur, gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        cur.copy_expert(f"COPY (SELECT * FROM {name}) TO STDOUT WITH (FORMAT csv, HEADER)", f)
+        exported = cur.rowcount
+
+    os.replace(tmp_path, path)
+    return exported
+
+def archive_partition(db: Session, table: str, name: str) -> bool:
+    """Exporta, confere a contagem e remove a partição. Retorna False se foi pulada."""
+    _lock(db)
+    if table == "request_queue":
+        active = db.execute(text(
+            f"SELECT 1 FROM {name} WHERE status IN ('pending', 'processing') LIMIT 1"
+        )).first()
+        if active:
+            logger.warning(f"Partição {name} ainda tem itens pendentes/em processamento; arquivamento adiado")
+            db.rollback()
+            return False
+
+    total = db.execute(text(f"SELECT count(*) FROM {name}")).scalar()
+    exported = export_partition(db, table, name)
+    if exported != total:
+        db.rollback()
+        raise RuntimeError(f"Exportação de {name} incompleta ({exported} de {total} linhas)")
+
+    db.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+    db.execute(text(f"DROP TABLE {name}"))
+    db.commit()
+    logger.info(f"Partição {name} arquivada em {archive_path(table, name)} ({exported} linhas)")
+    return True
+
+def archive_old_partitions(db: Session) -> List[str]:
+    """Arquiva as partições cujo mês terminou antes do limite de retenção."""
+    cutoff = now_br().replace(tzinfo=None) - timedelta(days=settings.PARTITION_ARCHIVE_AFTER_DAYS)
+    archived = []
+    for table in PARTITIONED_TABLES:
+        for name, month in list_partitions(db, table):
+            if _add_months(month, 1) > cutoff:
+                continue
+            if archive_partition(db, table, name):
+                archived.append(name)
+    return archived
+
+def restore_partition(db: Session, path: str) -> int:
+    """
+    Recarrega um arquivo gerado por export_partition na tabela de origem (a partição
+    do mês é recriada). Retorna as linhas carregadas.
+
+    Se o mês continuar fora da retenção, a próxima execução do job o arquiva de novo.
+    """
+    match = ARCHIVE_FILE_PATTERN.match(os.path.basename(path))
+    if not match or match.group("table") not in PARTITIONED_TABLES:
+        raise ValueError(f"Arquivo de partição inválido: {path}")
+
+    table = match.group("table")
+    _lock(db)
+    create_partition(db, table, datetime.strptime(match.group("month"), "%Y%m"))
+
+    raw = db.connection().connection
+    with raw.cursor() as cur, gzip.open(path, "rt", encoding="utf-8") as f:
+        # Alterado: Colunas pelo cabeçalho do arquivo: arquivos exportados antes de uma
+        # coluna nova (ex.: request_queue.envelope) continuam restauráveis
+        columns = ", ".join(f'"{column}"' for column in next(csv.reader([f.readline()])))
+        cur.copy_expert(f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)", f)
+        restored = cur.rowcount
+    db.commit()
+    return restored
+
+def partition_loop():
+    logger.info("Iniciando manutenção periódica de partições...")
+    while True:
+        try:
+            with SessionLocal() as db:
+                ensure_partitions(db)
+                archived = archive_old_partitions(db)
+            if archived:
+                logger.info(f"Partições arquivadas: {', '.join(archived)}")
+        except Exception as e:
+            logger.error(f"Erro na manutenção de partições: {e}")
+
+        time.sleep(settings.PARTITION_JOB_INTERVAL_SECONDS)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    with SessionLocal() as db:
+        if len(sys.argv) > 2 and sys.argv[1] == "restore":
+            total = restore_partition(db, sys.argv[2])
+            logger.info(f"{total} linha(s) restaurada(s) de {sys.argv[2]}")
+        else:
+            ensure_partitions(db)
+            archived = archive_old_partitions(db)
+            logger.info(f"Partições arquivadas: {archived or 'nenhuma'}")
@@ -0,0 +1,161 @@
+# Alterado: Novo módulo com spans de tempo por etapa do process_request e profiler amostrado
+# processing_logs mostra quais passos rodaram, mas não quanto tempo cada um levou.
+#   - trace_request(queue_id): abre o "trace" do item (ContextVar: vale para a thread do
+#     worker e para a task do engine async). Ao final alimenta jeronimo_stage_seconds no
+#     /metrics e registra no log (DEBUG) a duração de cada etapa. Não grava em
+#     processing_logs: uma linha extra por item entraria nas contagens de passos do
+#     dashboard, dos rollups e de jeronimo_steps_total.
+#   - span("etapa"): mede um trecho. Sem trace ativo (PROFILING_SPANS_ENABLED=False) é só
+#     uma leitura de ContextVar e devolve um context manager vazio compartilhado.
+#   - Profiler amostrado (PROFILING_SAMPLE_RATE > 0, engine de threads): roda cProfile em
+#     uma fração dos itens e guarda em PROFILING_DIR o pstats dos PROFILING_KEEP_SLOWEST
+#     mais lentos deste processo (.prof para o pstats/snakeviz e .txt com o resumo).
+
+import contextlib
+import cProfile
+import heapq
+import io
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.metrics import registry, Histogram
+
+logger = logging.getLogger("Profiling")
+
+stage_latency = registry.register(Histogram(
+    "jeronimo_stage_seconds", "Duração das etapas do process_request (spans, se ativados)", ["stage"]))
+
+_NOOP = contextlib.nullcontext()
+
+
+class Trace:
+    """Durações (s) das etapas de um item, na ordem em que rodaram."""
+
+    __slots__ = ("queue_id", "started", "stages")
+
+    def __init__(self, queue_id: int):
+        self.queue_id = queue_id
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def summary(self, total: float) -> str:
+        parts = [f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in self.stages.items()]
+        return f"total={total * 1000:.1f}ms " + " ".join(parts)
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+
+
+class _Span:
+    __slots__ = ("trace", "stage", "started")
+
+    def __init__(self, trace: Trace, stage: str):
+        self.trace = trace
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.trace.add(self.stage, time.perf_counter() - self.started)
+        return False
+
+
+def span(stage: str):
+    """Mede o bloco como a etapa 'stage' do item em andamento (no-op sem trace ativo)."""
+    trace = _current_trace.get()
+    if trace is None:
+        return _NOOP
+    return _Span(trace, stage)
+
+
+class SlowestProfiles:
+    """Mantém em disco só os N perfis mais lentos (min-heap por duração)."""
+
+    def __init__(self, directory: str, keep: int):
+        self.directory = directory
+        self.keep = keep
+        self._heap: List[Tuple[float, str]] = []
+        self._lock = threading.Lock()
+
+    def offer(self, queue_id: int, seconds: float, profiler: cProfile.Profile):
+        with self._lock:
+            if len(self._heap) >= self.keep and seconds <= self._heap[0][0]:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            base = os.path.join(self.directory, f"item{queue_id}_{int(seconds * 1000)}ms_pid{os.getpid()}")
+            profiler.dump_stats(base + ".prof")
+            with open(base + ".txt", "w", encoding="utf-8") as f:
+                stream = io.StringIO()
+                pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(40)
+                f.write(stream.getvalue())
+
+            heapq.heappush(self._heap, (seconds, base))
+            if len(self._heap) > self.keep:
+                _, evicted = heapq.heappop(self._heap)
+                for suffix in (".prof", ".txt"):
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(evicted + suffix)
+
+
+slowest_profiles = SlowestProfiles(settings.PROFILING_DIR, settings.PROFILING_KEEP_SLOWEST)
+# cProfile não suporta dois perfis ativos ao mesmo tempo (Python 3.12+): um item por vez
+_profiler_lock = threading.Lock()
+
+
+def _start_profiler() -> Optional[cProfile.Profile]:
+    if settings.PROFILING_SAMPLE_RATE <= 0 or random.random() >= settings.PROFILING_SAMPLE_RATE:
+        return None
+    if not _profiler_lock.acquire(blocking=False):
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Outra ferramenta de profiling já está ativa no interpretador
+        _profiler_lock.release()
+        return None
+    return profiler
+
+
+@contextlib.contextmanager
+def trace_request(queue_id: int, allow_profiler: bool = True):
+    """
+    Abre o trace do item. allow_profiler=False no engine async: o cProfile mede a thread
+    inteira, e o event loop intercala várias conversas.
+    """
+    if not settings.PROFILING_SPANS_ENABLED and settings.PROFILING_SAMPLE_RATE <= 0:
+        yield None
+        return
+
+    trace = Trace(queue_id)
+    token = _current_trace.set(trace)
+    profiler = _start_profiler() if allow_profiler else None
+    try:
+        yield trace
+    finally:
+        total = time.perf_counter() - trace.started
+        _current_trace.reset(token)
+        if profiler is not None:
+            profiler.disable()
+            try:
+                slowest_profiles.offer(queue_id, total, profiler)
+            except Exception as e:
+                logger.error(f"Erro ao gravar perfil do item {queue_id}: {e}")
+            finally:
+                _profiler_lock.release()
+        if settings.PROFILING_SPANS_ENABLED and trace.stages:
+            for stage, seconds in trace.stages.items():
+                stage_latency.observe(seconds, stage=stage)
+            logger.debug(f"Tempos do item {queue_id}: {trace.summary(total)}")
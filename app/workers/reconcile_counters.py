@@ -0,0 +1,66 @@
+# Alterado: Novo job de reconciliação do contador users.ai_response_count
+# O contador é incrementado em update_chat_log_with_response; este job recalcula
+# o valor a partir de chat_logs (fonte da verdade) e corrige divergências, por
+# exemplo respostas gravadas antes da coluna existir ou alterações manuais.
+# Pode rodar avulso: python -m app.workers.reconcile_counters
+
+import logging
+import time
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.core.database import SessionLocal
+
+logger = logging.getLogger("ReconcileCounters")
+
+# Alterado: Compare-and-set. O valor lido (observed) vem do mesmo snapshot da contagem;
+# se update_chat_log_with_response incrementar o contador durante o comando, o Postgres
+# reavalia o WHERE na versão nova da linha, ela deixa de bater com observed e não é
+# sobrescrita com a contagem antiga (o que deixaria um lead passar do limite).
+RECONCILE_SQL = text("""
+    UPDATE users u
+    SET ai_response_count = c.total
+    FROM (
+        SELECT u2.id, u2.ai_response_count AS observed, COUNT(cl.id) AS total
+        FROM users u2
+        LEFT JOIN chat_logs cl
+               ON cl.user_id = u2.id
+              AND cl.response_text IS NOT NULL
+        GROUP BY u2.id
+    ) c
+    WHERE u.id = c.id
+      AND u.ai_response_count IS NOT DISTINCT FROM c.observed
+      AND c.observed IS DISTINCT FROM c.total
+""")
+
+def reconcile_ai_response_counts(db: Session) -> int:
+    """
+    Recalcula users.ai_response_count a partir de chat_logs.
+
+    Returns:
+        int: quantidade de usuários corrigidos
+    """
+    result = db.execute(RECONCILE_SQL)
+    db.commit()
+    return result.rowcount
+
+def reconcile_loop():
+    logger.info("Iniciando reconciliação periódica de contadores...")
+    while True:
+        try:
+            with SessionLocal() as db:
+                fixed = reconcile_ai_response_counts(db)
+            if fixed:
+                logger.warning(f"Contador de respostas corrigido para {fixed} usuário(s)")
+            else:
+                logger.info("Contadores de respostas consistentes")
+        except Exception as e:
+            logger.error(f"Erro na reconciliação de contadores: {e}")
+
+        time.sleep(settings.COUNTER_RECONCILE_INTERVAL_SECONDS)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    with SessionLocal() as db:
+        total = reconcile_ai_response_counts(db)
+    logger.info(f"Reconciliação concluída: {total} usuário(s) corrigido(s)")
@@ -0,0 +1,111 @@
+# Alterado: Novo job de manutenção dos rollups por hora do dashboard
+# Os gráficos agregavam request_queue/processing_logs inteiras a cada renderização.
+# Este job recalcula só os buckets entre (marca d'água - ROLLUP_LOOKBACK_HOURS) e o
+# início da hora atual e avança a marca; o dashboard lê os rollups antes da marca e
+# as tabelas brutas só depois dela (hora corrente).
+# Pode rodar avulso: python -m app.workers.rollup_job
+
+import logging
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.timezone import now_br
+from app.models.all_models import RollupState
+
+logger = logging.getLogger("RollupJob")
+
+ROLLUP_NAME = "hourly"
+
+# Início usado no primeiro cálculo (sem marca d'água): recalcula todo o histórico
+ROLLUP_EPOCH = datetime(1970, 1, 1)
+
+# (tabela do rollup, INSERT ... SELECT do intervalo [:since, :until))
+ROLLUP_QUERIES = [
+    ("rollup_queue_status_hourly", text("""
+        INSERT INTO rollup_queue_status_hourly
+            (bucket, status, request_count, duration_seconds_sum, duration_count)
+        SELECT
+            date_trunc('hour', created_at) AS bucket,
+            status,
+            count(*),
+            COALESCE(SUM(EXTRACT(EPOCH FROM (updated_at - created_at)))
+                     FILTER (WHERE updated_at IS NOT NULL AND status IN ('completed', 'failed')), 0),
+            count(*) FILTER (WHERE updated_at IS NOT NULL AND status IN ('completed', 'failed'))
+        FROM request_queue
+        WHERE created_at >= :since AND created_at < :until
+          AND status IS NOT NULL
+        GROUP BY 1, 2
+    """)),
+    ("rollup_step_hourly", text("""
+        INSERT INTO rollup_step_hourly (bucket, step, step_count)
+        SELECT date_trunc('hour', timestamp) AS bucket, step, count(*)
+        FROM processing_logs
+        WHERE timestamp >= :since AND timestamp < :until
+          AND step IS NOT NULL
+        GROUP BY 1, 2
+    """)),
+    ("rollup_user_requests_hourly", text("""
+        INSERT INTO rollup_user_requests_hourly (bucket, phone, request_count)
+        SELECT date_trunc('hour', created_at) AS bucket, phone, count(*)
+        FROM request_queue
+        WHERE created_at >= :since AND created_at < :until
+          AND phone IS NOT NULL AND phone != ''
+        GROUP BY 1, 2
+    """)),
+]
+
+def refresh_rollups(db: Session) -> dict:
+    """
+    Recalcula os buckets completos desde a última execução (menos a janela de
+    ROLLUP_LOOKBACK_HOURS) e avança a marca d'água para o início da hora atual.
+
+    Returns:
+        dict: intervalo recalculado (since, until)
+    """
+    # Serializa execuções concorrentes (várias réplicas do worker)
+    db.execute(text("SELECT pg_advisory_xact_lock(hashtext(:name))"), {"name": f"rollup_{ROLLUP_NAME}"})
+
+    state = db.get(RollupState, ROLLUP_NAME)
+    until = now_br().replace(tzinfo=None, minute=0, second=0, microsecond=0)
+    if state:
+        since = state.high_water - timedelta(hours=settings.ROLLUP_LOOKBACK_HOURS)
+    else:
+        since = ROLLUP_EPOCH
+
+    bounds = {"since": since, "until": until}
+    for table, insert_sql in ROLLUP_QUERIES:
+        db.execute(text(f"DELETE FROM {table} WHERE bucket >= :since AND bucket < :until"), bounds)
+        db.execute(insert_sql, bounds)
+
+    db.execute(
+        pg_insert(RollupState)
+        .values(name=ROLLUP_NAME, high_water=until, updated_at=now_br())
+        .on_conflict_do_update(
+            index_elements=[RollupState.name],
+            set_={"high_water": until, "updated_at": now_br()}
+        )
+    )
+    db.commit()
+    return bounds
+
+def rollup_loop():
+    logger.info("Iniciando manutenção periódica dos rollups do dashboard...")
+    while True:
+        try:
+            with SessionLocal() as db:
+                bounds = refresh_rollups(db)
+            logger.info(f"Rollups atualizados ({bounds['since']} até {bounds['until']})")
+        except Exception as e:
+            logger.error(f"Erro ao atualizar rollups: {e}")
+
+        time.sleep(settings.ROLLUP_INTERVAL_SECONDS)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    with SessionLocal() as db:
+        bounds = refresh_rollups(db)
+    logger.info(f"Rollups atualizados ({bounds['since']} até {bounds['until']})")
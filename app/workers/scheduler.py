@@ -0,0 +1,113 @@
+# Alterado: Agendador (APScheduler) das tarefas periódicas da fila
+# - reaper (visibility timeout): devolve à fila os itens travados em 'processing' por
+#   um worker que caiu. As retentativas em si não dependem de varredura: cada falha
+#   agenda next_attempt_at (app/services/retry_service.py).
+# - limpeza de ingest_dedup: IDs de mensagens mais antigos que DEDUP_RETENTION_DAYS.
+# - publicação do estado do circuit breaker/limite AIMD do n8n em upstream_health.
+
+import logging
+import os
+import socket
+from datetime import timedelta
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy import text
+from apscheduler.schedulers.background import BackgroundScheduler
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.timezone import TIMEZONE_BR, now_br
+from app.models.all_models import UpstreamHealth
+from app.services.resilience import n8n_guard
+from app.services.retry_service import reap_stuck_items, release_orphan_siblings
+from app.workers.worker import log_step
+
+logger = logging.getLogger("Scheduler")
+
+def reap_stuck_items_job():
+    try:
+        with SessionLocal() as db:
+            reaped = reap_stuck_items(db)
+        for item_id, status in reaped:
+            log_step(item_id, "REAPED", "error",
+                     f"Sem conclusão após {settings.VISIBILITY_TIMEOUT_SECONDS:.0f}s em processamento; novo status: {status}")
+        if reaped:
+            logger.warning(f"{len(reaped)} item(ns) travado(s) em processamento devolvido(s) à fila")
+
+        # Alterado: Agrupadas a um principal que terminou sem reivindicá-las de novo
+        with SessionLocal() as db:
+            released = release_orphan_siblings(db)
+        for item_id in released:
+            log_step(item_id, "REAPED", "success", "Item principal do agrupamento já terminou; mensagem liberada")
+        if released:
+            logger.warning(f"{len(released)} mensagem(ns) agrupada(s) órfã(s) devolvida(s) à fila")
+    except Exception as e:
+        logger.error(f"Erro no reaper da fila: {e}")
+
+def purge_ingest_dedup_job():
+    try:
+        cutoff = now_br() - timedelta(days=settings.DEDUP_RETENTION_DAYS)
+        with SessionLocal() as db:
+            removed = db.execute(
+                text("DELETE FROM ingest_dedup WHERE created_at < :cutoff"), {"cutoff": cutoff}
+            ).rowcount
+            db.commit()
+        if removed:
+            logger.info(f"{removed} ID(s) de mensagem antigo(s) removido(s) de ingest_dedup")
+    except Exception as e:
+        logger.error(f"Erro na limpeza de ingest_dedup: {e}")
+
+# Identifica este processo em upstream_health
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+def publish_upstream_health_job():
+    try:
+        snapshot = n8n_guard.snapshot()
+        values = {
+            "instance": INSTANCE_ID,
+            "upstream": snapshot["name"],
+            "state": snapshot["state"],
+            "concurrency_limit": snapshot["limit"],
+            "in_flight": snapshot["in_flight"],
+            "details": snapshot,
+            "updated_at": now_br(),
+        }
+        with SessionLocal() as db:
+            db.execute(
+                pg_insert(UpstreamHealth).values(**values).on_conflict_do_update(
+                    index_elements=[UpstreamHealth.instance, UpstreamHealth.upstream],
+                    set_={key: value for key, value in values.items() if key not in ("instance", "upstream")}
+                )
+            )
+            db.commit()
+        if snapshot["state"] != "closed":
+            logger.warning(f"Circuito do n8n: {snapshot}")
+    except Exception as e:
+        logger.error(f"Erro ao publicar estado do n8n: {e}")
+
+def build_scheduler() -> BackgroundScheduler:
+    scheduler = BackgroundScheduler(timezone=TIMEZONE_BR)
+    scheduler.add_job(
+        reap_stuck_items_job,
+        "interval",
+        seconds=settings.REAPER_INTERVAL_SECONDS,
+        id="reap_stuck_items",
+        max_instances=1,
+        coalesce=True,
+        next_run_time=now_br()
+    )
+    scheduler.add_job(
+        purge_ingest_dedup_job,
+        "interval",
+        hours=6,
+        id="purge_ingest_dedup",
+        max_instances=1,
+        coalesce=True
+    )
+    scheduler.add_job(
+        publish_upstream_health_job,
+        "interval",
+        seconds=settings.UPSTREAM_HEALTH_PUBLISH_SECONDS,
+        id="publish_upstream_health",
+        max_instances=1,
+        coalesce=True
+    )
+    return scheduler
@@ -0,0 +1,197 @@
+# Alterado: Novo gravador em lote dos ProcessingLog (passos do worker)
+# Antes, cada log_step fazia db.add + commit dentro da transação de negócio do
+# worker: 4 a 6 commits (e fsyncs) extras por mensagem. Agora os passos vão para
+# um buffer em memória compartilhado por todos os workers do processo, e uma
+# thread grava tudo com INSERTs multi-linha quando o lote enche ou o tempo vence.
+
+import atexit
+import logging
+import queue
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from sqlalchemy import insert
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.timezone import now_br
+from app.models.all_models import ProcessingLog
+
+logger = logging.getLogger("StepLogWriter")
+
+
+class StepLogWriter:
+    """
+    Buffer de ProcessingLog com flush por tamanho (batch_size) ou tempo (flush_interval).
+
+    - write() nunca bloqueia: se o buffer estiver cheio, a linha é descartada e contada
+      em 'dropped'.
+    - Se o INSERT do lote falhar, as linhas são regravadas uma a uma (savepoint por
+      linha): só a linha com erro fica para trás. Linhas que falharem voltam para a
+      próxima tentativa, com backoff ('delayed'), e após max_retries falhas são
+      descartadas ('dropped').
+    - stop() grava o que restou no buffer (chamado no encerramento do processo).
+    """
+
+    def __init__(self, batch_size: int, flush_interval: float, max_queue: int, max_retries: int):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        # (linha, falhas) a regravar uma a uma
+        self._retry: List[Tuple[Dict, int]] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.written = 0
+        self.dropped = 0
+        self.delayed = 0
+        self.flushes = 0
+
+    # --- API pública --------------------------------------------------------
+
+    def write(self, queue_id: int, step: str, status: str, details: str = None):
+        self._ensure_started()
+        row = {
+            "queue_id": queue_id,
+            "step": step,
+            "status": status,
+            "details": details,
+            # Horário do passo (não do flush)
+            "timestamp": now_br(),
+        }
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "buffered": self._queue.qsize() + len(self._retry),
+                "written": self.written,
+                "dropped": self.dropped,
+                "delayed": self.delayed,
+                "flushes": self.flushes,
+            }
+
+    def stop(self, timeout: float = 10.0):
+        """Para a thread e grava o restante do buffer."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=timeout)
+        self._thread = None
+        logger.info(f"Gravador de passos encerrado: {self.stats()}")
+
+    # --- Internos -----------------------------------------------------------
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="step-log-writer", daemon=True)
+                self._thread.start()
+
+    def _collect(self) -> List[Dict]:
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or (self._stop.is_set() and self._queue.empty()):
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, rows: List[Dict]):
+        if not rows:
+            return
+        try:
+            with SessionLocal() as db:
+                db.execute(insert(ProcessingLog).values(rows))
+                db.commit()
+            with self._lock:
+                self.written += len(rows)
+                self.flushes += 1
+
+        except Exception as e:
+            # Alterado: Uma linha inválida derrubava o INSERT multi-linha inteiro (e, após
+            # max_retries, o lote todo era descartado). Regrava já, linha a linha.
+            logger.error(f"Falha ao gravar lote de {len(rows)} passo(s), regravando um a um: {e}")
+            self._retry.extend((row, 0) for row in rows)
+            self._retry_rows()
+
+    def _retry_rows(self):
+        """Regrava as linhas pendentes uma a uma (savepoint por linha)."""
+        pending, self._retry = self._retry, []
+        failed = []
+        try:
+            with SessionLocal() as db:
+                for row, failures in pending:
+                    try:
+                        with db.begin_nested():
+                            db.execute(insert(ProcessingLog).values(row))
+                    except Exception as e:
+                        failed.append((row, failures + 1, e))
+                db.commit()
+        except Exception as e:
+            # Sem conexão (ou commit falhou): todas as linhas contam uma falha
+            failed = [(row, failures + 1, e) for row, failures in pending]
+
+        with self._lock:
+            self.written += len(pending) - len(failed)
+            for row, failures, e in failed:
+                if failures >= self.max_retries:
+                    self.dropped += 1
+                    logger.error(f"Passo {row['step']} do item {row['queue_id']} descartado após {failures} falhas: {e}")
+                else:
+                    self.delayed += 1
+                    self._retry.append((row, failures))
+        if self._retry:
+            logger.error(f"{len(self._retry)} passo(s) com falha; nova tentativa com backoff")
+
+    def _retry_backoff(self):
+        """Espera antes de regravar (dobra a cada falha); no encerramento, no máximo 1s."""
+        failures = max(failures for _, failures in self._retry)
+        delay = min(30.0, max(self.flush_interval, 0.1) * (2 ** (failures - 1)))
+        if self._stop.is_set():
+            time.sleep(min(delay, 1.0))
+        else:
+            self._stop.wait(delay)
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self._retry:
+                self._retry_backoff()
+                self._retry_rows()
+            self._flush(self._collect())
+
+        # Encerramento: drena o que sobrou (linhas com falha são re-tentadas até max_retries)
+        while True:
+            if self._retry:
+                self._retry_backoff()
+                self._retry_rows()
+            batch = self._collect()
+            if not batch and not self._retry:
+                break
+            self._flush(batch)
+
+
+step_log_writer = StepLogWriter(
+    batch_size=settings.STEP_LOG_BATCH_SIZE,
+    flush_interval=settings.STEP_LOG_FLUSH_INTERVAL,
+    max_queue=settings.STEP_LOG_MAX_QUEUE,
+    max_retries=settings.STEP_LOG_MAX_RETRIES
+)
+
+# Garante o flush final mesmo se o processo encerrar sem chamar stop()
+atexit.register(step_log_writer.stop)
@@ -1,200 +1,474 @@
 import logging
 import time
-from sqlalchemy.orm import Session
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import List, Optional
+from sqlalchemy.orm import Session, defer
+from app.core.config import settings
 from app.core.database import SessionLocal
-from app.models.all_models import RequestQueue, ProcessingLog
+from app.core.timezone import now_br, format_br
+from app.core.metrics import observe_step
+from app.models.all_models import RequestQueue
+from app.services.outbound_service import enqueue_message, request_notifier
+from app.services.ai_service import process_with_n8n
+from app.services.blob_store import resolve_media
+from app.services.queue_service import claim_sibling_items, TEXT_MESSAGE_TYPES
+from app.services.message_envelope import MessageEnvelope
+from app.services.retry_service import schedule_retry, defer_item
+from app.services.resilience import n8n_guard, UpstreamPermit, UpstreamUnavailable
+from app.workers.step_log_writer import step_log_writer
+from app.workers.profiling import span, trace_request
+from app.services.flow_service import (
+    Notifier,
+    get_or_create_user,
+    process_lead_logic,
+    check_block_and_compliant,
+    get_chat_context,
+    save_chat_log,
+    update_chat_log_with_response
+)
 
 logger = logging.getLogger("Worker")
 
-def log_step(db: Session, queue_id: int, step: str, status: str, details: str = None):
-    new_log = ProcessingLog(
-        queue_id=queue_id,
-        step=step,
-        status=status,
-        details=details
+def load_item(db: Session, queue_id: int) -> Optional[RequestQueue]:
+    """
+    Alterado: Carrega o item sem o payload (carga adiada): o worker usa o envelope
+    extraído na ingestão; o payload só é lido se acessado (linhas antigas).
+    """
+    return db.query(RequestQueue).options(defer(RequestQueue.payload)).filter(RequestQueue.id == queue_id).first()
+
+def log_step(queue_id: int, step: str, status: str, details: str = None):
+    # Alterado: Não faz mais db.add + commit por passo. O passo vai para o buffer do
+    # StepLogWriter, que grava em lote (INSERT multi-linha) fora da transação do worker.
+    step_log_writer.write(queue_id, step, status, details)
+    # Alterado: Contagem e latência por passo para o /metrics
+    observe_step(queue_id, step, status)
+
+def retry_or_fail(db: Session, item: RequestQueue) -> str:
+    """
+    Alterado: Falhas transitórias agendam nova tentativa com backoff (next_attempt_at)
+    em vez de marcar 'failed' e esperar a varredura do antigo retry manager.
+    """
+    status = schedule_retry(db, item)
+    if status == "pending":
+        log_step(item.id, "RETRY", "success",
+                 f"Tentativa {item.attempts} agendada para {format_br(item.next_attempt_at)}")
+    return status
+
+# Alterado: O processamento foi dividido em fases para (1) não segurar uma conexão do
+# banco durante a chamada ao n8n (até 180s) e (2) permitir que o engine asyncio
+# (app/workers/async_engine.py) reutilize exatamente as mesmas regras via run_sync:
+#   prepare_request -> chamada ao n8n (sem sessão aberta) -> finish_request
+
+@dataclass
+class PreparedRequest:
+    """Dados extraídos e gravados na fase de preparação, usados nas fases seguintes."""
+    queue_id: int
+    phone: str
+    message_text: str
+    message_type: str
+    media_data: Optional[str]
+    evo_id: Optional[str]
+    is_audio: bool
+    user_name: Optional[str]
+    chat_log_id: int
+    context: str
+
+def defer_request(db: Session, item: RequestQueue, seconds: float, reason: str):
+    defer_item(db, item, seconds)
+    log_step(item.id, "DEFERRED", "success", f"{reason}; nova tentativa em {format_br(item.next_attempt_at)}")
+
+def defer_if_unavailable(db: Session, queue_id: int) -> bool:
+    """
+    Alterado: Com o circuito do n8n aberto, adia o item antes da preparação (sem gravar
+    chat_log nem enviar nada). Retorna True se o item foi adiado.
+    """
+    if not n8n_guard.breaker.is_open():
+        return False
+
+    item = load_item(db, queue_id)
+    if item:
+        defer_request(db, item, n8n_guard.breaker.retry_after(), "Circuito do n8n aberto")
+        db.commit()
+    return True
+
+def defer_unavailable(db: Session, queue_id: int, error: UpstreamUnavailable):
+    """Adia o item recusado pelo guard do n8n (circuito aberto ou limite esgotado)."""
+    item = load_item(db, queue_id)
+    if item:
+        defer_request(db, item, error.retry_after, str(error))
+        db.commit()
+
+def reserve_n8n(queue_id: int) -> Optional[UpstreamPermit]:
+    """
+    Alterado: Reserva a vaga do n8n (circuito + limite AIMD) ANTES da preparação. Sem
+    vaga, o item é adiado sem ter gravado chat_log nem enfileirado avisos de lead/bloqueio
+    (que a nova tentativa gravaria de novo). Retorna None se o item foi adiado.
+    """
+    try:
+        return n8n_guard.reserve()
+    except UpstreamUnavailable as e:
+        with SessionLocal() as db:
+            defer_unavailable(db, queue_id, e)
+        return None
+
+def run_phase(db: Session, queue_id: int, phase, *args):
+    """
+    Executa uma fase com a sessão informada. Qualquer erro inesperado registra o passo
+    ERROR e agenda nova tentativa (ou marca 'failed' se as tentativas acabaram).
+    """
+    try:
+        return phase(db, *args)
+    except Exception as e:
+        logger.error(f"Erro ao processar item {queue_id}: {e}")
+        db.rollback()
+        log_step(queue_id, "ERROR", "error", str(e))
+        item = load_item(db, queue_id)
+        if item:
+            retry_or_fail(db, item)
+            db.commit()
+        return None
+
+# Alterado: Agrupamento (debounce) de mensagens de texto seguidas do mesmo usuário.
+# O item principal reivindica as mensagens de texto pendentes e mais novas do mesmo
+# telefone e espera até o usuário "parar de digitar" por COALESCE_WINDOW_SECONDS
+# (limitado a COALESCE_MAX_WAIT_SECONDS). Tudo vira uma chamada ao n8n e uma resposta.
+
+@dataclass
+class CoalesceState:
+    queue_id: int
+    phone: str
+    last_seen: datetime          # created_at da mensagem mais recente do grupo
+    started: float = field(default_factory=time.monotonic)
+    sibling_ids: List[int] = field(default_factory=list)
+    texts: List[str] = field(default_factory=list)
+
+def collect_siblings(db: Session, state: CoalesceState) -> int:
+    """Reivindica novas mensagens do mesmo telefone e as adiciona ao grupo."""
+    limit = settings.COALESCE_MAX_MESSAGES - 1 - len(state.sibling_ids)
+    after_id = state.sibling_ids[-1] if state.sibling_ids else state.queue_id
+    rows = claim_sibling_items(db, state.queue_id, state.phone, after_id, limit)
+
+    for sibling_id, envelope, payload, created_at in rows:
+        # Alterado: Texto lido do envelope gravado na ingestão (payload só em linhas antigas)
+        sibling = MessageEnvelope.load(envelope, payload)
+        state.sibling_ids.append(sibling_id)
+        state.texts.append(sibling.text if sibling.is_text else "")
+        if created_at and created_at > state.last_seen:
+            state.last_seen = created_at
+    return len(rows)
+
+def start_coalescing(db: Session, queue_id: int) -> Optional[CoalesceState]:
+    """Abre um grupo para o item se ele for texto e a janela estiver ativa."""
+    if settings.COALESCE_WINDOW_SECONDS <= 0:
+        return None
+
+    # Alterado: Usa as colunas extraídas na ingestão (sem carregar o payload)
+    row = db.query(
+        RequestQueue.phone, RequestQueue.message_type, RequestQueue.created_at
+    ).filter(RequestQueue.id == queue_id).first()
+    if not row or not row.phone or row.message_type not in TEXT_MESSAGE_TYPES:
+        return None
+
+    state = CoalesceState(queue_id=queue_id, phone=row.phone, last_seen=row.created_at)
+    collect_siblings(db, state)
+    return state
+
+def coalesce_wait_seconds(state: CoalesceState) -> float:
+    """Quanto ainda esperar por novas mensagens (0 = grupo fechado)."""
+    if len(state.sibling_ids) + 1 >= settings.COALESCE_MAX_MESSAGES:
+        return 0.0
+
+    # created_at é gravado sem timezone, já no horário de Brasília
+    now = now_br().replace(tzinfo=None)
+    remaining = (state.last_seen + timedelta(seconds=settings.COALESCE_WINDOW_SECONDS) - now).total_seconds()
+    budget = settings.COALESCE_MAX_WAIT_SECONDS - (time.monotonic() - state.started)
+    return max(0.0, min(remaining, budget))
+
+def settle_coalesced(db: Session, state: CoalesceState):
+    """
+    Finaliza as mensagens agrupadas conforme o resultado do item principal:
+    concluído ou falha definitiva -> agrupadas ficam com o mesmo status; retentativa
+    ou adiado -> voltam para 'pending' presas ao principal (coalesced_into), fora do
+    claim, e são reivindicadas de novo pelo principal quando ele for reprocessado.
+    """
+    if not state.sibling_ids:
+        return
+
+    primary = db.query(RequestQueue.status, RequestQueue.attempts).filter(
+        RequestQueue.id == state.queue_id
+    ).first()
+    finished = primary is not None and primary.status in ("completed", "failed")
+
+    # Alterado: Agrupadas continuam do principal até ele terminar (antes voltavam soltas e
+    # eram processadas cada uma por conta própria, com respostas duplicadas)
+    db.query(RequestQueue).filter(RequestQueue.id.in_(state.sibling_ids)).update(
+        {
+            "status": primary.status if finished else "pending",
+            "claimed_at": None,
+            "next_attempt_at": None,
+            "coalesced_into": None if finished or primary is None else state.queue_id,
+            "attempts": primary.attempts if primary is not None else RequestQueue.attempts,
+        },
+        synchronize_session=False
     )
-    db.add(new_log)
     db.commit()
 
-def process_request(queue_id: int):
-    # Cria uma nova sessão para esta thread
-    db = SessionLocal()
+    if finished:
+        step_status = "success" if primary.status == "completed" else "error"
+        for sibling_id in state.sibling_ids:
+            log_step(sibling_id, "COALESCED", step_status, f"Agrupada no item {state.queue_id} ({primary.status})")
+
+def coalesce(queue_id: int) -> Optional[CoalesceState]:
+    """Versão síncrona (engine de threads) do ciclo de agrupamento."""
     try:
-        item = db.query(RequestQueue).filter(RequestQueue.id == queue_id).first()
-        if not item:
-            logger.error(f"Item {queue_id} não encontrado para processamento.")
-            return
+        with SessionLocal() as db:
+            state = start_coalescing(db, queue_id)
+
+        while state is not None:
+            wait = coalesce_wait_seconds(state)
+            if wait <= 0:
+                break
+            time.sleep(wait)
+            with SessionLocal() as db:
+                collect_siblings(db, state)
+
+        return state
+    except Exception as e:
+        # Agrupamento é otimização: em caso de erro segue com o que já foi reunido
+        logger.error(f"Erro no agrupamento do item {queue_id}: {e}")
+        return None
 
-        logger.info(f"Iniciando processamento do item {queue_id}")
-        log_step(db, queue_id, "START", "success", "Iniciando fluxo do agente")
-
-        # Payload disponível em item.payload
-        # Extrair dados do payload (Evolution API v2 structure)
-        # Exemplo: body -> data -> message -> conversation (texto) ou audioMessage
-        # Payload disponível em item.payload
-        payload = item.payload
-        
-        # Tenta pegar 'data' de 'body' ou da raiz
-        body = payload.get("body", {})
-        data = body.get("data")
-        
-        if not data:
-            data = payload.get("data", {})
-            
-        key = data.get("key", {})
-        remote_jid = key.get("remoteJid", "")
-        if not remote_jid:
+def prepare_request(db: Session, queue_id: int, notify: Notifier = enqueue_message,
+                    extra_texts: List[str] = ()) -> Optional[PreparedRequest]:
+    """
+    Passos de extração, identificação do usuário, regras e contexto.
+
+    extra_texts: textos de mensagens agrupadas (mesmo usuário), anexados à mensagem.
+
+    Returns:
+        PreparedRequest se o item deve seguir para o n8n; None se o fluxo terminou aqui
+        (status do item já gravado).
+    """
+    with span("load_item"):
+        item = load_item(db, queue_id)
+    if not item:
+        logger.error(f"Item {queue_id} não encontrado para processamento.")
+        return None
+
+    logger.info(f"Iniciando processamento do item {queue_id}")
+    log_step(queue_id, "START", "success", "Iniciando fluxo do agente")
+
+    # Alterado: Cada etapa é medida por span() (no-op com PROFILING_SPANS_ENABLED=False)
+    with span("extract"):
+        # Alterado: Dados já extraídos na ingestão (request_queue.envelope); o payload
+        # só é lido (carga adiada) em linhas antigas, sem envelope
+        if item.envelope:
+            envelope = MessageEnvelope.from_dict(item.envelope)
+        else:
+            envelope = MessageEnvelope.from_payload(item.payload)
+
+        if not envelope.phone:
             logger.error("Não foi possível identificar remoteJid")
-            log_step(db, queue_id, "EXTRACT", "error", "RemoteJid não encontrado")
+            log_step(queue_id, "EXTRACT", "error", "RemoteJid não encontrado")
             item.status = "failed"
             db.commit()
-            return
-            
-        phone = remote_jid.split("@")[0]
-        push_name = data.get("pushName", "Desconhecido")
-        
-        # Extrair dados básicos para log
-        evo_id = key.get("id")
-        
-        # Extrair mensagem
-        msg_obj = data.get("message", {})
-        message_type = data.get("messageType", "text") # default text
-        
-        # Mapeamento básico de tipos aceitos
-        # Texto pode vir como "conversation" ou "extendedTextMessage"
-        # Audio como "audioMessage"
-        
-        is_text = "conversation" in msg_obj or "extendedTextMessage" in msg_obj
-        is_audio = "audioMessage" in msg_obj
-        
+            return None
+
+        phone = envelope.phone
+        push_name = envelope.push_name or "Desconhecido"
+        evo_id = envelope.evolution_id
+        message_type = envelope.declared_type or "text" # default text
+        is_audio = envelope.is_audio
+
         # (*Melhoria) 1. Verifica no json da requisição o tipo de mensagem enviada
-        if not (is_text or is_audio):
+        # Texto pode vir como "conversation" ou "extendedTextMessage"; áudio como "audioMessage"
+        if envelope.kind is None:
             logger.info(f"Tipo de mensagem não suportado: {message_type}")
-            send_message(phone, "Desculpe, no momento só consigo processar mensagens de texto e áudio.")
-            log_step(db, queue_id, "TYPE_CHECK", "stopped", f"Tipo não suportado: {message_type}")
-            item.status = "completed"
-            db.commit()
-            return
-            
-        message_text = msg_obj.get("conversation") or \
-                       msg_obj.get("extendedTextMessage", {}).get("text") or \
-                       ""
-        
-        media_data = None
-        if is_audio:
-             if not message_text:
-                message_text = "" # Placeholder removido (será preenchido pós-transcrição)
-             
-             # Tentar extrair base64 do payload (requer configuração includeBase64OnData na Evolution)
-             audio_msg = msg_obj.get("audioMessage", {})
-             # Evolution v2 as vezes manda direto ou pode precisar de fetch. O usuario pediu para enviar base64.
-             # Vamos tentar pegar 'base64' (comum em algumas versoes) ou verificar se há necessidade de download.
-             # Por hora, assumindo que vem no payload conforme padrao de webhook full
-             media_data = audio_msg.get("base64") 
-             
-             if not media_data:
-                 logger.warning("Base64 de áudio não encontrado no payload. Verifique cfg da Evolution.")
-
-        if not message_text and not is_audio:
-            logger.warning("Mensagem vazia ou tipo não suportado.")
-            log_step(db, queue_id, "EXTRACT", "skipped", "Mensagem sem texto")
+            notify(phone, "Desculpe, no momento só consigo processar mensagens de texto e áudio.")
+            log_step(queue_id, "TYPE_CHECK", "stopped", f"Tipo não suportado: {message_type}")
             item.status = "completed"
             db.commit()
-            return
+            return None
 
-        from app.services.flow_service import (
-            get_or_create_user, 
-            process_lead_logic, 
-            check_block_and_compliant, 
-            get_chat_context, 
-            save_chat_log,
-            update_chat_log_with_response
-        )
-        from app.services.evolution_service import send_message
-        from app.services.ai_service import process_with_n8n
-
-        # Passo 1
-        log_step(db, queue_id, "STEP_1", "processing", "Identificando usuário")
+        message_text = envelope.text
+
+        # Áudio: referência do blob store (o conteúdo só é lido do disco na hora de chamar
+        # o n8n); texto da mensagem é preenchido depois com a transcrição
+        media_data = envelope.media_ref
+        if is_audio and not media_data:
+            logger.warning("Base64 de áudio não encontrado no payload. Verifique cfg da Evolution.")
+
+        if extra_texts and not is_audio:
+            # Mensagens seguidas do mesmo usuário viram uma só pergunta
+            message_text = "\n".join([message_text, *[t for t in extra_texts if t]])
+            log_step(queue_id, "COALESCE", "success", f"{len(extra_texts)} mensagem(ns) agrupada(s)")
+
+    if not message_text and not is_audio:
+        logger.warning("Mensagem vazia ou tipo não suportado.")
+        log_step(queue_id, "EXTRACT", "skipped", "Mensagem sem texto")
+        item.status = "completed"
+        db.commit()
+        return None
+
+    # Passo 1
+    log_step(queue_id, "STEP_1", "processing", "Identificando usuário")
+    with span("resolve_user"):
         user = get_or_create_user(db, phone, push_name)
-        
+
         # Loga a mensagem do usuário (COM NOVOS CAMPOS E FK)
         # Se for audio, message_text vai vazio. Será atualizado depois.
-        user_msg_log = save_chat_log(db, user.id, message_text, sent_by_user=True, 
-                                     message_type=message_type, 
-                                     media_data=media_data, 
+        user_msg_log = save_chat_log(db, user.id, message_text, sent_by_user=True,
+                                     message_type=message_type,
+                                     media_data=media_data,
                                      evolution_id=evo_id)
 
+    with span("lead_check"):
         if not user.is_client:
             # Lógica de Lead
-            should_continue = process_lead_logic(db, user, message_text)
+            should_continue = process_lead_logic(db, user, message_text, notify=notify)
             if not should_continue:
-                log_step(db, queue_id, "LEAD_RULE", "stopped", "Regra de lead interrompeu fluxo")
+                log_step(queue_id, "LEAD_RULE", "stopped", "Regra de lead interrompeu fluxo")
                 item.status = "completed"
                 db.commit()
-                return
+                return None
 
         # Passo 2 e 3 (Bloqueio e Adimplência)
-        if not check_block_and_compliant(db, user):
-            log_step(db, queue_id, "BLOCK_RULE", "stopped", "Usuário bloqueado ou inadimplente")
+        if not check_block_and_compliant(db, user, notify=notify):
+            log_step(queue_id, "BLOCK_RULE", "stopped", "Usuário bloqueado ou inadimplente")
             item.status = "completed"
             db.commit()
-            return
-            
-        # Passo 4
-        # Excluir a mensagem atual do contexto para não duplicar no prompt
+            return None
+
+    # Passo 4
+    # Excluir a mensagem atual do contexto para não duplicar no prompt
+    with span("build_context"):
         context = get_chat_context(db, user.id, exclude_message_id=user_msg_log.id)
-        
-        # Passo 5
-        log_step(db, queue_id, "AI_PROCESS", "processing", "Enviando para n8n")
-        try:
+
+    # Passo 5
+    log_step(queue_id, "AI_PROCESS", "processing", "Enviando para n8n")
+
+    return PreparedRequest(
+        queue_id=queue_id,
+        phone=phone,
+        message_text=message_text,
+        message_type=message_type,
+        media_data=media_data,
+        evo_id=evo_id,
+        is_audio=is_audio,
+        user_name=user.name,
+        chat_log_id=user_msg_log.id,
+        context=context
+    )
+
+def call_n8n(prepared: PreparedRequest, permit: UpstreamPermit):
+    """Chama o n8n sem nenhuma sessão do banco aberta. Retorna (resposta, erro)."""
+    try:
+        with span("n8n_call"):
             # Enviando para n8n com novos campos e NOME DO USUARIO
-            ai_response_data = process_with_n8n(context, message_text, phone, 
-                                           user_name=user.name,
-                                           message_type=message_type, 
-                                           media_data=media_data, 
-                                           message_id=evo_id)
-            
-            if ai_response_data and isinstance(ai_response_data, dict):
-                ai_text = ai_response_data.get("respostaIA")
-                user_transcription = ai_response_data.get("perguntaUsuario")
-                
-                if not ai_text:
-                     raise Exception("Campo 'respostaIA' vazio ou nulo da IA")
-
-                # Passo 6 (Sucesso)
-                # Se for áudio, atualizamos o texto da mensagem original com a transcrição (perguntaUsuario)
-                transcription_to_save = None
-                if is_audio and user_transcription:
-                    transcription_to_save = user_transcription
-                
-                # ATUALIZA o log original com a resposta e transcrição (se houver)
-                update_chat_log_with_response(db, user_msg_log.id, ai_text, transcription=transcription_to_save) 
-                
-                send_message(phone, ai_text)
-                log_step(db, queue_id, "RESPONSE", "success", "Resposta enviada")
-                item.status = "completed"
-            else:
-                # Falha genérica n8n
-                raise Exception("Resposta inválida ou nula do n8n")
-                
-        except TimeoutError:
-            log_step(db, queue_id, "TIMEOUT", "error", "n8n não respondeu em 60s")
-            # Enviar para fila de falhas
-            item.status = "failed"
-            # TODO: Enviar email 
-            
-        except Exception as e:
-            logger.error(f"Erro IA: {e}")
-            log_step(db, queue_id, "AI_ERROR", "error", str(e))
-            item.status = "failed"
-            
-        db.commit()
-        
+            ai_response_data = process_with_n8n(prepared.context, prepared.message_text, prepared.phone,
+                                                user_name=prepared.user_name,
+                                                message_type=prepared.message_type,
+                                                media_data=resolve_media(prepared.media_data),
+                                                message_id=prepared.evo_id,
+                                                permit=permit)
+        return ai_response_data, None
     except Exception as e:
-        logger.error(f"Erro ao processar item {queue_id}: {e}")
-        log_step(db, queue_id, "ERROR", "error", str(e))
-        if item:
-            item.status = "failed"
-            db.commit()
+        return None, e
+
+def finish_request(db: Session, prepared: PreparedRequest, ai_response_data, error: Exception = None,
+                   notify: Notifier = enqueue_message):
+    """Passo 6: grava a resposta da IA, envia ao usuário e finaliza o status do item."""
+    queue_id = prepared.queue_id
+    item = load_item(db, queue_id)
+    if not item:
+        logger.error(f"Item {queue_id} não encontrado ao finalizar processamento.")
+        return None
+
+    try:
+        if error is not None:
+            raise error
+
+        if ai_response_data and isinstance(ai_response_data, dict):
+            ai_text = ai_response_data.get("respostaIA")
+            user_transcription = ai_response_data.get("perguntaUsuario")
+
+            if not ai_text:
+                 raise Exception("Campo 'respostaIA' vazio ou nulo da IA")
+
+            # Passo 6 (Sucesso)
+            # Se for áudio, atualizamos o texto da mensagem original com a transcrição (perguntaUsuario)
+            transcription_to_save = None
+            if prepared.is_audio and user_transcription:
+                transcription_to_save = user_transcription
+
+            # ATUALIZA o log original com a resposta e transcrição (se houver)
+            with span("db_update"):
+                update_chat_log_with_response(db, prepared.chat_log_id, ai_text, transcription=transcription_to_save)
+
+            # Com a fila de envio, mede só a entrega à fila (o envio à Evolution fica no /metrics)
+            with span("send"):
+                notify(prepared.phone, ai_text)
+            log_step(queue_id, "RESPONSE", "success", "Resposta enviada")
+            item.status = "completed"
+        else:
+            # Falha genérica n8n
+            raise Exception("Resposta inválida ou nula do n8n")
+
+    except TimeoutError:
+        log_step(queue_id, "TIMEOUT", "error", "n8n não respondeu em 60s")
+        # Enviar para fila de falhas
+        retry_or_fail(db, item)
+        # TODO: Enviar email
+
+    except Exception as e:
+        logger.error(f"Erro IA: {e}")
+        log_step(queue_id, "AI_ERROR", "error", str(e))
+        retry_or_fail(db, item)
+
+    db.commit()
+    return item.status
+
+def process_request(queue_id: int):
+    # Alterado: Trace do item (spans por etapa e profiler amostrado, se ativados)
+    with trace_request(queue_id):
+        _process_request(queue_id)
+
+def _process_request(queue_id: int):
+    with SessionLocal() as db:
+        if defer_if_unavailable(db, queue_id):
+            return
+
+    # Agrupa mensagens seguidas do mesmo usuário (se COALESCE_WINDOW_SECONDS > 0)
+    with span("coalesce"):
+        group = coalesce(queue_id)
+    extra_texts = group.texts if group else []
+
+    permit = None
+    try:
+        # Alterado: Vaga do n8n reservada antes de gravar qualquer coisa (sem vaga: adiado)
+        permit = reserve_n8n(queue_id)
+        if permit is None:
+            return
+
+        # Cria uma sessão só para a fase de preparação (liberada antes da chamada ao n8n)
+        # Alterado: Notifier ligado ao item (falha de entrega vira o passo SEND_FAILED)
+        notify = request_notifier(queue_id)
+        with SessionLocal() as db:
+            prepared = run_phase(db, queue_id, prepare_request, queue_id, notify, extra_texts)
+
+        if prepared is None:
+            return
+
+        ai_response_data, error = call_n8n(prepared, permit)
+
+        # Nova sessão para gravar o resultado
+        with SessionLocal() as db:
+            run_phase(db, queue_id, finish_request, prepared, ai_response_data, error, notify)
     finally:
-        db.close()
+        # Fluxo parou antes da chamada (lead, bloqueio, erro): devolve a vaga
+        if permit is not None:
+            permit.cancel()
+        if group and group.sibling_ids:
+            with SessionLocal() as db:
+                settle_coalesced(db, group)
@@ -0,0 +1,205 @@
+# Alterado: Novo módulo com pool de workers persistentes e limitados
+# Substitui o modelo antigo de "uma thread nova por item da fila", que criava
+# centenas de threads (cada uma segurando uma conexão do banco) quando o n8n ficava lento.
+
+import logging
+import queue
+import threading
+import time
+from typing import Callable
+
+logger = logging.getLogger("WorkerPool")
+
+# Sentinela usada para pedir que uma thread encerre
+_STOP = object()
+
+
+class WorkerPool:
+    """
+    Pool de threads persistentes com tamanho mínimo/máximo e auto-scaling.
+
+    - Cresce sob demanda: cada item submetido sem thread ociosa disponível cria uma
+      nova thread (até max_workers).
+    - Cresce de forma agressiva quando a fila do banco está atrasada (lag alto).
+    - Encolhe sozinho: threads acima do mínimo encerram após idle_timeout sem trabalho.
+    - Backpressure: available_slots() informa quantos itens ainda cabem; o gerenciador
+      só reivindica itens do banco quando há vaga.
+
+    Exemplo:
+        >>> pool = WorkerPool(process_request, min_workers=2, max_workers=20)
+        >>> pool.start()
+        >>> if pool.available_slots() > 0:
+        ...     pool.submit(123)
+    """
+
+    def __init__(self, target: Callable[[int], None], min_workers: int, max_workers: int,
+                 idle_timeout: float = 60.0, scale_up_lag: float = 5.0, name: str = "agente"):
+        if min_workers < 0 or max_workers < 1 or min_workers > max_workers:
+            raise ValueError(f"Configuração inválida do pool: min={min_workers}, max={max_workers}")
+
+        self._target = target
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.idle_timeout = idle_timeout
+        self.scale_up_lag = scale_up_lag
+        self._name = name
+
+        self._tasks: "queue.Queue" = queue.Queue()
+        self._lock = threading.Lock()
+        self._capacity = threading.Condition(self._lock)
+        self._workers = 0     # threads vivas
+        self._busy = 0        # threads executando um item
+        self._queued = 0      # itens submetidos aguardando thread
+        self._seq = 0         # contador para nomear threads
+        self._stopping = False
+
+    # --- Estado -------------------------------------------------------------
+
+    @property
+    def in_flight(self) -> int:
+        """Itens aceitos pelo pool e ainda não finalizados (executando + aguardando)."""
+        with self._lock:
+            return self._busy + self._queued
+
+    def available_slots(self) -> int:
+        """Quantos itens novos o pool aceita sem ultrapassar max_workers (0 se parando)."""
+        with self._lock:
+            if self._stopping:
+                return 0
+            return max(0, self.max_workers - (self._busy + self._queued))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self._workers,
+                "busy": self._busy,
+                "queued": self._queued,
+                "min": self.min_workers,
+                "max": self.max_workers,
+            }
+
+    def wait_for_capacity(self, timeout: float) -> bool:
+        """
+        Bloqueia até existir ao menos uma vaga no pool ou o timeout expirar.
+
+        Returns:
+            bool: True se há vaga disponível
+        """
+        with self._capacity:
+            return self._capacity.wait_for(
+                lambda: self._busy + self._queued < self.max_workers,
+                timeout=timeout
+            )
+
+    # --- Ciclo de vida ------------------------------------------------------
+
+    def start(self):
+        with self._lock:
+            while self._workers < self.min_workers:
+                self._spawn_locked()
+        logger.info(f"Pool iniciado com {self.min_workers} thread(s) (máximo {self.max_workers})")
+
+    def shutdown(self, wait: bool = True, timeout: float = None):
+        """Pede o encerramento de todas as threads após os itens em andamento."""
+        with self._lock:
+            self._stopping = True
+            workers = self._workers
+        for _ in range(workers):
+            self._tasks.put(_STOP)
+
+        if wait:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            with self._capacity:
+                while self._workers > 0:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        logger.warning(f"Shutdown do pool expirou com {self._workers} thread(s) ativas")
+                        break
+                    self._capacity.wait(timeout=remaining)
+
+    # --- Submissão e scaling ------------------------------------------------
+
+    def submit(self, queue_id: int) -> bool:
+        """
+        Entrega um item ao pool. Retorna False (sem enfileirar) se o pool estiver cheio.
+        """
+        with self._lock:
+            if self._stopping:
+                return False
+            if self._busy + self._queued >= self.max_workers:
+                return False
+
+            self._queued += 1
+            # Threads ociosas = vivas - ocupadas; se não sobra nenhuma para o item, cresce
+            idle = self._workers - self._busy
+            if idle < self._queued and self._workers < self.max_workers:
+                self._spawn_locked()
+
+        self._tasks.put(queue_id)
+        return True
+
+    def report_backlog(self, pending: int, lag_seconds: float):
+        """
+        Ajusta o tamanho do pool conforme o atraso da fila no banco.
+
+        Se o item pendente mais antigo está esperando mais que scale_up_lag segundos,
+        pré-aquece threads suficientes para absorver o backlog (limitado a max_workers).
+
+        Args:
+            pending: quantidade de itens pendentes no banco
+            lag_seconds: idade (s) do item pendente mais antigo
+        """
+        if pending <= 0 or lag_seconds < self.scale_up_lag:
+            return
+
+        with self._lock:
+            target = min(self.max_workers, self._busy + self._queued + pending)
+            spawned = 0
+            while self._workers < target:
+                self._spawn_locked()
+                spawned += 1
+
+        if spawned:
+            logger.info(f"Fila atrasada ({lag_seconds:.1f}s, {pending} pendentes): +{spawned} thread(s)")
+
+    # --- Internos -----------------------------------------------------------
+
+    def _spawn_locked(self):
+        self._workers += 1
+        self._seq += 1
+        t = threading.Thread(target=self._worker_loop, name=f"{self._name}-{self._seq}", daemon=True)
+        t.start()
+
+    def _worker_loop(self):
+        while True:
+            try:
+                task = self._tasks.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                # Ocioso: encerra se estiver acima do mínimo
+                with self._lock:
+                    if self._workers > self.min_workers and self._workers - self._busy > self._queued:
+                        self._workers -= 1
+                        self._capacity.notify_all()
+                        logger.debug(f"Thread {threading.current_thread().name} encerrada por ociosidade")
+                        return
+                continue
+
+            if task is _STOP:
+                with self._lock:
+                    self._workers -= 1
+                    self._capacity.notify_all()
+                return
+
+            with self._lock:
+                self._queued -= 1
+                self._busy += 1
+
+            try:
+                self._target(task)
+            except Exception as e:
+                # process_request já trata seus erros; isso é só uma rede de segurança
+                logger.error(f"Erro não tratado processando item {task}: {e}")
+            finally:
+                with self._lock:
+                    self._busy -= 1
+                    self._capacity.notify_all()
@@ -0,0 +1,141 @@
+# Gerador sintético de webhooks messages.upsert da Evolution para o benchmark.
+# Cada mensagem carrega um marcador "#bench:<id>" (no texto e no key.id) que os stubs
+# do n8n e da Evolution devolvem na resposta; assim o runner mede o tempo de ponta a
+# ponta de cada mensagem, mesmo quando o worker agrupa várias numa só resposta.
+#
+# Uso isolado (imprime N webhooks em JSON, um por linha):
+#   python -m bench.generator --messages 5 --users 3 --audio-ratio 0.2
+
+import argparse
+import base64
+import json
+import os
+import random
+import re
+import time
+import uuid
+from typing import Dict, Iterator, List
+
+# Faixa de telefones fictícios: o runner cria/limpa só usuários com esse prefixo
+BENCH_PHONE_PREFIX = "5500999"
+MARKER_PREFIX = "#bench:"
+MARKER_RE = re.compile(r"#bench:([A-Za-z0-9_-]+)")
+
+SAMPLE_TEXTS = [
+    "Oi, tudo bem?",
+    "Quais documentos preciso para abrir uma empresa?",
+    "Pode me explicar melhor a última resposta?",
+    "Qual o prazo para entregar a declaração?",
+    "Obrigado!",
+]
+
+
+def bench_phone(index: int) -> str:
+    return f"{BENCH_PHONE_PREFIX}{index:06d}"
+
+
+def find_markers(text: str) -> List[str]:
+    return MARKER_RE.findall(text or "")
+
+
+class WebhookGenerator:
+    """
+    Gera webhooks messages.upsert.
+
+    - user_dist: "uniform" (todos os usuários igualmente ativos) ou "zipf" (poucos
+      usuários concentram a maior parte das mensagens, expoente zipf_s).
+    - burst_size: mensagens seguidas do mesmo usuário (exercita o agrupamento).
+    - audio_ratio: fração de mensagens de áudio (base64 de audio_bytes bytes aleatórios).
+    """
+
+    def __init__(self, users: int = 100, user_dist: str = "uniform", zipf_s: float = 1.2,
+                 audio_ratio: float = 0.0, burst_size: int = 1, audio_bytes: int = 16000,
+                 instance: str = "bench", seed: int = None):
+        self.users = max(1, users)
+        self.user_dist = user_dist
+        self.audio_ratio = audio_ratio
+        self.burst_size = max(1, burst_size)
+        self.audio_bytes = audio_bytes
+        self.instance = instance
+        self.run_id = uuid.uuid4().hex[:8]
+        self._random = random.Random(seed)
+        self._sequence = 0
+        # Pesos da distribuição de Zipf (usuário de rank k tem peso 1/k^s)
+        self._weights = [1.0 / (rank ** zipf_s) for rank in range(1, self.users + 1)] if user_dist == "zipf" else None
+
+    def _pick_user(self) -> int:
+        if self._weights is None:
+            return self._random.randrange(self.users)
+        return self._random.choices(range(self.users), weights=self._weights)[0]
+
+    def _next_id(self) -> str:
+        self._sequence += 1
+        # key.id único por execução (a deduplicação de reentregas descartaria repetidos)
+        return f"{self.run_id}-{self._sequence}"
+
+    def build(self, user_index: int, message_id: str, audio: bool = False) -> Dict:
+        phone = bench_phone(user_index)
+        if audio:
+            media = base64.b64encode(os.urandom(self.audio_bytes)).decode("ascii")
+            message = {"audioMessage": {"mimetype": "audio/ogg; codecs=opus", "seconds": 5, "base64": media}}
+            message_type = "audioMessage"
+        else:
+            text = f"{self._random.choice(SAMPLE_TEXTS)} {MARKER_PREFIX}{message_id}"
+            message = {"conversation": text}
+            message_type = "conversation"
+
+        return {
+            "event": "messages.upsert",
+            "instance": self.instance,
+            "data": {
+                "key": {"remoteJid": f"{phone}@s.whatsapp.net", "fromMe": False, "id": message_id},
+                "pushName": f"Bench {user_index}",
+                "message": message,
+                "messageType": message_type,
+                "messageTimestamp": int(time.time()),
+            },
+        }
+
+    def messages(self, count: int) -> Iterator[Dict]:
+        """Gera 'count' mensagens, em rajadas de burst_size por usuário."""
+        produced = 0
+        while produced < count:
+            user_index = self._pick_user()
+            for _ in range(min(self.burst_size, count - produced)):
+                audio = self._random.random() < self.audio_ratio
+                yield self.build(user_index, self._next_id(), audio=audio)
+                produced += 1
+
+    def user_phones(self) -> List[str]:
+        return [bench_phone(index) for index in range(self.users)]
+
+
+def add_generator_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--users", type=int, default=100, help="Usuários distintos")
+    parser.add_argument("--user-dist", choices=["uniform", "zipf"], default="uniform")
+    parser.add_argument("--zipf-s", type=float, default=1.2, help="Expoente da distribuição de Zipf")
+    parser.add_argument("--audio-ratio", type=float, default=0.0, help="Fração de mensagens de áudio (0 a 1)")
+    parser.add_argument("--audio-bytes", type=int, default=16000, help="Tamanho do áudio sintético")
+    parser.add_argument("--burst-size", type=int, default=1, help="Mensagens seguidas do mesmo usuário")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def generator_from_args(args) -> WebhookGenerator:
+    return WebhookGenerator(
+        users=args.users,
+        user_dist=args.user_dist,
+        zipf_s=args.zipf_s,
+        audio_ratio=args.audio_ratio,
+        burst_size=args.burst_size,
+        audio_bytes=args.audio_bytes,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gera webhooks messages.upsert sintéticos")
+    parser.add_argument("--messages", type=int, default=10)
+    add_generator_arguments(parser)
+    args = parser.parse_args()
+    for payload in generator_from_args(args).messages(args.messages):
+        print(json.dumps(payload))
@@ -0,0 +1,302 @@
+# Runner do benchmark de ponta a ponta.
+# Dispara webhooks sintéticos (bench/generator.py) contra POST /webhook/evolution e mede:
+#   - ingestão: webhooks/s e mensagens/s aceitos pela API, latência p50/p95/p99 do POST;
+#   - ponta a ponta: do POST até a resposta chegar ao stub da Evolution (p50/p95/p99);
+#   - banco: comandos por mensagem (pg_stat_statements, se a extensão estiver ativa) ou
+#     transações por mensagem (pg_stat_database) como aproximação.
+#
+# Pré-requisitos (tudo local):
+#   1. Postgres com o schema da aplicação (python -m app.init_db e migrações).
+#   2. Stubs: --with-stubs sobe os dois neste processo (ou python -m bench.stubs).
+#   3. API e worker apontando para os stubs:
+#        N8N_WEBHOOK_URL=http://localhost:5678/webhook/bench EVOLUTION_API_URL=http://localhost:8081
+#        uvicorn app.main:app --port 8000   e   python -m app.workers.agent_manager
+#   4. python -m bench.run --with-stubs --messages 2000 --users 200 --concurrency 50
+#
+# Os usuários do benchmark (telefones 5500999xxxxxx) são criados como clientes para passar
+# pelas regras de lead; --cleanup apaga tudo que o benchmark gravou. Use um banco de testes.
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import sys
+import time
+from typing import Dict, List, Optional
+
+import httpx
+from sqlalchemy import text
+
+from app.core.database import SessionLocal
+from app.core.timezone import now_br
+from app.services.user_cache import notify_user_changed
+from bench.generator import (
+    BENCH_PHONE_PREFIX, WebhookGenerator, add_generator_arguments, generator_from_args
+)
+from bench.stubs import add_stub_arguments, start_stubs_from_args
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+logger = logging.getLogger("BenchRunner")
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Percentil pelo método nearest-rank (None se não há valores)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(values: List[float]) -> Dict[str, Optional[float]]:
+    def ms(value):
+        return None if value is None else round(value * 1000, 1)
+    return {
+        "count": len(values),
+        "p50_ms": ms(percentile(values, 50)),
+        "p95_ms": ms(percentile(values, 95)),
+        "p99_ms": ms(percentile(values, 99)),
+        "max_ms": ms(max(values) if values else None),
+    }
+
+
+# --- Banco -------------------------------------------------------------------
+
+def seed_users(phones: List[str]):
+    """Cria (ou reativa) os usuários do benchmark como clientes adimplentes."""
+    with SessionLocal() as db:
+        db.execute(text("""
+            INSERT INTO users (phone, name, is_client, is_blocked, is_compliant, is_canceled,
+                               ai_response_count, created_at)
+            SELECT phone, 'Bench', TRUE, FALSE, TRUE, FALSE, 0, :now
+            FROM unnest(CAST(:phones AS varchar[])) AS phone
+            ON CONFLICT (phone) DO UPDATE
+                SET is_client = TRUE, is_blocked = FALSE, is_compliant = TRUE, is_canceled = FALSE
+        """), {"phones": phones, "now": now_br()})
+        # Workers descartam o usuário do cache e releem as flags
+        for phone in phones:
+            notify_user_changed(db, phone)
+        db.commit()
+
+
+def cleanup(run_id: str):
+    """Apaga o que o benchmark gravou (fila, passos, conversas, dedup e usuários)."""
+    prefix = BENCH_PHONE_PREFIX + "%"
+    with SessionLocal() as db:
+        db.execute(text("""
+            DELETE FROM processing_logs
+            WHERE queue_id IN (SELECT id FROM request_queue WHERE phone LIKE :prefix)
+        """), {"prefix": prefix})
+        db.execute(text("DELETE FROM request_queue WHERE phone LIKE :prefix"), {"prefix": prefix})
+        db.execute(text("""
+            DELETE FROM chat_logs
+            WHERE user_id IN (SELECT id FROM users WHERE phone LIKE :prefix)
+        """), {"prefix": prefix})
+        db.execute(text("DELETE FROM ingest_dedup WHERE evolution_id LIKE :run"), {"run": run_id + "-%"})
+        db.execute(text("DELETE FROM users WHERE phone LIKE :prefix"), {"prefix": prefix})
+        db.commit()
+    logger.info("Dados do benchmark removidos")
+
+
+def db_counters() -> Dict[str, float]:
+    """Contadores acumulados do banco atual (a diferença antes/depois vai para o relatório)."""
+    counters = {}
+    with SessionLocal() as db:
+        row = db.execute(text("""
+            SELECT xact_commit + xact_rollback AS transactions,
+                   tup_inserted, tup_updated, tup_deleted, tup_returned + tup_fetched AS tup_read
+            FROM pg_stat_database
+            WHERE datname = current_database()
+        """)).mappings().first()
+        counters.update({key: float(value) for key, value in row.items()})
+
+        try:
+            statements = db.execute(text("""
+                SELECT sum(calls) FROM pg_stat_statements
+                WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+            """)).scalar()
+            counters["statements"] = float(statements or 0)
+        except Exception:
+            # Extensão pg_stat_statements não instalada: fica só a contagem de transações
+            db.rollback()
+    return counters
+
+
+# --- Carga -------------------------------------------------------------------
+
+async def drive_load(api_url: str, generator: WebhookGenerator, messages: int, batch: int,
+                     concurrency: int, rate: float, timeout: float):
+    """
+    Envia os webhooks e retorna (horário de envio por marcador, latências do POST,
+    contadores de webhooks aceitos/erros, duração da ingestão).
+    """
+    payloads = list(generator.messages(messages))
+    batches = [payloads[i:i + batch] for i in range(0, len(payloads), batch)]
+    queue: "asyncio.Queue" = asyncio.Queue()
+    for item in batches:
+        queue.put_nowait(item)
+
+    sent_at: Dict[str, float] = {}
+    post_latencies: List[float] = []
+    counts = {"accepted": 0, "http_errors": 0, "exceptions": 0}
+    started = time.monotonic()
+    interval = 1.0 / rate if rate > 0 else 0.0
+    next_slot = [started]
+    slot_lock = asyncio.Lock()
+
+    async def worker(client: httpx.AsyncClient):
+        while True:
+            try:
+                item = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            if interval:
+                # Ritmo constante de 'rate' webhooks/s entre todos os workers
+                async with slot_lock:
+                    slot = next_slot[0]
+                    next_slot[0] = max(slot, time.monotonic()) + interval
+                await asyncio.sleep(max(0.0, slot - time.monotonic()))
+
+            body = item if len(item) > 1 else item[0]
+            post_started = time.monotonic()
+            wall = time.time()
+            try:
+                response = await client.post(f"{api_url}/webhook/evolution", json=body)
+                post_latencies.append(time.monotonic() - post_started)
+                if response.status_code != 200:
+                    counts["http_errors"] += 1
+                    continue
+            except Exception as e:
+                counts["exceptions"] += 1
+                logger.warning(f"Falha no POST do webhook: {e}")
+                continue
+            counts["accepted"] += 1
+            for payload in item:
+                sent_at[payload["data"]["key"]["id"]] = wall
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+
+    return sent_at, post_latencies, counts, time.monotonic() - started
+
+
+def wait_for_responses(evolution_url: str, expected: Dict[str, float], timeout: float) -> Dict:
+    """Consulta o stub da Evolution até todas as respostas chegarem (ou o timeout)."""
+    deadline = time.monotonic() + timeout
+    received: Dict[str, float] = {}
+    sends = 0
+    with httpx.Client(timeout=10) as client:
+        while True:
+            body = client.get(f"{evolution_url}/_bench/received").json()
+            received, sends = body["received"], body["sends"]
+            done = sum(1 for marker in expected if marker in received)
+            if done >= len(expected) or time.monotonic() >= deadline:
+                break
+            logger.info(f"Respostas recebidas: {done}/{len(expected)}")
+            time.sleep(1.0)
+    return {"received": received, "sends": sends}
+
+
+def run(args) -> Dict:
+    if args.with_stubs:
+        start_stubs_from_args(args)
+
+    generator = generator_from_args(args)
+    evolution_url = args.evolution_url or f"http://127.0.0.1:{args.evolution_port}"
+    httpx.delete(f"{evolution_url}/_bench/received", timeout=10)
+
+    seed_users(generator.user_phones())
+    before = db_counters()
+
+    sent_at, post_latencies, counts, ingest_seconds = asyncio.run(drive_load(
+        args.api_url, generator, args.messages, args.batch, args.concurrency, args.rate, args.http_timeout
+    ))
+    logger.info(f"Ingestão concluída: {len(sent_at)} mensagem(ns) em {ingest_seconds:.1f}s")
+
+    result = wait_for_responses(evolution_url, sent_at, args.drain_timeout)
+    # pg_stat_database é atualizado com algum atraso pelo coletor de estatísticas
+    time.sleep(1.0)
+    after = db_counters()
+
+    received = result["received"]
+    e2e = [received[marker] - sent for marker, sent in sent_at.items() if marker in received]
+    completed = len(e2e)
+    accepted = len(sent_at)
+    webhooks = counts["accepted"]
+    deltas = {key: after[key] - before.get(key, 0.0) for key in after}
+    per_message = {f"{key}_per_message": round(value / completed, 2) for key, value in deltas.items()} if completed else {}
+
+    end_to_end_window = (max(received[m] for m in sent_at if m in received) - min(sent_at.values())) if completed else 0.0
+
+    report = {
+        "run_id": generator.run_id,
+        "messages": args.messages,
+        "accepted": accepted,
+        "completed": completed,
+        "missing": accepted - completed,
+        "ingest": {
+            "seconds": round(ingest_seconds, 2),
+            "webhooks_per_second": round(webhooks / ingest_seconds, 1) if ingest_seconds else None,
+            "messages_per_second": round(accepted / ingest_seconds, 1) if ingest_seconds else None,
+            "post_latency": summarize(post_latencies),
+            "errors": {"http": counts["http_errors"], "exception": counts["exceptions"]},
+        },
+        "end_to_end": {
+            **summarize(e2e),
+            "throughput_per_second": round(completed / end_to_end_window, 1) if end_to_end_window else None,
+            "evolution_sends": result["sends"],
+        },
+        "db": {"deltas": deltas, **per_message},
+    }
+
+    if args.cleanup:
+        cleanup(generator.run_id)
+    return report
+
+
+def print_report(report: Dict):
+    ingest, e2e, db = report["ingest"], report["end_to_end"], report["db"]
+    print()
+    print(f"Execução {report['run_id']}: {report['accepted']}/{report['messages']} aceitas, "
+          f"{report['completed']} respondidas, {report['missing']} sem resposta")
+    print(f"Ingestão: {ingest['webhooks_per_second']} webhooks/s, {ingest['messages_per_second']} msg/s "
+          f"(POST p50={ingest['post_latency']['p50_ms']}ms p95={ingest['post_latency']['p95_ms']}ms "
+          f"p99={ingest['post_latency']['p99_ms']}ms; erros={ingest['errors']})")
+    print(f"Ponta a ponta: p50={e2e['p50_ms']}ms p95={e2e['p95_ms']}ms p99={e2e['p99_ms']}ms "
+          f"max={e2e['max_ms']}ms; {e2e['throughput_per_second']} msg/s; envios Evolution={e2e['evolution_sends']}")
+    if "statements_per_message" in db:
+        print(f"Banco: {db['statements_per_message']} comandos/mensagem, "
+              f"{db.get('transactions_per_message')} transações/mensagem")
+    else:
+        print(f"Banco: {db.get('transactions_per_message')} transações/mensagem "
+              f"(pg_stat_statements indisponível)")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Benchmark de ponta a ponta do Jeronimo")
+    parser.add_argument("--api-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--evolution-url", default=None, help="Stub da Evolution (padrão: local em --evolution-port)")
+    parser.add_argument("--with-stubs", action="store_true", help="Sobe os stubs do n8n e da Evolution neste processo")
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--batch", type=int, default=1, help="Mensagens por webhook")
+    parser.add_argument("--concurrency", type=int, default=20, help="POSTs simultâneos")
+    parser.add_argument("--rate", type=float, default=0.0, help="Webhooks/s (0 = o mais rápido possível)")
+    parser.add_argument("--http-timeout", type=float, default=30.0)
+    parser.add_argument("--drain-timeout", type=float, default=300.0, help="Espera máxima pelas respostas (s)")
+    parser.add_argument("--cleanup", action="store_true", help="Apaga os dados do benchmark ao final")
+    parser.add_argument("--json", dest="json_path", default=None, help="Grava o relatório em JSON")
+    add_generator_arguments(parser)
+    add_stub_arguments(parser)
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    report = run(args)
+    print_report(report)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    sys.exit(0 if report["missing"] == 0 else 1)
@@ -0,0 +1,184 @@
+# Servidores locais que substituem o n8n e a Evolution no benchmark (só biblioteca padrão).
+#   - n8n: responde ao webhook com {"respostaIA", "perguntaUsuario"} ecoando os marcadores
+#     #bench:<id> da pergunta (e o message_id, para áudios), após a latência configurada.
+#   - Evolution: aceita POST /message/sendText/<instância> (201) e registra a hora de
+#     chegada de cada marcador; GET /_bench/received devolve {marcador: epoch}.
+# Ambos aceitam latência (média ± jitter, em ms) e taxa de erro (respostas 500).
+#
+# Para apontar a API/worker para os stubs:
+#   N8N_WEBHOOK_URL=http://localhost:5678/webhook/bench EVOLUTION_API_URL=http://localhost:8081
+#
+# Uso isolado:
+#   python -m bench.stubs --n8n-latency-ms 800 --n8n-jitter-ms 400 --evolution-error-rate 0.01
+
+import argparse
+import json
+import logging
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+from bench.generator import find_markers
+
+logger = logging.getLogger("BenchStubs")
+
+
+class StubBehavior:
+    """Latência e taxa de erro de um stub."""
+
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0, error_rate: float = 0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self._random = random.Random()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            delay = self.latency_ms + self._random.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+    def should_fail(self) -> bool:
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    # Keep-alive: os clientes httpx da aplicação reaproveitam a conexão
+    protocol_version = "HTTP/1.1"
+
+    def _read_json(self) -> Optional[Dict]:
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            return json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return None
+
+    def _reply(self, status: int, body: Dict):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class N8nStubHandler(_StubHandler):
+    behavior: StubBehavior = StubBehavior()
+
+    def do_POST(self):
+        payload = self._read_json() or {}
+        self.behavior.wait()
+        if self.behavior.should_fail():
+            self._reply(500, {"message": "bench: erro simulado"})
+            return
+
+        markers = find_markers(payload.get("pergunta-do-usuario-atual"))
+        if payload.get("message_id") and payload["message_id"] not in markers:
+            markers.append(payload["message_id"])
+        is_audio = payload.get("tipo_mensagem") == "audioMessage"
+        self._reply(200, {
+            "respostaIA": "Resposta de benchmark " + " ".join(f"#bench:{m}" for m in markers),
+            "perguntaUsuario": "Transcrição de benchmark" if is_audio else None,
+        })
+
+
+class EvolutionStubHandler(_StubHandler):
+    behavior: StubBehavior = StubBehavior()
+    received: Dict[str, float] = {}
+    sends = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        if not self.path.startswith("/message/sendText/"):
+            self._reply(404, {"message": "not found"})
+            return
+        payload = self._read_json() or {}
+        self.behavior.wait()
+        if self.behavior.should_fail():
+            self._reply(500, {"message": "bench: erro simulado"})
+            return
+
+        now = time.time()
+        cls = type(self)
+        with cls.lock:
+            cls.sends += 1
+            for marker in find_markers(payload.get("text")):
+                cls.received.setdefault(marker, now)
+        self._reply(201, {"key": {"id": f"bench-{now}"}, "status": "PENDING"})
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/_bench/received":
+            self._reply(404, {"message": "not found"})
+            return
+        cls = type(self)
+        with cls.lock:
+            body = {"sends": cls.sends, "received": dict(cls.received)}
+        self._reply(200, body)
+
+    def do_DELETE(self):
+        # Zera os registros entre execuções do runner
+        cls = type(self)
+        with cls.lock:
+            cls.received.clear()
+            cls.sends = 0
+        self._reply(200, {"status": "reset"})
+
+
+def _serve(handler, host: str, port: int) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name=f"stub-{port}", daemon=True).start()
+    return server
+
+
+def start_stubs(n8n_port: int, evolution_port: int, n8n: StubBehavior, evolution: StubBehavior,
+                host: str = "127.0.0.1"):
+    """Sobe os dois stubs em threads daemon; retorna os servidores."""
+    n8n_handler = type("N8nStub", (N8nStubHandler,), {"behavior": n8n})
+    evolution_handler = type("EvolutionStub", (EvolutionStubHandler,), {
+        "behavior": evolution, "received": {}, "sends": 0, "lock": threading.Lock()
+    })
+    servers = (_serve(n8n_handler, host, n8n_port), _serve(evolution_handler, host, evolution_port))
+    logger.info(f"Stubs: n8n em http://{host}:{n8n_port}/webhook/bench, Evolution em http://{host}:{evolution_port}")
+    return servers
+
+
+def add_stub_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--n8n-port", type=int, default=5678)
+    parser.add_argument("--evolution-port", type=int, default=8081)
+    parser.add_argument("--n8n-latency-ms", type=float, default=500.0)
+    parser.add_argument("--n8n-jitter-ms", type=float, default=200.0)
+    parser.add_argument("--n8n-error-rate", type=float, default=0.0)
+    parser.add_argument("--evolution-latency-ms", type=float, default=100.0)
+    parser.add_argument("--evolution-jitter-ms", type=float, default=50.0)
+    parser.add_argument("--evolution-error-rate", type=float, default=0.0)
+
+
+def start_stubs_from_args(args, host: str = "127.0.0.1"):
+    return start_stubs(
+        args.n8n_port, args.evolution_port,
+        StubBehavior(args.n8n_latency_ms, args.n8n_jitter_ms, args.n8n_error_rate),
+        StubBehavior(args.evolution_latency_ms, args.evolution_jitter_ms, args.evolution_error_rate),
+        host=host,
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Stubs locais do n8n e da Evolution")
+    parser.add_argument("--host", default="0.0.0.0")
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+    start_stubs_from_args(args, host=args.host)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
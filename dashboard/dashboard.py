@@ -10,6 +10,7 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 from sqlalchemy import create_engine, text
 from app.core.config import settings
+from app.core.timezone import now_br, format_br
 
 # Configuração da Página
 st.set_page_config(page_title="Jeronimo Dashboard", layout="wide")
@@ -36,7 +37,14 @@ PASSOS_TRADUCAO = {
     'RESPONSE': 'Resposta Enviada',
     'TIMEOUT': 'Tempo Esgotado',
     'AI_ERROR': 'Erro na IA',
-    'ERROR': 'Erro Geral'
+    'ERROR': 'Erro Geral',
+    'COALESCE': 'Agrupamento de Mensagens',
+    'COALESCED': 'Mensagem Agrupada',
+    'RETRY': 'Nova Tentativa Agendada',
+    'REAPED': 'Devolvido à Fila (Travado)',
+    'DEFERRED': 'Adiado (n8n Indisponível)',
+    'SEND_FAILED': 'Falha no Envio ao Usuário',
+    'TIMINGS': 'Tempos por Etapa'
 }
 
 # Conexão DB
@@ -156,44 +164,119 @@ if date_start and date_end:
     date_filter = " AND created_at BETWEEN :start AND :end"
     params = {"start": date_start, "end": end_datetime}
 
-with engine.connect() as conn:
-    pending_count = conn.execute(text(f"SELECT count(*) FROM request_queue WHERE status = 'pending'{date_filter}"), params).scalar()
-    processing_count = conn.execute(text(f"SELECT count(*) FROM request_queue WHERE status = 'processing'{date_filter}"), params).scalar()
-    failed_count = conn.execute(text(f"SELECT count(*) FROM request_queue WHERE status = 'failed'{date_filter}"), params).scalar()
-    
-    # Alterado: Contabilizando todos os concluídos (respeitando filtro global se houver)
-    completed_total = conn.execute(text(f"SELECT count(*) FROM request_queue WHERE status = 'completed'{date_filter}"), params).scalar()
-    
-    # Alterado: Novas métricas de Clientes e Leads
-    clients_count = conn.execute(text(f"SELECT count(*) FROM users WHERE is_client = true{date_filter}"), params).scalar()
-    leads_count = conn.execute(text(f"SELECT count(*) FROM users WHERE is_client = false{date_filter}"), params).scalar()
-
-col1.metric("Fila Pendente", pending_count)
-col2.metric("Processando", processing_count)
-col3.metric("Falhas (Total)", failed_count)
-col4.metric("Concluídos", completed_total)
+# Alterado: Filtro equivalente para as tabelas de rollup (buckets de 1 hora)
+bucket_filter = date_filter.replace("created_at", "bucket")
+
+# Alterado: Marca d'água dos rollups por hora (app/workers/rollup_job.py): buckets anteriores
+# vêm dos rollups, linhas a partir dela vêm das tabelas brutas. Sem marca (job nunca
+# rodou), '-infinity' faz tudo ser lido das tabelas brutas, como antes.
+ROLLUP_HW_CTE = """
+    hw AS (
+        SELECT COALESCE(
+            (SELECT high_water FROM rollup_state WHERE name = 'hourly'),
+            '-infinity'::timestamp
+        ) AS ts
+    )
+"""
+
+# Alterado: Os 6 count(*) separados + o GROUP BY do gráfico viraram UMA consulta:
+# contagens por status (cards e gráfico) e users uma única vez (count(*) FILTER). O
+# resultado é compartilhado entre todas as sessões abertas por
+# DASHBOARD_CACHE_TTL_SECONDS, com chave no filtro de datas.
+# Alterado: Status finais (concluído/falha) antes da marca d'água vêm do rollup por hora;
+# a tabela bruta só é lida para a hora corrente e para itens pendentes/em processamento
+# (índice de status), para que os cards da fila continuem em tempo real. Itens que mudam
+# de status após a marca podem ficar defasados até a próxima execução do job.
+@st.cache_data(ttl=settings.DASHBOARD_CACHE_TTL_SECONDS, show_spinner=False)
+def load_kpis(date_filter: str, bucket_filter: str, params: dict):
+    query = f"""
+        WITH {ROLLUP_HW_CTE},
+        status_counts AS (
+            SELECT
+                status,
+                SUM(total) AS total,
+                SUM(duration_sum) AS duration_sum,
+                SUM(duration_count) AS duration_count
+            FROM (
+                SELECT r.status, r.request_count AS total,
+                       r.duration_seconds_sum AS duration_sum, r.duration_count
+                FROM rollup_queue_status_hourly r, hw
+                WHERE r.bucket < hw.ts
+                  AND r.status NOT IN ('pending', 'processing') {bucket_filter}
+                UNION ALL
+                SELECT
+                    q.status,
+                    count(*),
+                    COALESCE(SUM(EXTRACT(EPOCH FROM (q.updated_at - q.created_at)))
+                             FILTER (WHERE q.updated_at IS NOT NULL AND q.status IN ('completed', 'failed')), 0),
+                    count(*) FILTER (WHERE q.updated_at IS NOT NULL AND q.status IN ('completed', 'failed'))
+                FROM request_queue q, hw
+                WHERE (q.created_at >= hw.ts OR q.status IN ('pending', 'processing')) {date_filter}
+                GROUP BY q.status
+            ) s
+            GROUP BY status
+        ),
+        user_counts AS (
+            SELECT
+                count(*) FILTER (WHERE is_client = true) AS clients,
+                count(*) FILTER (WHERE is_client = false) AS leads
+            FROM users
+            WHERE 1=1 {date_filter}
+        )
+        SELECT
+            (SELECT json_object_agg(status, total) FROM status_counts) AS by_status,
+            (SELECT SUM(duration_sum) / NULLIF(SUM(duration_count), 0) FROM status_counts) AS avg_duration,
+            (SELECT COALESCE(SUM(duplicate_count), 0) FROM ingest_dedup WHERE 1=1 {date_filter}) AS duplicates,
+            clients,
+            leads
+        FROM user_counts
+    """
+    with engine.connect() as conn:
+        row = conn.execute(text(query), params).one()
+
+    return {
+        "by_status": row.by_status or {},
+        "avg_duration": row.avg_duration,
+        "duplicates": row.duplicates,
+        "clients": row.clients,
+        "leads": row.leads,
+        "as_of": now_br()
+    }
+
+kpis = load_kpis(date_filter, bucket_filter, params)
+by_status = kpis["by_status"]
+
+col1.metric("Fila Pendente", by_status.get("pending", 0))
+col2.metric("Processando", by_status.get("processing", 0))
+col3.metric("Falhas (Total)", by_status.get("failed", 0))
+# Alterado: Contabilizando todos os concluídos (respeitando filtro global se houver)
+col4.metric("Concluídos", by_status.get("completed", 0))
 # Alterado: Exibindo novas métricas
-col5.metric("Total de Clientes", clients_count)
-col6.metric("Total de Leads", leads_count)
+col5.metric("Total de Clientes", kpis["clients"])
+col6.metric("Total de Leads", kpis["leads"])
+
+st.caption(f"Dados de {format_br(kpis['as_of'])} (atualizados a cada {settings.DASHBOARD_CACHE_TTL_SECONDS:.0f}s)")
+# Alterado: Reentregas de webhook descartadas pela deduplicação (cada uma seria uma chamada ao n8n)
+if kpis["duplicates"]:
+    st.caption(f"Webhooks duplicados descartados no período: {kpis['duplicates']}")
 
 st.divider()
 
 # Gráficos
 col_chart1, col_chart2 = st.columns(2)
 
-# Ajuste do filtro para queries que não começam com WHERE preexistente ou precisam de WHERE
-# Para charts, o GROUP BY vem depois.
-# Query 1: SELECT ... FROM request_queue [WHERE ...] GROUP BY status
-where_clause_chart = f"WHERE 1=1 {date_filter}" # 1=1 facilita append
-
 with col_chart1:
     st.subheader("Status da Fila")
-    df_status = pd.read_sql(text(f"SELECT status, count(*) as count FROM request_queue {where_clause_chart} GROUP BY status"), engine, params=params)
+    # Alterado: Reaproveita as contagens por status da consulta agregada (cache)
+    df_status = pd.DataFrame(list(by_status.items()), columns=['status', 'count'])
     if not df_status.empty:
         # Alterado: Traduzindo status para português
         df_status['status_pt'] = df_status['status'].map(STATUS_TRADUCAO).fillna(df_status['status'])
         fig1 = px.pie(df_status, values='count', names='status_pt', title='Distribuição de Status')
         st.plotly_chart(fig1, use_container_width=True)
+        # Alterado: Tempo médio de processamento (somas do rollup + hora corrente)
+        if kpis["avg_duration"] is not None:
+            st.caption(f"Tempo médio de processamento: {float(kpis['avg_duration']):.1f}s")
     else:
         st.info("Sem dados de fila ainda.")
 
@@ -207,7 +290,24 @@ with col_chart2:
     if date_start and date_end:
         date_filter_logs = " AND timestamp BETWEEN :start AND :end"
         
-    df_steps = pd.read_sql(text(f"SELECT step, count(*) as count FROM processing_logs WHERE 1=1 {date_filter_logs} GROUP BY step ORDER BY count DESC LIMIT 10"), engine, params=params)
+    # Alterado: Buckets completos vêm do rollup por hora; processing_logs só após a marca d'água
+    df_steps = pd.read_sql(text(f"""
+        WITH {ROLLUP_HW_CTE}
+        SELECT step, SUM(total) AS count
+        FROM (
+            SELECT r.step, r.step_count AS total
+            FROM rollup_step_hourly r, hw
+            WHERE r.bucket < hw.ts {bucket_filter}
+            UNION ALL
+            SELECT l.step, count(*)
+            FROM processing_logs l, hw
+            WHERE l.timestamp >= hw.ts AND l.step IS NOT NULL {date_filter_logs}
+            GROUP BY l.step
+        ) s
+        GROUP BY step
+        ORDER BY count DESC
+        LIMIT 10
+    """), engine, params=params)
     
     if not df_steps.empty:
         # Alterado: Traduzindo passos para português
@@ -223,29 +323,35 @@ st.divider()
 st.subheader("🏆 Top 10 Usuários com Mais Requisições")
 
 # CTE precisa do filtro na tabela base request_queue
+# Alterado: Usa a coluna indexada request_queue.phone (preenchida na ingestão) em vez de
+# extrair o remoteJid do JSON do payload em todas as linhas a cada renderização
+# Alterado: Contagens por telefone vêm do rollup por hora (buckets completos) + hora corrente
 query_top_users = f"""
-    WITH extracted_phones AS (
-        SELECT 
-            CASE 
-                WHEN payload::jsonb #>> '{{body,data,key,remoteJid}}' IS NOT NULL 
-                THEN split_part(payload::jsonb #>> '{{body,data,key,remoteJid}}', '@', 1)
-                ELSE split_part(payload::jsonb #>> '{{data,key,remoteJid}}', '@', 1)
-            END as phone
-        FROM request_queue
-        WHERE 1=1 {date_filter}
+    WITH {ROLLUP_HW_CTE},
+    per_phone AS (
+        SELECT phone, SUM(request_count) AS request_count
+        FROM (
+            SELECT r.phone, r.request_count
+            FROM rollup_user_requests_hourly r, hw
+            WHERE r.bucket < hw.ts {bucket_filter}
+            UNION ALL
+            SELECT q.phone, COUNT(*)
+            FROM request_queue q, hw
+            WHERE q.created_at >= hw.ts AND q.phone IS NOT NULL AND q.phone != '' {date_filter}
+            GROUP BY q.phone
+        ) s
+        GROUP BY phone
     )
     SELECT 
-        COALESCE(u.name, ep.phone) as user_identifier,
-        COUNT(*) as request_count
-    FROM extracted_phones ep
-    LEFT JOIN users u ON ep.phone = u.phone
-    WHERE ep.phone IS NOT NULL AND ep.phone != ''
+        COALESCE(u.name, pp.phone) as user_identifier,
+        SUM(pp.request_count) as request_count
+    FROM per_phone pp
+    LEFT JOIN users u ON pp.phone = u.phone
     GROUP BY user_identifier
     ORDER BY request_count DESC
     LIMIT 10
 """
 
-# Nota: f-string com chaves duplas {{ }} para escapar o JSON
 df_top_users = pd.read_sql(text(query_top_users), engine, params=params)
 
 if not df_top_users.empty:
@@ -270,79 +376,61 @@ st.subheader("📋 Últimas Requisições (Detalhado)")
 
 # Alterado: Ordenação por ID DESC (maior para menor)
 # Adicionando filtro
-df_requests = pd.read_sql(text(f"SELECT id, payload, status, created_at, updated_at, attempts FROM request_queue WHERE 1=1 {date_filter} ORDER BY id DESC LIMIT 50"), engine, params=params)
+# Alterado: Uma única consulta no servidor junta request_queue, users e chat_logs
+# (antes: listas IN montadas por f-string + merges no pandas). O LATERAL pega o
+# chat_log mais recente de cada evolution_id, sem duplicar linhas da fila.
+# Alterado: Itens ainda sem chat_log (pendentes, tipo não suportado) ou de usuários sem
+# nome usam o envelope gravado na ingestão (request_queue.envelope), sem ler o payload.
+date_filter_q = " AND q.created_at BETWEEN :start AND :end" if date_filter else ""
+df_final = pd.read_sql(text(f"""
+    SELECT
+        q.id, q.phone AS user_phone, q.status, q.created_at, q.updated_at, q.attempts,
+        COALESCE(u.name, q.envelope ->> 'push_name') AS name,
+        u.is_client, u.is_blocked, u.is_compliant,
+        COALESCE(c.message_text, q.envelope ->> 'text') AS message_text,
+        c.response_text,
+        COALESCE(c.message_type, q.message_type) AS message_type
+    FROM (
+        SELECT id, phone, evolution_id, message_type, envelope, status, created_at, updated_at, attempts
+        FROM request_queue q
+        WHERE 1=1 {date_filter_q}
+        ORDER BY id DESC
+        LIMIT :limit
+    ) q
+    LEFT JOIN users u ON u.phone = q.phone
+    LEFT JOIN LATERAL (
+        SELECT message_text, response_text, message_type
+        FROM chat_logs
+        WHERE chat_logs.evolution_id = q.evolution_id
+        ORDER BY chat_logs.id DESC
+        LIMIT 1
+    ) c ON TRUE
+    ORDER BY q.id DESC
+"""), engine, params={**params, "limit": settings.DASHBOARD_REQUESTS_LIMIT})
+
+if not df_final.empty:
+    # Alterado: Formatação vetorizada (sem DataFrame.apply linha a linha)
+    # Colunas só com NULL chegam como object; converte antes de usar .dt
+    df_final['created_at'] = pd.to_datetime(df_final['created_at'])
+    df_final['updated_at'] = pd.to_datetime(df_final['updated_at'])
+    # Tempo no formato HH:MM:SS (sem "0 days" e sem microssegundos)
+    whole_seconds = (df_final['updated_at'] - df_final['created_at']).dt.total_seconds().fillna(0).astype('int64')
+    hours = whole_seconds // 3600
+    days = hours // 24
+    df_final['duration'] = (
+        (hours % 24).astype(str).str.zfill(2) + ":" +
+        ((whole_seconds % 3600) // 60).astype(str).str.zfill(2) + ":" +
+        (whole_seconds % 60).astype(str).str.zfill(2)
+    )
+    # Mais de um dia: mantém o prefixo de dias, como o str(timedelta) fazia
+    multi_day = days > 0
+    df_final.loc[multi_day, 'duration'] = days[multi_day].astype(str) + " days " + df_final.loc[multi_day, 'duration']
+    df_final.loc[df_final['updated_at'].isna(), 'duration'] = "Em andamento"
 
-if not df_requests.empty:
-    def extract_metadata(row):
-        payload = row['payload']
-        if not payload: return pd.Series([None, None])
-        
-        try:
-            body = payload.get("body", {})
-            data = body.get("data") if body else payload.get("data")
-            if not data: return pd.Series([None, None])
-            
-            key = data.get("key", {})
-            evo_id = key.get("id")
-            remote_jid = key.get("remoteJid", "")
-            phone = remote_jid.split("@")[0] if remote_jid else None
-            
-            return pd.Series([evo_id, phone])
-        except:
-            return pd.Series([None, None])
-
-    df_requests[['evolution_id', 'user_phone']] = df_requests.apply(extract_metadata, axis=1)
-
-    unique_phones = df_requests['user_phone'].dropna().unique().tolist()
-    unique_evo_ids = df_requests['evolution_id'].dropna().unique().tolist()
-
-    df_users = pd.DataFrame()
-    df_logs = pd.DataFrame()
-
-    if unique_phones:
-        # Usando bind params para a lista IN é complexo com SQLalchemy text simples, manter f-string para lista
-        # Mas as datas já estao em params
-        placeholders_phones = ','.join([f"'{p}'" for p in unique_phones])
-        # Aqui nao precisa de filtro de data, pois estamos buscando dados cadastrais dos usuarios encontrados
-        df_users = pd.read_sql(f"SELECT phone as user_phone, name, is_client, is_blocked, is_compliant FROM users WHERE phone IN ({placeholders_phones})", engine)
-
-    if unique_evo_ids:
-        placeholders_ids = ','.join([f"'{eid}'" for eid in unique_evo_ids])
-        df_logs = pd.read_sql(f"SELECT evolution_id, message_text, response_text, message_type FROM chat_logs WHERE evolution_id IN ({placeholders_ids})", engine)
-
-    df_final = pd.merge(df_requests, df_users, on='user_phone', how='left')
-    df_final = pd.merge(df_final, df_logs, on='evolution_id', how='left')
-
-    # Alterado: Formatação do tempo removendo "0 days" e mostrando só HH:MM:SS
-    def calc_duration(row):
-        if pd.isna(row['updated_at']):
-            return "Em andamento"
-        delta = row['updated_at'] - row['created_at']
-        # Remove microsegundos primeiro
-        duration_str = str(delta).split('.')[0]
-        # Alterado: Remove "0 days " usando replace (formato: "0 days 00:00:46")
-        duration_str = duration_str.replace("0 days ", "")
-        return duration_str
-
-    df_final['duration'] = df_final.apply(calc_duration, axis=1)
-
-    def format_created_at(row):
-        if pd.isna(row['created_at']):
-            return ""
-        dt = row['created_at']
-        return dt.strftime("%d/%m/%Y %H:%M:%S")
-    
-    df_final['data_formatada'] = df_final.apply(format_created_at, axis=1)
-
-    def format_message_type(row):
-        msg_type = row.get('message_type', None)
-        if pd.isna(msg_type) or not msg_type:
-            return "Texto"
-        if 'audio' in str(msg_type).lower():
-            return "Áudio"
-        return "Texto"
-    
-    df_final['tipo_mensagem'] = df_final.apply(format_message_type, axis=1)
+    df_final['data_formatada'] = df_final['created_at'].dt.strftime("%d/%m/%Y %H:%M:%S").fillna("")
+
+    is_audio = df_final['message_type'].fillna("").astype(str).str.lower().str.contains('audio', regex=False)
+    df_final['tipo_mensagem'] = is_audio.map({True: "Áudio", False: "Texto"})
 
     # Alterado: Traduzindo status para português
     df_final['status_pt'] = df_final['status'].map(STATUS_TRADUCAO).fillna(df_final['status'])
@@ -383,5 +471,7 @@ df_failures.columns = ['ID', 'Data', 'Tentativas', 'Detalhes do Erro']
 st.dataframe(df_failures, use_container_width=True)
 
 if st.button("Atualizar Dados"):
+    # Alterado: Descarta o cache das métricas para forçar nova leitura
+    load_kpis.clear()
     st.rerun()
 
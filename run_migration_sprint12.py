@@ -0,0 +1,30 @@
+from app.core.database import SessionLocal
+from app.workers.reconcile_counters import reconcile_ai_response_counts
+from sqlalchemy import text
+import logging
+
+# Configuração de Logs
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("MigrationSprint12")
+
+def run_migration():
+    logger.info("Iniciando migração (Sprint 12 - Contador de respostas da IA)...")
+    db = SessionLocal()
+    try:
+        logger.info("Adicionando coluna ai_response_count em users...")
+        db.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS ai_response_count INTEGER NOT NULL DEFAULT 0;"))
+        db.commit()
+
+        logger.info("Preenchendo contador a partir de chat_logs (backfill)...")
+        total = reconcile_ai_response_counts(db)
+        logger.info(f"{total} usuário(s) atualizado(s)")
+
+        logger.info("Migração concluída com sucesso!")
+    except Exception as e:
+        logger.error(f"Erro na migração: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    run_migration()
@@ -0,0 +1,74 @@
+from app.core.database import SessionLocal
+from sqlalchemy import text
+import logging
+
+# Configuração de Logs
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("MigrationSprint13")
+
+# Tamanho de cada lote do backfill (faixas de id, para não travar a tabela inteira)
+BACKFILL_BATCH_SIZE = 5000
+
+BACKFILL_SQL = text("""
+    UPDATE request_queue
+    SET phone = NULLIF(split_part(
+            COALESCE(payload::jsonb #>> '{body,data,key,remoteJid}',
+                     payload::jsonb #>> '{data,key,remoteJid}'),
+            '@', 1), ''),
+        evolution_id = COALESCE(payload::jsonb #>> '{body,data,key,id}',
+                                payload::jsonb #>> '{data,key,id}'),
+        message_type = CASE
+            WHEN COALESCE(payload::jsonb #> '{body,data,message}', payload::jsonb #> '{data,message}') ? 'conversation'
+                THEN 'conversation'
+            WHEN COALESCE(payload::jsonb #> '{body,data,message}', payload::jsonb #> '{data,message}') ? 'extendedTextMessage'
+                THEN 'extendedTextMessage'
+            WHEN COALESCE(payload::jsonb #> '{body,data,message}', payload::jsonb #> '{data,message}') ? 'audioMessage'
+                THEN 'audioMessage'
+            ELSE COALESCE(payload::jsonb #>> '{body,data,messageType}', payload::jsonb #>> '{data,messageType}')
+        END
+    WHERE id >= :start_id AND id < :end_id
+      AND phone IS NULL
+""")
+
+def run_migration():
+    logger.info("Iniciando migração (Sprint 13 - Metadados indexados em request_queue)...")
+    db = SessionLocal()
+    try:
+        logger.info("Adicionando colunas phone, evolution_id e message_type em request_queue...")
+        db.execute(text("ALTER TABLE request_queue ADD COLUMN IF NOT EXISTS phone VARCHAR;"))
+        db.execute(text("ALTER TABLE request_queue ADD COLUMN IF NOT EXISTS evolution_id VARCHAR;"))
+        db.execute(text("ALTER TABLE request_queue ADD COLUMN IF NOT EXISTS message_type VARCHAR;"))
+        db.commit()
+
+        logger.info("Preenchendo colunas a partir do payload (backfill em lotes)...")
+        bounds = db.execute(text("SELECT MIN(id), MAX(id) FROM request_queue")).first()
+        total = 0
+        if bounds and bounds[0] is not None:
+            start_id, max_id = bounds
+            while start_id <= max_id:
+                end_id = start_id + BACKFILL_BATCH_SIZE
+                result = db.execute(BACKFILL_SQL, {"start_id": start_id, "end_id": end_id})
+                db.commit()
+                total += result.rowcount
+                start_id = end_id
+        logger.info(f"{total} item(ns) da fila atualizado(s)")
+
+        logger.info("Criando índices...")
+        db.execute(text("CREATE INDEX IF NOT EXISTS ix_request_queue_phone ON request_queue (phone);"))
+        db.execute(text("CREATE INDEX IF NOT EXISTS ix_request_queue_evolution_id ON request_queue (evolution_id);"))
+        # Índice parcial usado pelo agrupamento de mensagens (CLAIM_SIBLINGS_SQL)
+        db.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_request_queue_pending_phone "
+            "ON request_queue (phone, id) WHERE status = 'pending';"
+        ))
+        db.commit()
+
+        logger.info("Migração concluída com sucesso!")
+    except Exception as e:
+        logger.error(f"Erro na migração: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    run_migration()
@@ -0,0 +1,25 @@
+from app.core.database import SessionLocal
+from sqlalchemy import text
+import logging
+
+# Configuração de Logs
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("MigrationSprint14")
+
+def run_migration():
+    logger.info("Iniciando migração (Sprint 14 - Índice de chat_logs.evolution_id)...")
+    db = SessionLocal()
+    try:
+        logger.info("Criando índice em chat_logs.evolution_id...")
+        db.execute(text("CREATE INDEX IF NOT EXISTS ix_chat_logs_evolution_id ON chat_logs (evolution_id);"))
+        db.commit()
+
+        logger.info("Migração concluída com sucesso!")
+    except Exception as e:
+        logger.error(f"Erro na migração: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    run_migration()
@@ -0,0 +1,63 @@
+from app.core.database import SessionLocal
+from app.workers.rollup_job import refresh_rollups
+from sqlalchemy import text
+import logging
+
+# Configuração de Logs
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("MigrationSprint15")
+
+def run_migration():
+    logger.info("Iniciando migração (Sprint 15 - Rollups por hora do dashboard)...")
+
+    commands = [
+        """CREATE TABLE IF NOT EXISTS rollup_queue_status_hourly (
+            bucket TIMESTAMP NOT NULL,
+            status VARCHAR NOT NULL,
+            request_count INTEGER NOT NULL DEFAULT 0,
+            duration_seconds_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+            duration_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (bucket, status)
+        );""",
+        """CREATE TABLE IF NOT EXISTS rollup_step_hourly (
+            bucket TIMESTAMP NOT NULL,
+            step VARCHAR NOT NULL,
+            step_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (bucket, step)
+        );""",
+        """CREATE TABLE IF NOT EXISTS rollup_user_requests_hourly (
+            bucket TIMESTAMP NOT NULL,
+            phone VARCHAR NOT NULL,
+            request_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (bucket, phone)
+        );""",
+        """CREATE TABLE IF NOT EXISTS rollup_state (
+            name VARCHAR PRIMARY KEY,
+            high_water TIMESTAMP NOT NULL,
+            updated_at TIMESTAMP
+        );""",
+        # Consultas da hora corrente (após a marca d'água) e recálculo por intervalo
+        "CREATE INDEX IF NOT EXISTS ix_request_queue_created_at ON request_queue (created_at);",
+        "CREATE INDEX IF NOT EXISTS ix_processing_logs_timestamp ON processing_logs (timestamp);",
+    ]
+
+    db = SessionLocal()
+    try:
+        for cmd in commands:
+            logger.info(f"Executando: {cmd.splitlines()[0]}")
+            db.execute(text(cmd))
+        db.commit()
+
+        logger.info("Calculando rollups do histórico (primeira carga)...")
+        bounds = refresh_rollups(db)
+        logger.info(f"Rollups calculados até {bounds['until']}")
+
+        logger.info("Migração concluída com sucesso!")
+    except Exception as e:
+        logger.error(f"Erro na migração: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    run_migration()
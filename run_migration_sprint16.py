@@ -0,0 +1,86 @@
+from app.core.database import SessionLocal
+from app.workers.partition_job import PARTITIONED_TABLES, create_partitions
+from sqlalchemy import text
+import logging
+
+# Configuração de Logs
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("MigrationSprint16")
+
+# Índices recriados na tabela particionada (propagados para todas as partições)
+TABLE_INDEXES = {
+    "request_queue": [
+        "CREATE INDEX ix_request_queue_id ON request_queue (id);",
+        "CREATE INDEX ix_request_queue_status ON request_queue (status);",
+        "CREATE INDEX ix_request_queue_created_at ON request_queue (created_at);",
+        "CREATE INDEX ix_request_queue_phone ON request_queue (phone);",
+        "CREATE INDEX ix_request_queue_evolution_id ON request_queue (evolution_id);",
+        "CREATE INDEX ix_request_queue_pending_phone ON request_queue (phone, id) WHERE status = 'pending';",
+    ],
+    "processing_logs": [
+        "CREATE INDEX ix_processing_logs_id ON processing_logs (id);",
+        "CREATE INDEX ix_processing_logs_queue_id ON processing_logs (queue_id);",
+        "CREATE INDEX ix_processing_logs_timestamp ON processing_logs (timestamp);",
+    ],
+}
+
+def partition_table(db, table: str, key: str):
+    legacy = f"{table}_legacy"
+
+    # Já particionada? (relkind 'p')
+    kind = db.execute(text("SELECT relkind FROM pg_class WHERE relname = :t"), {"t": table}).scalar()
+    if kind == "p":
+        logger.info(f"{table} já é particionada, nada a fazer")
+        return
+
+    logger.info(f"Renomeando {table} (e seus índices) para {legacy}...")
+    db.execute(text(f"ALTER TABLE {table} RENAME TO {legacy};"))
+    index_names = db.execute(
+        text("SELECT indexname FROM pg_indexes WHERE tablename = :t"), {"t": legacy}
+    ).scalars().all()
+    for index_name in index_names:
+        db.execute(text(f"ALTER INDEX {index_name} RENAME TO {index_name}_legacy;"))
+
+    logger.info(f"Criando {table} particionada por mês em {key}...")
+    db.execute(text(f"UPDATE {legacy} SET {key} = now() WHERE {key} IS NULL;"))
+    db.execute(text(
+        f"CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS) PARTITION BY RANGE ({key});"
+    ))
+    db.execute(text(f"ALTER TABLE {table} ALTER COLUMN {key} SET NOT NULL;"))
+    db.execute(text(f"ALTER TABLE {table} ADD PRIMARY KEY (id, {key});"))
+
+    first = db.execute(text(f"SELECT MIN({key}) FROM {legacy}")).scalar()
+    create_partitions(db, table, start=first)
+
+    logger.info(f"Copiando linhas de {legacy}...")
+    copied = db.execute(text(f"INSERT INTO {table} SELECT * FROM {legacy};")).rowcount
+    logger.info(f"{copied} linha(s) copiada(s)")
+
+    for cmd in TABLE_INDEXES[table]:
+        db.execute(text(cmd))
+
+    # A sequence do id passa a pertencer à nova tabela antes de remover a antiga
+    db.execute(text(f"ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id;"))
+    db.execute(text(f"DROP TABLE {legacy};"))
+
+def run_migration():
+    logger.info("Iniciando migração (Sprint 16 - Particionamento mensal de request_queue/processing_logs)...")
+    db = SessionLocal()
+    try:
+        # FK de processing_logs para request_queue não é suportada com particionamento
+        logger.info("Removendo FK processing_logs.queue_id -> request_queue.id...")
+        db.execute(text("ALTER TABLE processing_logs DROP CONSTRAINT IF EXISTS processing_logs_queue_id_fkey;"))
+
+        for table, key in PARTITIONED_TABLES.items():
+            partition_table(db, table, key)
+
+        db.commit()
+        logger.info("Migração concluída com sucesso!")
+    except Exception as e:
+        logger.error(f"Erro na migração: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    run_migration()
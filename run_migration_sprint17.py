@@ -0,0 +1,34 @@
+from app.core.database import SessionLocal
+from sqlalchemy import text
+import logging
+
+# Configuração de Logs
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("MigrationSprint17")
+
+def run_migration():
+    logger.info("Iniciando migração (Sprint 17 - Retentativas agendadas e visibility timeout)...")
+
+    commands = [
+        "ALTER TABLE request_queue ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMP;",
+        "ALTER TABLE request_queue ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMP;",
+        # Itens que hoje estão em processamento: o reaper usa updated_at como referência
+        # até serem reivindicados de novo
+        "CREATE INDEX IF NOT EXISTS ix_request_queue_processing ON request_queue (claimed_at) WHERE status = 'processing';",
+    ]
+
+    db = SessionLocal()
+    try:
+        for cmd in commands:
+            logger.info(f"Executando: {cmd}")
+            db.execute(text(cmd))
+        db.commit()
+        logger.info("Migração concluída com sucesso!")
+    except Exception as e:
+        logger.error(f"Erro na migração: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    run_migration()
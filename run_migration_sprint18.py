@@ -0,0 +1,44 @@
+from app.core.database import SessionLocal
+from sqlalchemy import text
+import logging
+
+# Configuração de Logs
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("MigrationSprint18")
+
+def run_migration():
+    logger.info("Iniciando migração (Sprint 18 - Deduplicação de webhooks)...")
+
+    commands = [
+        """CREATE TABLE IF NOT EXISTS ingest_dedup (
+            evolution_id VARCHAR PRIMARY KEY,
+            created_at TIMESTAMP,
+            duplicate_count INTEGER NOT NULL DEFAULT 0
+        );""",
+        "CREATE INDEX IF NOT EXISTS ix_ingest_dedup_created_at ON ingest_dedup (created_at);",
+        # Registra as mensagens recentes já enfileiradas, para que reentregas delas também
+        # sejam descartadas logo após o deploy
+        """INSERT INTO ingest_dedup (evolution_id, created_at, duplicate_count)
+           SELECT evolution_id, MIN(created_at), COUNT(*) - 1
+           FROM request_queue
+           WHERE evolution_id IS NOT NULL
+             AND created_at >= now() - interval '7 days'
+           GROUP BY evolution_id
+           ON CONFLICT (evolution_id) DO NOTHING;""",
+    ]
+
+    db = SessionLocal()
+    try:
+        for cmd in commands:
+            logger.info(f"Executando: {cmd.splitlines()[0]}")
+            db.execute(text(cmd))
+        db.commit()
+        logger.info("Migração concluída com sucesso!")
+    except Exception as e:
+        logger.error(f"Erro na migração: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    run_migration()
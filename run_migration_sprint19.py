@@ -0,0 +1,39 @@
+from app.core.database import SessionLocal
+from sqlalchemy import text
+import logging
+
+# Configuração de Logs
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("MigrationSprint19")
+
+def run_migration():
+    logger.info("Iniciando migração (Sprint 19 - Estado do circuit breaker do n8n)...")
+
+    commands = [
+        """CREATE TABLE IF NOT EXISTS upstream_health (
+            instance VARCHAR NOT NULL,
+            upstream VARCHAR NOT NULL,
+            state VARCHAR NOT NULL,
+            concurrency_limit INTEGER NOT NULL,
+            in_flight INTEGER NOT NULL,
+            details JSON,
+            updated_at TIMESTAMP,
+            PRIMARY KEY (instance, upstream)
+        );""",
+    ]
+
+    db = SessionLocal()
+    try:
+        for cmd in commands:
+            logger.info(f"Executando: {cmd.splitlines()[0]}")
+            db.execute(text(cmd))
+        db.commit()
+        logger.info("Migração concluída com sucesso!")
+    except Exception as e:
+        logger.error(f"Erro na migração: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    run_migration()
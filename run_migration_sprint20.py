@@ -0,0 +1,74 @@
+from app.core.database import SessionLocal
+from app.services.message_envelope import MessageEnvelope
+from sqlalchemy import text
+import json
+import logging
+import sys
+
+# Configuração de Logs
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("MigrationSprint20")
+
+# Tamanho de cada lote do backfill (faixas de id, para não travar a tabela inteira)
+BACKFILL_BATCH_SIZE = 2000
+
+# O envelope é montado em Python pelo mesmo extrator da ingestão (MessageEnvelope);
+# por padrão só itens ainda em aberto. Itens concluídos sem envelope continuam
+# funcionando (worker e dashboard caem no payload / chat_logs); use --all para todos.
+SELECT_BATCH_SQL = """
+    SELECT id, created_at, payload
+    FROM request_queue
+    WHERE id >= :start_id AND id < :end_id
+      AND envelope IS NULL
+      {status_filter}
+"""
+
+UPDATE_SQL = text("""
+    UPDATE request_queue
+    SET envelope = CAST(:envelope AS json)
+    WHERE id = :id AND created_at = :created_at
+""")
+
+def run_migration(backfill_all: bool = False):
+    logger.info("Iniciando migração (Sprint 20 - MessageEnvelope em request_queue)...")
+    db = SessionLocal()
+    try:
+        logger.info("Adicionando coluna envelope em request_queue...")
+        db.execute(text("ALTER TABLE request_queue ADD COLUMN IF NOT EXISTS envelope JSON;"))
+        db.commit()
+
+        status_filter = "" if backfill_all else "AND status IN ('pending', 'processing', 'failed')"
+        select_batch = text(SELECT_BATCH_SQL.format(status_filter=status_filter))
+
+        logger.info("Preenchendo envelope a partir do payload (backfill em lotes)...")
+        bounds = db.execute(text("SELECT MIN(id), MAX(id) FROM request_queue")).first()
+        total = 0
+        if bounds and bounds[0] is not None:
+            start_id, max_id = bounds
+            while start_id <= max_id:
+                end_id = start_id + BACKFILL_BATCH_SIZE
+                rows = db.execute(select_batch, {"start_id": start_id, "end_id": end_id}).fetchall()
+                updates = [
+                    {
+                        "id": row.id,
+                        "created_at": row.created_at,
+                        "envelope": json.dumps(MessageEnvelope.from_payload(row.payload).to_dict()),
+                    }
+                    for row in rows
+                ]
+                if updates:
+                    db.execute(UPDATE_SQL, updates)
+                db.commit()
+                total += len(updates)
+                start_id = end_id
+        logger.info(f"{total} item(ns) da fila atualizado(s)")
+
+        logger.info("Migração concluída com sucesso!")
+    except Exception as e:
+        logger.error(f"Erro na migração: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    run_migration(backfill_all="--all" in sys.argv)
@@ -0,0 +1,33 @@
+from app.core.database import SessionLocal
+from sqlalchemy import text
+import logging
+
+# Configuração de Logs
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("MigrationSprint21")
+
+def run_migration():
+    logger.info("Iniciando migração (Sprint 21 - Mensagens agrupadas presas ao item principal)...")
+
+    commands = [
+        "ALTER TABLE request_queue ADD COLUMN IF NOT EXISTS coalesced_into INTEGER;",
+        # Usado pelo reaper para achar agrupadas órfãs (quase sempre vazio)
+        """CREATE INDEX IF NOT EXISTS ix_request_queue_coalesced_into
+           ON request_queue (coalesced_into) WHERE coalesced_into IS NOT NULL;""",
+    ]
+
+    db = SessionLocal()
+    try:
+        for cmd in commands:
+            logger.info(f"Executando: {cmd.splitlines()[0]}")
+            db.execute(text(cmd))
+        db.commit()
+        logger.info("Migração concluída com sucesso!")
+    except Exception as e:
+        logger.error(f"Erro na migração: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    run_migration()
@@ -0,0 +1,63 @@
+from app.core.database import SessionLocal
+from sqlalchemy import text
+import logging
+
+# Configuração de Logs
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("MigrationSprint22")
+
+def run_migration():
+    logger.info("Iniciando migração (Sprint 22 - NOTIFY user_changed em alterações diretas de users)...")
+
+    # Alterações feitas direto no banco (SQL manual, painel do Supabase, outros sistemas)
+    # não passam por notify_user_changed; o trigger emite o mesmo NOTIFY. O cache dos
+    # workers é indexado por telefone, então o payload é o telefone (o antigo também,
+    # se mudou). Só dispara quando muda uma coluna guardada no cache (UserRecord):
+    # incrementos de ai_response_count não geram avisos.
+    commands = [
+        """CREATE OR REPLACE FUNCTION notify_user_changed() RETURNS trigger AS $$
+           BEGIN
+               IF TG_OP = 'DELETE' THEN
+                   PERFORM pg_notify('user_changed', OLD.phone);
+                   RETURN OLD;
+               END IF;
+               IF OLD.phone IS DISTINCT FROM NEW.phone THEN
+                   PERFORM pg_notify('user_changed', OLD.phone);
+               END IF;
+               PERFORM pg_notify('user_changed', NEW.phone);
+               RETURN NEW;
+           END;
+           $$ LANGUAGE plpgsql;""",
+        "DROP TRIGGER IF EXISTS trg_users_notify_changed ON users;",
+        """CREATE TRIGGER trg_users_notify_changed
+           AFTER UPDATE OF phone, name, is_client, is_blocked, is_compliant, is_canceled ON users
+           FOR EACH ROW
+           WHEN (OLD.phone IS DISTINCT FROM NEW.phone
+                 OR OLD.name IS DISTINCT FROM NEW.name
+                 OR OLD.is_client IS DISTINCT FROM NEW.is_client
+                 OR OLD.is_blocked IS DISTINCT FROM NEW.is_blocked
+                 OR OLD.is_compliant IS DISTINCT FROM NEW.is_compliant
+                 OR OLD.is_canceled IS DISTINCT FROM NEW.is_canceled)
+           EXECUTE FUNCTION notify_user_changed();""",
+        "DROP TRIGGER IF EXISTS trg_users_notify_deleted ON users;",
+        """CREATE TRIGGER trg_users_notify_deleted
+           AFTER DELETE ON users
+           FOR EACH ROW
+           EXECUTE FUNCTION notify_user_changed();""",
+    ]
+
+    db = SessionLocal()
+    try:
+        for cmd in commands:
+            logger.info(f"Executando: {cmd.splitlines()[0]}")
+            db.execute(text(cmd))
+        db.commit()
+        logger.info("Migração concluída com sucesso!")
+    except Exception as e:
+        logger.error(f"Erro na migração: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    run_migration()